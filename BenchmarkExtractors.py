@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import argparse
+from CurlScraper import ARMedBoardCurl, ORMedBoardCurl
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+# Saved pages live in <pages_dir>/<site>/<license number or id>.html, with the dict parse_license_page is expected to
+# give for them in <license number or id>.json when there is one
+SITES = {
+    "armed": (ARMedBoardCurl.ARMedBoard, ARMedBoardCurl.parse_license_page),
+    "ormed": (ORMedBoardCurl.ORMedBoard, ORMedBoardCurl.parse_license_page),
+}
+
+# Keys (by prefix) where the single pass parser knowingly differs from the frozen reference, left out of the comparison.
+# ormed Address: the reference collects address rows with findall over the whole page, so rows of other tables shaped
+# like address rows (eg saved_pages/ormed/1001.html) end up as addresses. The single pass parser only reads the rows of
+# the VerificationAddress table
+KNOWN_DIFFERENCES = {
+    "ormed": ("Address",),
+}
+
+
+def save_pages(site, license_numbers, pages_dir):
+    """
+    Downloads license detail pages so the parsers can be benchmarked offline
+    :param site: armed or ormed
+    :param license_numbers: license numbers / ASMB ids (armed) or EntityIDs (ormed)
+    :param pages_dir:
+    :return:
+    """
+    client_class, _ = SITES[site]
+    client = client_class(cookies_dict=None)
+    site_dir = os.path.join(pages_dir, site)
+    os.makedirs(site_dir, exist_ok=True)
+
+    for license_number in license_numbers:
+        if site == "armed":
+            url = client.get_license_page_url(license_number)
+        else:
+            url = f"{client.LICENSE_SEARCH_URL}{license_number}"
+        response = client.get_license_page(url)
+        page = response.get('response', str(response))
+        with open(os.path.join(site_dir, f"{license_number}.html"), 'w', encoding="utf-8") as page_file:
+            page_file.write(page)
+        logger.info(f"INFO: Saved page of {license_number}")
+
+
+def load_pages(site, pages_dir):
+    """
+    :return: list of (license number, html, expected dict or None)
+    """
+    site_dir = os.path.join(pages_dir, site)
+    if not os.path.isdir(site_dir):
+        return []
+    pages = []
+    for file_name in sorted(os.listdir(site_dir)):
+        if file_name.endswith(".html"):
+            license_number = file_name[:-len(".html")]
+            with open(os.path.join(site_dir, file_name), 'r', encoding="utf-8") as page_file:
+                page = page_file.read()
+            expected = None
+            expected_path = os.path.join(site_dir, f"{license_number}.json")
+            if os.path.exists(expected_path):
+                with open(expected_path, 'r', encoding="utf-8") as expected_file:
+                    expected = json.load(expected_file)
+            pages.append((license_number, page, expected))
+    return pages
+
+
+def without_known_differences(site, license_info):
+    """
+    license_info without the keys listed for the site in KNOWN_DIFFERENCES
+    """
+    prefixes = KNOWN_DIFFERENCES.get(site, ())
+    return {key: value for key, value in license_info.items() if not key.startswith(prefixes)}
+
+
+def benchmark_site(site, pages, repeat):
+    """
+    Checks that both parsers give the same dicts (apart from KNOWN_DIFFERENCES) and that the single pass parser gives
+    the expected dicts, then times them over every page
+    :return: dict of results
+    """
+    client_class, parse_license_page = SITES[site]
+    # The regex path is an instance method, but only needs the page. Skip __init__ so no request is sent
+    legacy = client_class.__new__(client_class)
+
+    mismatches = []
+    unexpected = []
+    for license_number, page, expected in pages:
+        license_info = parse_license_page(page, license_number)
+        if without_known_differences(site, legacy.parse_license_page_regex(page, license_number)) != without_known_differences(site, license_info):
+            mismatches.append(license_number)
+        if expected is not None and license_info != expected:
+            unexpected.append(license_number)
+
+    timings = {}
+    for name, parse in (("regex", legacy.parse_license_page_regex), ("single_pass", parse_license_page)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for license_number, page, _ in pages:
+                parse(page, license_number)
+        timings[name] = time.perf_counter() - start
+
+    return {
+        "site": site,
+        "pages": len(pages),
+        "repeat": repeat,
+        "mismatches": mismatches,
+        "ignored_keys": list(KNOWN_DIFFERENCES.get(site, ())),
+        "unexpected": unexpected,
+        "regex_ms_per_page": round(1000 * timings["regex"] / (repeat * len(pages)), 3),
+        "single_pass_ms_per_page": round(1000 * timings["single_pass"] / (repeat * len(pages)), 3),
+        "speedup": round(timings["regex"] / timings["single_pass"], 2) if timings["single_pass"] else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the single pass license page parsers with the old per field regex path on saved pages")
+    parser.add_argument("--pages-dir", default="saved_pages")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--site", choices=list(SITES), action="append", help="Defaults to every site")
+    parser.add_argument("--save", nargs="+", metavar="LICENSE", help="Download these license pages of --site first")
+    args = parser.parse_args()
+
+    sites = args.site or list(SITES)
+    if args.save:
+        for site in sites:
+            save_pages(site, args.save, args.pages_dir)
+
+    failed = False
+    for site in sites:
+        pages = load_pages(site, args.pages_dir)
+        if not pages:
+            logger.info(f"INFO: No saved pages for {site} in {args.pages_dir}. Use --save to download some")
+            continue
+        results = benchmark_site(site, pages, args.repeat)
+        logger.info(f"INFO: {results}")
+        failed = failed or bool(results["mismatches"]) or bool(results["unexpected"])
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,128 @@
+import sys
+import json
+import time
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from SeleniumScraper.SeleniumPageNavigator import get_chrome_driver, SelemiumPageNavigetor
+from SeleniumScraper.WaitStrategy import WaitStrategy
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+# A directory search like the ones the scrapers crawl: pick a license type, search, then page through results that
+# are loaded with fetch after a delay and rendered by script
+FIXTURE_PAGE = """<!DOCTYPE html>
+<html><body>
+<h2>Directory Search</h2>
+<select name="LicenseType"><option value="">Select</option><option value="PA">Physician Assistant</option></select>
+<input type="button" name="DirSearch" value="Search" onclick="search(1)">
+<div id="results"></div>
+<div id="pager"></div>
+<script>
+function search(page) {
+    document.getElementById('results').innerHTML = '<span class="loading">Loading</span>';
+    fetch('/results?page=' + page).then(function (r) { return r.json(); }).then(function (data) {
+        document.getElementById('results').innerHTML = data.rows.map(function (row) {
+            return '<div class="row"><a href="/detail?PHIDNO=' + row + '">' + row + '</a></div>';
+        }).join('');
+        var pager = '';
+        for (var p = 1; p <= data.pages; p++) { pager += '<a class="page" href="javascript:search(' + p + ')">' + p + '</a> '; }
+        document.getElementById('pager').innerHTML = pager;
+    });
+}
+</script>
+</body></html>"""
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    pages = 5
+    rows_per_page = 10
+    response_delay = 0.2
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/results":
+            time.sleep(self.response_delay)
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            rows = [f"ASMB{page * 100 + row}" for row in range(self.rows_per_page)]
+            body = json.dumps({"rows": rows, "pages": self.pages}).encode()
+            content_type = "application/json"
+        else:
+            body = FIXTURE_PAGE.encode()
+            content_type = "text/html"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def crawl(navigator, site_url):
+    """
+    Searches the fixture site and reads every result id, one navigator call per row like the scrapers' id loops
+    :return: list of ids
+    """
+    ids = []
+    navigator.get_page(site_url)
+    navigator.check_page_loaded(page_load_xpath="(//h2[contains(text(),'Directory Search')])")
+    navigator.click_element(xpath="//option[@value='PA']")
+    navigator.click_element(xpath="(//input[contains(@name,'DirSearch') and @value='Search'])")
+    navigator.check_page_loaded(page_load_xpath="(//a[@class='page'])")
+
+    num_pages = navigator.get_number_of_elements(xpath="(//a[@class='page'])", time_delay=0.5)
+    for page in range(1, num_pages + 1):
+        if page != 1:
+            navigator.click_element(xpath=f"(//a[@class='page'])[{page}]")
+        num_results = navigator.get_number_of_elements(xpath="(//div[@class='row']/a)", time_delay=0.5)
+        for idx in range(1, num_results + 1):
+            ids.append(navigator.get_element_text(xpath=f"(//div[@class='row']/a)[{idx}]"))
+    return ids
+
+
+def benchmark(site_url, repeat, headless):
+    """
+    Crawls the fixture site with fixed sleeps, then waiting for the page, and reports the seconds each took
+    :return: dict of results
+    """
+    results = {}
+    for name, fixed_sleeps in (("fixed_sleeps", True), ("page_waits", False)):
+        driver = get_chrome_driver(dataDirName=f"WaitBenchmark_{name}", headless=headless)
+        try:
+            navigator = SelemiumPageNavigetor(driver, wait_strategy=WaitStrategy(fixed_sleeps=fixed_sleeps))
+            start = time.perf_counter()
+            crawled_ids = [crawl(navigator, site_url) for _ in range(repeat)]
+            elapsed = time.perf_counter() - start
+            results[name] = {"seconds_per_crawl": round(elapsed / repeat, 3), "ids_per_crawl": len(crawled_ids[0]),
+                             "same_ids": all(ids == crawled_ids[0] for ids in crawled_ids), "waits": navigator.get_wait_report()}
+        finally:
+            driver.quit()
+
+    results["seconds_saved_per_crawl"] = round(results["fixed_sleeps"]["seconds_per_crawl"] - results["page_waits"]["seconds_per_crawl"], 3)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times a crawl of a local fixture site with the navigator's fixed sleeps and with its page waits")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=5, help="Result pages of the fixture site")
+    parser.add_argument("--response-delay", type=float, default=0.2, help="Seconds the fixture site takes to answer a results request")
+    parser.add_argument("--show-browser", action="store_true")
+    args = parser.parse_args()
+
+    FixtureHandler.pages = args.pages
+    FixtureHandler.response_delay = args.response_delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        results = benchmark(f"http://127.0.0.1:{server.server_address[1]}/search", args.repeat, headless=not args.show_browser)
+    finally:
+        server.shutdown()
+
+    logger.info(f"INFO: {json.dumps(results, indent=2)}")
+    same_ids = results["fixed_sleeps"]["ids_per_crawl"] == results["page_waits"]["ids_per_crawl"]
+    sys.exit(0 if same_ids else 1)
@@ -1,13 +1,89 @@
-import os
 import re
-import json
-import pickle
-from CurlScraper.CoreLibrary.PyCurlRequest import CurlRequests
+import html
+from CurlScraper.CoreLibrary.ProxyPool import ProxyPool
+from CurlScraper.CoreLibrary.SiteClient import SiteClient
+from CurlScraper.CoreLibrary.PageExtractor import PageScanner, LabelRule, FixedRule, ScanResult
+from CurlScraper.CoreLibrary.ParsePipeline import ParsePipeline
+from CurlScraper.CoreLibrary.WebForms import WebForm
 from LoggingModule import set_logging
 
 logger = set_logging()
 
-class ARMedBoard:
+# Extraction spec of the license details page. Compiled once, all the fields come out of one pass over the page
+LICENSE_PAGE_SCANNER = PageScanner([
+    LabelRule(anchor=r'<li>(.+?):\s*<span\s+id="ctl00_MainContentPlaceHolder_lvResults',
+              value=r':\s*<span\s+id="ctl00_MainContentPlaceHolder.+?class="indent">(.+?)<',
+              reject="/span"),
+    FixedRule("Board Minutes", r'"ctl00_MainContentPlaceHolder_lblBoardMinutes">(.+?)</'),
+    FixedRule("Board Orders", r'"ctl00_MainContentPlaceHolder_lblBoardActions">(.+?)</'),
+])
+
+ASMB_ID_REGEX = re.compile(r'PHIDNO=(ASMB\d+)')
+HTML_TAG_REGEX = re.compile(r'<[^>]*>')
+# Page links of the directory results grid are postbacks to the grid with "Page$<number>" as argument
+RESULTS_GRID_TARGET = "ctl00$MainContentPlaceHolder$gvLookup"
+RESULTS_PAGE_REGEX = re.compile(r'Page\$(\d+)')
+
+
+def html_to_text(value):
+    """
+    Text a browser shows for an html fragment: tags dropped, entities unescaped, whitespace collapsed.
+    An empty value (None, eg an empty span) is ""
+    """
+    if value is None:
+        return ""
+    return " ".join(html.unescape(HTML_TAG_REGEX.sub("", value)).split())
+
+
+def parse_license_page(page_html_response, license_number, as_text=False):
+    """
+    Gets the license json from a license details page.
+    The page lists the same fields once per license the person holds. The values are taken from the block of the
+    license whose number was searched for
+    :param page_html_response: html of the page
+    :param license_number: license number or ASMB id searched for
+    :param as_text: Give the values as the browser shows them (see html_to_text), like the element text the selenium
+    scraper read. By default they are the html as it is in the page, like parse_license_page_regex
+    :return: dict
+    """
+    scan = LICENSE_PAGE_SCANNER.scan(page_html_response)
+
+    # A label also picks up the values of the labels ending with it, eg "Name" those of "Last Name"
+    labels = [label for label, _ in scan.labels]
+    values_by_label = {}
+    for label in labels:
+        if label not in values_by_label:
+            values_by_label[label] = [html_to_text(value) if as_text else value for found_label, value in scan.labels
+                                      if found_label.endswith(label) and value is not ScanResult.MISSING]
+
+    license_info = {}
+    group_index = 0
+    for field in labels:
+        field_value_list = values_by_label[field]
+        value = None
+        if field == "License Number":
+            # Index of license_number. This will be the group index of the remaining license information
+            if license_number in field_value_list:
+                group_index = field_value_list.index(license_number)
+                value = field_value_list[group_index]
+            else:
+                logger.info(f"ERROR: Could not extract field value of {field} from page source")
+        elif group_index < len(field_value_list):
+            value = field_value_list[group_index]
+        else:
+            logger.info(f"ERROR: Could not extract field value of {field} from page source")
+        license_info[field] = value
+
+    for key in ("Board Minutes", "Board Orders"):
+        if key in scan.fixed:
+            license_info[key] = html_to_text(scan.fixed[key]) if as_text else scan.fixed[key]
+        else:
+            logger.info(f"ERROR: Could not extract {key} using this regex")
+
+    return license_info
+
+
+class ARMedBoard(SiteClient):
     """
     Method for transferring data via curl to the AR Med Board site
     """
@@ -15,14 +91,19 @@ class ARMedBoard:
     MAIN_PAGE = "http://www.armedicalboard.org/Default.aspx"
     LICENSE_SEARCH_URL = "http://www.armedicalboard.org/Public/verify/lookup.aspx?LicNum="
     ASMB_ID_SEARCH_URL = "http://www.armedicalboard.org/Public/verify/results.aspx?strPHIDNO="
+    DIRECTORY_SEARCH_PAGE = "http://www.armedicalboard.org/public/directory/AdvancedDirectorySearch.aspx"
 
     def __init__(self, cookies_dict=None, curl_proxy=None):
         if not cookies_dict:
             self.cookies_dict = {}
         else:
             self.cookies_dict = cookies_dict
-        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER
+        if isinstance(curl_proxy, (list, tuple)):
+            curl_proxy = ProxyPool(curl_proxy, sticky=self.STICKY_PROXY)
+        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER, a list of them or a ProxyPool shared with other instances
         self.username = self.SITE_NAME
+        self.requester = None
+        self.session = self.get_session()
 
         self.set_cookies_dict()
 
@@ -31,16 +112,9 @@ class ARMedBoard:
         Loads cookies from disk if available, for sending requests
         :return:
         """
-        logger.info(f"INFO: LOADING COOKIE FROM DISK")
-        cookie = None
-        if os.path.exists(f'{self.username}.cookie'):
-            logger.info(f"\nINFO: Cookie present on disk! Loading into program.")
-            with open(f'{self.username}.cookie', 'rb') as cookie_store:
-                cookie = pickle.load(cookie_store)
-                if cookie:
-                    logger.info("INFO: Cookie loaded from disk")
-                    self.cookies_dict = cookie
-
+        cookie = self.session.load()
+        if cookie:
+            self.cookies_dict = cookie
         return cookie
 
     def save_cookie_to_disk(self, cookies_dict):
@@ -49,38 +123,21 @@ class ARMedBoard:
         :param cookies_dict:
         :return:
         """
-        logger.info(f"\nINFO: SAVING COOKIES TO DISK")
-        with open(f'{self.username}.cookie', 'wb') as cookie_store:
-            pickle.dump(cookies_dict, cookie_store)
-            logger.info("INFO: Cookie saved")
+        self.session.update(cookies_dict)
+        self.session.flush()
 
     def set_cookies_dict(self, curl_proxy=None):
         """
-        Check if cookies are stored on local machine before trying to get a new one
+        Gets the session cookies. The site is only asked for new ones when the stored cookies are missing or about to expire
         :return:
         """
-        logger.info(f"\nINFO: SETTING COOKIES FOR SESSION")
         if curl_proxy:
             proxy = curl_proxy
         else:
             proxy = self.curl_proxy
 
-        if self.cookies_dict:
-            logger.info(f"INFO: Cookies passed in to init. Will merge with ones from disk or new ones from site")
-
-        cookie_dict_from_disk = self.load_cookie_from_disk()
-        if cookie_dict_from_disk:
-            # Merge cookies from disk to the ones passed
-            logger.info(f"INFO: Merging cookies from disk to new cookies")
-            cookie_dict_from_disk.update(self.cookies_dict)
-            self.cookies_dict = cookie_dict_from_disk
-            logger.info(f"\nINFO: Cookies found from disk + merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-
-        # This process will get cookies from site and add in the new values to the self.cookies dict from init (which may be empty or contain some key-value pairs)
-        headers_dict = self.get_site_request_headers()
-        curl = CurlRequests(cookies_dict=self.cookies_dict, headers_dict=headers_dict)
-        response = curl.send_curl_request(request_url=self.MAIN_PAGE, page_redirects=True, include=True, proxy=proxy)
-        self.add_cookies_from_site_response(response)
+        self.session.add_caller_cookies(self.cookies_dict)
+        self.cookies_dict = self.session.ensure_warm(self.get_requester(), proxy)
 
         return
 
@@ -90,33 +147,8 @@ class ARMedBoard:
         :param response:
         :return:
         """
-        logger.info(f"\nINFO: ADDING COOKIES FROM SITE RESPONSE")
-        cookie_regex = re.compile(r'Set-Cookie:\s(.*?=.*?);', flags=re.IGNORECASE)
-        cookies_list = cookie_regex.findall(str(response))
-
-        logger.info(f"INFO: Found cookies to add {cookies_list}")
-
-        cookie_dict_regex = re.compile(r'(.*?)=(.*)')
-        for cookie in cookies_list:
-            try:
-                name = cookie_dict_regex.search(cookie).group(1).strip()
-                logger.info(f"INFO: Found cookie: {name}")
-            except:
-                logger.info(f"ERROR Extracting cookie name")
-                name = None
-
-            try:
-                value = cookie_dict_regex.search(cookie).group(2).strip()
-                logger.info(f"INFO: Found value of cookie {name}: {value}")
-            except:
-                logger.info(f"ERROR Extracting cookie value")
-                value = None
-
-            if name not in self.cookies_dict.keys():
-                self.cookies_dict[name] = value
-
-        logger.info(f"\nINFO: Cookies found from site response+ merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-        self.save_cookie_to_disk(self.cookies_dict)
+        self.session.add_cookies_from_response(response)
+        self.cookies_dict = self.session.cookies()
 
     def get_site_request_headers(self):
         """
@@ -147,13 +179,22 @@ class ARMedBoard:
         else:
             proxy = self.curl_proxy
 
-        headers_dict = self.get_site_request_headers()
-
-        requester = CurlRequests(self.cookies_dict, headers_dict=headers_dict)
-        response = requester.send_curl_request(license_page_url, proxy=proxy, page_redirects=True)
+        requester = self.get_requester()
+        response = self.session.send(requester, license_page_url, proxy=proxy, page_redirects=True)
 
         return response
 
+    def get_license_page_url(self, license_number):
+        """
+        :param license_number: license number or ASMB id
+        :return: url of the license details page
+        """
+        # Do check to see if license number supplied is an actual license number or an ASMB id
+        # Determine query url based on that
+        if "ASMB" in license_number:
+            return f"{self.ASMB_ID_SEARCH_URL}{license_number}"
+        return f"{self.LICENSE_SEARCH_URL}{license_number}"
+
     def get_license_info(self, license_number, curl_proxy=None):
         """
         Gets the page response and then gets the license json from page response
@@ -162,12 +203,7 @@ class ARMedBoard:
         :return:
         """
 
-        # Do check to see if license number supplied is an actual license number or an ASMB id
-        # Determine query url based on that
-        if "ASMB" in license_number:
-            license_page_url = f"{self.ASMB_ID_SEARCH_URL}{license_number}"
-        else:
-            license_page_url = f"{self.LICENSE_SEARCH_URL}{license_number}"
+        license_page_url = self.get_license_page_url(license_number)
 
         logger.info(f"\nINFO: GETTING LICENSE INFO")
         if curl_proxy:
@@ -175,11 +211,120 @@ class ARMedBoard:
         else:
             proxy = self.curl_proxy
 
-        license_info = {}
-
         page_html_response = self.get_license_page(license_page_url, proxy)
         page_html_response = page_html_response.get('response', str(page_html_response))
 
+        return parse_license_page(page_html_response, license_number)
+
+    def get_license_info_many(self, license_numbers, curl_proxy=None, max_in_flight=10, parse_pipeline=None):
+        """
+        Gets the license json of many licenses. Pages are fetched concurrently and parsed in worker processes while
+        the next ones are being fetched
+        :param license_numbers: iterable of license numbers or ASMB ids
+        :param curl_proxy:
+        :param max_in_flight: Pages being fetched at the same time
+        :param parse_pipeline: ParsePipeline for parse_license_page to reuse across calls. One is started (and shut down) for this call otherwise
+        :return: Generator of (license number, license info) tuples, in completion order
+        """
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        requester = self.get_requester()
+        requester.cookies_dict = self.session.ensure_warm(requester, proxy)
+        request_specs = ((license_number, {"request_url": self.get_license_page_url(license_number), "page_redirects": True,
+                                           "proxy": proxy, "verbose": False})
+                         for license_number in license_numbers)
+
+        def fetched_pages():
+            for license_number, response in requester.send_many(request_specs, max_in_flight=max_in_flight):
+                self.session.add_cookies_from_response(response)
+                yield license_number, response.get('response', str(response))
+
+        pipeline = parse_pipeline or ParsePipeline(parse_license_page)
+        try:
+            yield from pipeline.parse_pages(fetched_pages())
+        finally:
+            if parse_pipeline is None:
+                pipeline.shutdown()
+
+    def post_form(self, form, form_data, proxy=None):
+        """
+        Sends a WebForms postback
+        :param form: WebForm of the page the postback is made from
+        :param form_data: body from form.submit or form.postback
+        :return: (html of the resulting page, its url)
+        """
+        requester = self.get_requester()
+        # The body makes it a POST. No forced method, so curl follows the 302 after the postback with a GET (-X POST would post again)
+        response = self.session.send(requester, form.action, proxy=proxy, page_redirects=True, form_data=form_data, verbose=False)
+        return response.get('response', str(response)), form.action
+
+    def get_all_license_ids(self, license_type, curl_proxy=None, page_limit=None):
+        """
+        Gets all ASMB Ids of a license type from the directory search, without a browser.
+        Replays what the browser does: submits the search form, then posts the grid's page links (Page$2, Page$3, ...)
+        with the __VIEWSTATE/__EVENTVALIDATION of the page before. The ids are read from each page's html in one pass
+        :param license_type: value of the license type drop down, eg "PA"
+        :param curl_proxy:
+        :param page_limit: Stop after this many result pages
+        :return: list of ASMB ids
+        """
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        requester = self.get_requester()
+        response = self.session.send(requester, self.DIRECTORY_SEARCH_PAGE, proxy=proxy, page_redirects=True)
+        page = response.get('response', str(response))
+
+        form = WebForm(page, self.DIRECTORY_SEARCH_PAGE)
+        if form.select(license_type) is None:
+            logger.info(f"ERROR: License type {license_type} is not an option of the directory search")
+            return []
+        search_button = form.find_button("DirSearch", "Search")
+        if search_button is None:
+            logger.info(f"ERROR: Could not find the search button of the directory search")
+            return []
+
+        page, page_url = self.post_form(form, form.submit(search_button), proxy)
+
+        asmb_id_list = []
+        seen = set()
+        page_number = 1
+        while True:
+            for asmb_id in ASMB_ID_REGEX.findall(page):
+                if asmb_id not in seen:
+                    seen.add(asmb_id)
+                    asmb_id_list.append(asmb_id)
+            logger.info(f"INFO: Number of results found after scraping current page (page {page_number}) {len(asmb_id_list)}")
+
+            if page_limit and page_number >= page_limit:
+                break
+            # The grid only links the pages around the current one (and "..." to the next set). Stop when there is no next one
+            next_page = page_number + 1
+            if str(next_page) not in RESULTS_PAGE_REGEX.findall(page):
+                break
+
+            form = WebForm(page, page_url)
+            page, page_url = self.post_form(form, form.postback(RESULTS_GRID_TARGET, f"Page${next_page}"), proxy)
+            page_number = next_page
+
+        logger.info(f"INFO: Found {len(asmb_id_list)} ASMB ids of type {license_type}")
+        return asmb_id_list
+
+    def parse_license_page_regex(self, page_html_response, license_number):
+        """
+        Gets the license json from the page with one regex per field, each run over the whole page.
+        Superseded by parse_license_page, kept as the reference it is checked and benchmarked against (see BenchmarkExtractors.py)
+        :param page_html_response:
+        :param license_number:
+        :return:
+        """
+        license_info = {}
+
         field_names_regex = re.compile(r'<li>(.+?):\s*<span\s+id="ctl00_MainContentPlaceHolder_lvResults')
         field_list = field_names_regex.findall(page_html_response)
         group_index = 0
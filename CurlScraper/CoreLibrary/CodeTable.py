@@ -0,0 +1,138 @@
+import os
+import time
+from CurlScraper.CoreLibrary.JsonStore import JsonStore
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+CODE_TABLE_DIR = ".scraper_cache/code_tables"
+# Bump when the stored layout changes. Files of another version are ignored and filled again
+CODE_TABLE_VERSION = 1
+
+
+def normalize_name(name):
+    """
+    Names are matched ignoring case and repeated spaces, eg "State Board of  pharmacy" finds "State Board of Pharmacy"
+    """
+    return " ".join(str(name).split()).lower()
+
+
+class CodeTable(JsonStore):
+    """
+    Names to ids of a site's two level search drop downs, eg the PALS boards/commissions (professionID) and the license
+    types of each board (licenseTypeId). Filled in one go by a bulk fetch (a browser pass over every board), stored as
+    versioned JSON in .scraper_cache/code_tables/<site>.json and looked up from memory afterwards.
+    Filled again when it is older than ttl, or on a name it does not know (at most once per process, so an unknown
+    name does not start a fetch on every lookup)
+    """
+    DESCRIPTION = "code table"
+    VERSION = CODE_TABLE_VERSION
+
+    def __init__(self, path, ttl=30 * 24 * 3600):
+        """
+        :param path: JSON file
+        :param ttl: Seconds after which the table is filled again
+        """
+        super().__init__(path)
+        self.ttl = ttl
+        self.fetched_at = None
+        self._groups = {}
+        self._refreshed = False
+        self.load()
+
+    @classmethod
+    def for_site(cls, site_name, **kwargs):
+        """
+        Table shared by everything in the process that resolves the site's codes
+        :return: CodeTable
+        """
+        return cls.shared(site_name, os.path.join(CODE_TABLE_DIR, f"{site_name}.json"), **kwargs)
+
+    def load(self):
+        """
+        Loads the JSON file if there is one of the current version
+        :return: True when the table was loaded
+        """
+        stored = self.read_file()
+        if stored is None:
+            return False
+
+        with self._lock:
+            self.fetched_at = stored.get("fetched_at")
+            self._groups = stored.get("groups", {})
+        return True
+
+    def save(self):
+        self.write_file({"fetched_at": self.fetched_at, "groups": self._groups}, indent=2)
+
+    def is_stale(self):
+        return self.fetched_at is None or time.time() - self.fetched_at > self.ttl
+
+    def replace(self, groups):
+        """
+        Replaces the whole table with the result of a bulk fetch and saves it
+        :param groups: {group name: {"id": group id, "items": {item name: item id}}}, eg {"State Board of Pharmacy": {"id": "1", "items": {"Pharmacist": "5"}}}.
+        "items" is None for a group whose items could not be read. The table is then only used by this process and not
+        saved, so the next process fills it again
+        :return:
+        """
+        normalized = {}
+        incomplete = []
+        for group_name, group in groups.items():
+            items = group.get("items", {})
+            if items is None:
+                incomplete.append(group_name)
+                items = {}
+            normalized[normalize_name(group_name)] = {
+                "name": group_name,
+                "id": group["id"],
+                "items": {normalize_name(item_name): {"name": item_name, "id": item_id} for item_name, item_id in items.items()}
+            }
+        with self._lock:
+            self._groups = normalized
+            self.fetched_at = time.time()
+        if incomplete:
+            logger.info(f"ERROR: Items of {incomplete} could not be read. Code table {self.path} is not saved")
+            return
+        self.save()
+        logger.info(f"INFO: Code table {self.path} filled with {len(normalized)} groups")
+
+    def lookup(self, group_name, item_name):
+        """
+        :return: (group id, item id), or None when either name is not in the table
+        """
+        with self._lock:
+            group = self._groups.get(normalize_name(group_name))
+            if group is None:
+                return None
+            item = group["items"].get(normalize_name(item_name))
+            if item is None:
+                return None
+            return group["id"], item["id"]
+
+    def resolve(self, group_name, item_name, fetch):
+        """
+        Looks the names up, filling the table first when it is stale or does not know them
+        :param fetch: Function returning the whole table (see replace). Only called when needed
+        :return: (group id, item id), or None when the names are not on the site
+        """
+        with self._lock:
+            codes = None if self.is_stale() else self.lookup(group_name, item_name)
+            if codes is not None:
+                return codes
+            if not self.is_stale() and self._refreshed:
+                logger.info(f"ERROR: {group_name} / {item_name} not found in code table {self.path}")
+                return None
+
+            logger.info(f"INFO: Filling code table {self.path}")
+            groups = fetch()
+            self._refreshed = True
+            if groups:
+                self.replace(groups)
+            else:
+                logger.info(f"ERROR: Bulk fetch for code table {self.path} returned nothing. Keeping the stored table")
+
+            codes = self.lookup(group_name, item_name)
+            if codes is None:
+                logger.info(f"ERROR: {group_name} / {item_name} not found in code table {self.path}")
+            return codes
@@ -0,0 +1,183 @@
+import os
+import re
+import time
+from email.utils import parsedate_to_datetime
+from CurlScraper.CoreLibrary.JsonStore import JsonStore
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+COOKIE_DIR = ".scraper_cache/cookies"
+SET_COOKIE_REGEX = re.compile(r'^Set-Cookie:\s*(.+?)\s*$', flags=re.IGNORECASE | re.MULTILINE)
+
+
+class CookieStore(JsonStore):
+    """
+    Cookie jar for one site that keeps what Set-Cookie said about each cookie (expiry, domain, path, flags).
+    Newer values always replace older ones, expired cookies are dropped, and the jar can tell whether it is still
+    good enough to skip the warm-up request. Stored as JSON in .scraper_cache/cookies/<site>.json, written atomically.
+    Shared by the curl site classes (through SiteSession) and the selenium scrapers, so cookies from the browser feed curl
+    """
+    DESCRIPTION = "cookie file"
+
+    def __init__(self, path, session_cookie_ttl=20 * 60, expiry_margin=60):
+        """
+        :param path: JSON file
+        :param session_cookie_ttl: Seconds a cookie without Expires/Max-Age is trusted after it was set
+        :param expiry_margin: Cookies expiring within this many seconds already count as expired
+        """
+        super().__init__(path)
+        self.session_cookie_ttl = session_cookie_ttl
+        self.expiry_margin = expiry_margin
+        self._cookies = {}
+        self.load()
+
+    @classmethod
+    def for_site(cls, site_name, **kwargs):
+        """
+        Store shared by everything in the process that talks to the site
+        :return: CookieStore
+        """
+        return cls.shared(site_name, os.path.join(COOKIE_DIR, f"{site_name}.json"), **kwargs)
+
+    def _expires_at(self, cookie):
+        if cookie["expires"] is not None:
+            return cookie["expires"]
+        return cookie["set_at"] + self.session_cookie_ttl
+
+    def set(self, name, value, expires=None, domain=None, path="/", secure=False, httponly=False):
+        """
+        Adds or replaces a cookie
+        :param expires: Epoch seconds, None for a session cookie
+        """
+        with self._lock:
+            self._cookies[name] = {
+                "value": value,
+                "expires": expires,
+                "domain": domain,
+                "path": path,
+                "secure": secure,
+                "httponly": httponly,
+                "set_at": time.time()
+            }
+
+    def update(self, cookies_dict):
+        """
+        Adds plain name/value cookies, eg the ones passed to a client constructor
+        """
+        for name, value in cookies_dict.items():
+            self.set(name, value)
+
+    def set_from_header(self, set_cookie):
+        """
+        Applies one Set-Cookie header value. A Max-Age of 0 or an Expires in the past deletes the cookie
+        :param set_cookie: eg "sid=abc; Path=/; Max-Age=3600; HttpOnly"
+        :return: cookie name
+        """
+        parts = set_cookie.split(";")
+        name, _, value = parts[0].partition("=")
+        name = name.strip()
+        if not name:
+            return None
+
+        attributes = {"path": "/", "domain": None, "secure": False, "httponly": False}
+        expires = None
+        max_age = None
+        for part in parts[1:]:
+            key, _, attribute_value = part.partition("=")
+            key = key.strip().lower()
+            attribute_value = attribute_value.strip()
+            if key == "max-age":
+                try:
+                    max_age = int(attribute_value)
+                except ValueError:
+                    pass
+            elif key == "expires":
+                try:
+                    expires = parsedate_to_datetime(attribute_value).timestamp()
+                except (TypeError, ValueError):
+                    pass
+            elif key in ("domain", "path"):
+                attributes[key] = attribute_value
+            elif key in ("secure", "httponly"):
+                attributes[key] = True
+
+        # Max-Age wins over Expires
+        if max_age is not None:
+            expires = time.time() + max_age
+
+        if expires is not None and expires <= time.time():
+            with self._lock:
+                self._cookies.pop(name, None)
+            return name
+
+        self.set(name, value.strip(), expires=expires, **attributes)
+        return name
+
+    def add_from_response(self, response):
+        """
+        Applies every Set-Cookie of a response, including the ones sent with redirects
+        :param response: CurlResponse, or anything whose str() holds the header lines
+        :return: list of cookie names set
+        """
+        header_blocks = getattr(response, "header_blocks", None)
+        if header_blocks:
+            header_text = b"".join(header_blocks).decode("latin-1")
+        else:
+            header_text = str(response)
+        return [self.set_from_header(set_cookie) for set_cookie in SET_COOKIE_REGEX.findall(header_text.replace("\r\n", "\n"))]
+
+    def add_browser_cookies(self, browser_cookies):
+        """
+        Adds cookies read from selenium (driver.get_cookies()), keeping their expiry and flags
+        :param browser_cookies: list of dicts with name, value and optionally expiry, domain, path, secure, httpOnly
+        :return:
+        """
+        for cookie in browser_cookies:
+            self.set(cookie["name"], cookie["value"], expires=cookie.get("expiry"), domain=cookie.get("domain"),
+                     path=cookie.get("path", "/"), secure=cookie.get("secure", False), httponly=cookie.get("httpOnly", False))
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for name in [name for name, cookie in self._cookies.items() if self._expires_at(cookie) <= now]:
+                del self._cookies[name]
+
+    def as_dict(self):
+        """
+        Name/value pairs of the cookies that have not expired, for sending with a request
+        :return: dict
+        """
+        self.purge_expired()
+        with self._lock:
+            return {name: cookie["value"] for name, cookie in self._cookies.items()}
+
+    def is_valid(self):
+        """
+        True when the jar holds cookies and none of them is about to expire, so the warm-up request can be skipped
+        """
+        deadline = time.time() + self.expiry_margin
+        with self._lock:
+            return bool(self._cookies) and all(self._expires_at(cookie) > deadline for cookie in self._cookies.values())
+
+    def clear(self):
+        with self._lock:
+            self._cookies = {}
+
+    def load(self):
+        """
+        Loads the JSON file if there is one. Expired cookies are left out
+        :return: True when cookies were loaded
+        """
+        cookies = self.read_file()
+        if cookies is None:
+            return False
+
+        with self._lock:
+            self._cookies.update(cookies)
+        self.purge_expired()
+        logger.info(f"INFO: Loaded {len(self._cookies)} cookies from {self.path}")
+        return bool(self._cookies)
+
+    def save(self):
+        self.write_file(self._cookies)
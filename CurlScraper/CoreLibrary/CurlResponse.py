@@ -0,0 +1,302 @@
+import json
+import zlib
+from LoggingModule import set_logging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = set_logging()
+
+# Encodings offered to servers when compression is negotiated. br only when the brotli module is available to decode it
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+
+def decode_content(body, content_encoding):
+    """
+    Decompresses a body according to its Content-Encoding header. Unknown encodings are returned untouched
+    :param body: raw body bytes
+    :param content_encoding: value of the Content-Encoding header (may list several codings)
+    :return: decoded bytes
+    """
+    # Codings are listed in the order they were applied, so undo them in reverse
+    for coding in reversed([coding.strip().lower() for coding in content_encoding.split(",") if coding.strip()]):
+        if coding in ("gzip", "x-gzip"):
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif coding == "deflate":
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                # Some servers send raw deflate without the zlib header
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        elif coding == "br" and brotli:
+            body = brotli.decompress(body)
+        elif coding != "identity":
+            logger.info(f"ERROR: Unsupported content encoding {coding}. Returning body as is")
+            break
+    return body
+
+
+class CurlResponse(dict):
+    """
+    Response returned by CurlRequests.send_curl_request.
+    Knows its status, headers and content type. Only decompresses when Content-Encoding says so.
+    Still behaves like the dict send_curl_request always returned: the JSON body when the server sent a JSON object,
+    otherwise {"response": text}. The dict content is built on first access, so callers that only need .text or
+    .status never pay for json.loads over a large html page
+    """
+
+    def __init__(self, header_blocks=None, body=b'', include=False, content_decoded=False):
+        """
+        :param header_blocks: raw header blocks (bytes) in the order received. More than one when redirects were followed
+        :param body: body bytes of the final response
+        :param include: Put the header blocks in front of the text in the "response" key, like curl -i
+        :param content_decoded: True when the transport already undid the Content-Encoding (curl --compressed)
+        """
+        super().__init__()
+        self.header_blocks = header_blocks if header_blocks else []
+        self.include = include
+        self.status = None
+        self.reason = ""
+        self.header_list = []
+        self.headers = {}
+        # Set by RetryPolicy: attempts it took and seconds spent over all of them
+        self.attempts = 1
+        self.latency = None
+        # "connect" when the transport failed before the request reached the server, "transfer" when it failed afterwards
+        self.error_phase = None
+        self._parse_final_header_block()
+
+        content_encoding = self.headers.get("content-encoding")
+        if content_encoding and not content_decoded and body:
+            try:
+                body = decode_content(body, content_encoding)
+            except Exception as e:
+                logger.info(f"ERROR: Could not decode {content_encoding} body. DETAILS {e}")
+        self.body = body
+
+        self._text = None
+        self._materialized = False
+
+    def _parse_final_header_block(self):
+        if not self.header_blocks:
+            return
+
+        lines = self.header_blocks[-1].decode("latin-1").splitlines()
+        status_line = lines[0].split(" ", 2)
+        try:
+            self.status = int(status_line[1])
+            self.reason = status_line[2] if len(status_line) > 2 else ""
+        except (IndexError, ValueError):
+            logger.info(f"ERROR: Could not read status line {lines[0]}")
+
+        for line in lines[1:]:
+            if ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            self.header_list.append((key.strip(), value.strip()))
+            self.headers[key.strip().lower()] = value.strip()
+
+    @property
+    def content_type(self):
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    @property
+    def charset(self):
+        for param in self.headers.get("content-type", "").split(";")[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "charset" and value:
+                return value.strip().strip('"')
+        return "utf-8"
+
+    @property
+    def header_text(self):
+        """
+        Header blocks as curl -i prints them
+        """
+        return b"".join(self.header_blocks).decode("latin-1")
+
+    @property
+    def text(self):
+        """
+        Decoded body text, without the header blocks
+        """
+        if self._text is None:
+            try:
+                self._text = self.body.decode(self.charset, errors="replace")
+            except LookupError:
+                self._text = self.body.decode("utf-8", errors="replace")
+        return self._text
+
+    def is_json(self):
+        """
+        Decides from the content type (and the first character of the body for servers that send JSON as text) whether the body should be parsed as JSON
+        """
+        if self.include:
+            return False
+        if "json" in self.content_type:
+            return True
+        if self.content_type in ("", "text/plain", "text/javascript", "application/javascript"):
+            return self.text.lstrip()[:1] in ("{", "[")
+        return False
+
+    def json(self):
+        """
+        Parses the body as JSON
+        :return: loaded JSON, or None when the body is not valid JSON
+        """
+        try:
+            return json.loads(self.text)
+        except ValueError as e:
+            logger.info(f"ERROR: Could not apply JSON loads to response. DETAILS: {e}")
+            return None
+
+    def _materialize(self):
+        """
+        Fills the dict content the first time it is accessed
+        """
+        if self._materialized:
+            return
+        self._materialized = True
+
+        loaded = self.json() if self.is_json() else None
+        if isinstance(loaded, dict):
+            super().update(loaded)
+        elif self.body or self.header_blocks:
+            if self.include:
+                super().__setitem__("response", self.header_text + self.text)
+            else:
+                super().__setitem__("response", self.text)
+
+    def __getitem__(self, key):
+        self._materialize()
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._materialize()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._materialize()
+        super().__delitem__(key)
+
+    def __contains__(self, key):
+        self._materialize()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._materialize()
+        return super().__iter__()
+
+    def __len__(self):
+        self._materialize()
+        return super().__len__()
+
+    def __eq__(self, other):
+        self._materialize()
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._materialize()
+        return super().__repr__()
+
+    __str__ = __repr__
+
+    def get(self, key, default=None):
+        self._materialize()
+        return super().get(key, default)
+
+    def keys(self):
+        self._materialize()
+        return super().keys()
+
+    def values(self):
+        self._materialize()
+        return super().values()
+
+    def items(self):
+        self._materialize()
+        return super().items()
+
+    def pop(self, key, *default):
+        self._materialize()
+        return super().pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        self._materialize()
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._materialize()
+        super().update(*args, **kwargs)
+
+    def copy(self):
+        self._materialize()
+        return dict(self)
+
+
+class CurlListResponse(list):
+    """
+    Returned instead of CurlResponse when the server sends a JSON array (eg the PALS search API),
+    since callers iterate over those responses directly. Carries the same status/headers attributes
+    """
+
+    def __init__(self, loaded_list, curl_response):
+        super().__init__(loaded_list)
+        self.status = curl_response.status
+        self.reason = curl_response.reason
+        self.headers = curl_response.headers
+        self.header_list = curl_response.header_list
+        self.header_blocks = curl_response.header_blocks
+        self.body = curl_response.body
+        self.content_type = curl_response.content_type
+        self.text = curl_response.text
+        self.attempts = curl_response.attempts
+        self.latency = curl_response.latency
+        self.error_phase = curl_response.error_phase
+
+    def get(self, key, default=None):
+        # Callers that expect a dict (eg .get("response")) get the default instead of an AttributeError
+        return default
+
+
+def finalize_response(curl_response):
+    """
+    Returns the object send_curl_request hands to callers.
+    JSON arrays become a CurlListResponse, everything else stays a lazy CurlResponse
+    :param curl_response:
+    :return:
+    """
+    if curl_response.is_json() and curl_response.text.lstrip()[:1] == "[":
+        loaded = curl_response.json()
+        if isinstance(loaded, list):
+            return CurlListResponse(loaded, curl_response)
+    return curl_response
+
+
+def split_header_blocks(raw_output):
+    """
+    Splits the output of curl -i into its header blocks and the body.
+    There is one block per response received (redirects, 100 Continue, proxy CONNECT)
+    :param raw_output: bytes printed by curl
+    :return: (list of header block bytes, body bytes)
+    """
+    header_blocks = []
+    while raw_output.startswith(b"HTTP/"):
+        end = raw_output.find(b"\r\n\r\n")
+        separator_length = 4
+        if end == -1:
+            end = raw_output.find(b"\n\n")
+            separator_length = 2
+        if end == -1:
+            header_blocks.append(raw_output)
+            return header_blocks, b''
+        header_blocks.append(raw_output[:end + separator_length])
+        raw_output = raw_output[end + separator_length:]
+    return header_blocks, raw_output
@@ -0,0 +1,159 @@
+import os
+import re
+import time
+import threading
+from CurlScraper.CoreLibrary.JsonStore import JsonStore
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+ID_INDEX_DIR = ".scraper_cache/id_indexes"
+# Bump when the stored layout changes. Files of another version are ignored and enumerated again
+ID_INDEX_VERSION = 1
+
+
+class IdIndex(JsonStore):
+    """
+    The license ids of one license type of a site, as found by its get_all_license_ids, kept on disk between runs in
+    .scraper_cache/id_indexes/<site>/<license type>.json with the time each id was first and last seen.
+    A run reuses the stored ids while the index is younger than ttl. Once it is stale the ids are enumerated again and
+    merged in: new ids are added, ids the enumeration no longer returns are removed, the rest keep their first seen time.
+    The enumeration can run on a background thread while the run goes on with the stored ids
+    """
+    DESCRIPTION = "id index"
+    VERSION = ID_INDEX_VERSION
+
+    def __init__(self, path, ttl=24 * 3600):
+        """
+        :param path: JSON file
+        :param ttl: Seconds the stored ids are used for before they are enumerated again
+        """
+        super().__init__(path)
+        self.ttl = ttl
+        self.refreshed_at = None
+        self._entries = {}  # id: {"first_seen": ..., "last_seen": ...}, in the order the ids were first found
+        self._refresh_thread = None
+        self.load()
+
+    @classmethod
+    def for_site(cls, site_name, license_type, **kwargs):
+        """
+        Index shared by everything in the process that enumerates the site's licenses of license_type
+        :return: IdIndex
+        """
+        file_name = re.sub(r'[^\w.-]+', '_', str(license_type)).strip('_') or "all"
+        return cls.shared((site_name, license_type), os.path.join(ID_INDEX_DIR, site_name, f"{file_name}.json"), **kwargs)
+
+    def load(self):
+        """
+        Loads the JSON file if there is one of the current version
+        :return: True when the index was loaded
+        """
+        stored = self.read_file()
+        if stored is None:
+            return False
+
+        with self._lock:
+            self.refreshed_at = stored.get("refreshed_at")
+            self._entries = stored.get("ids", {})
+        return True
+
+    def save(self):
+        self.write_file({"refreshed_at": self.refreshed_at, "ids": self._entries})
+
+    def is_stale(self):
+        return self.refreshed_at is None or time.time() - self.refreshed_at > self.ttl
+
+    def ids(self):
+        """
+        :return: list of the stored ids, in the order they were first found
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def last_seen(self, license_id):
+        """
+        :return: time license_id was last returned by an enumeration, None when it is not in the index
+        """
+        with self._lock:
+            entry = self._entries.get(str(license_id))
+            return entry["last_seen"] if entry else None
+
+    def merge(self, license_ids):
+        """
+        Merges the result of a full enumeration into the index and saves it
+        :param license_ids: every id the site returns now
+        :return: (added, removed) lists of ids
+        """
+        now = time.time()
+        seen = list(dict.fromkeys(str(license_id) for license_id in license_ids))
+        seen_set = set(seen)
+        with self._lock:
+            # Ids already known keep their place and first seen time, new ones go at the end
+            entries = {license_id: dict(entry, last_seen=now) for license_id, entry in self._entries.items() if license_id in seen_set}
+            added = [license_id for license_id in seen if license_id not in entries]
+            for license_id in added:
+                entries[license_id] = {"first_seen": now, "last_seen": now}
+            removed = [license_id for license_id in self._entries if license_id not in entries]
+            self._entries = entries
+            self.refreshed_at = now
+        self.save()
+        logger.info(f"INFO: Id index {self.path}: {len(seen)} ids, {len(added)} new, {len(removed)} removed")
+        return added, removed
+
+    def refresh(self, enumerate_ids):
+        """
+        Enumerates the ids again and merges them in. An empty enumeration is taken as a failed one and leaves the index as it is
+        :param enumerate_ids: Function returning every id of the license type, eg lambda: client.get_all_license_ids(license_type)
+        :return: (added, removed) lists of ids, None when the enumeration failed
+        """
+        try:
+            license_ids = enumerate_ids()
+        except Exception as e:
+            logger.info(f"ERROR: Could not enumerate the ids of {self.path}. DETAILS: {e}")
+            return None
+        if not license_ids:
+            logger.info(f"ERROR: Enumeration for id index {self.path} returned nothing. Keeping the stored ids")
+            return None
+        return self.merge(license_ids)
+
+    def refresh_in_background(self, enumerate_ids, block_exit=True):
+        """
+        Starts refresh on a thread, unless one is already running.
+        The refresh is a full enumeration, which can take minutes for a large license type. With block_exit the thread
+        is not a daemon: the process does not exit before the enumeration is done and the index saved, even when the
+        run itself is finished. Without it the process exits straight away and an unfinished refresh is dropped (the
+        file is written atomically, so the stored index stays as it was and the next run enumerates again)
+        :param block_exit: Let the process wait for the refresh at exit
+        :return: the refresh thread
+        """
+        with self._lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(target=self.refresh, args=(enumerate_ids,), name=f"IdIndexRefresh-{os.path.basename(self.path)}",
+                                                        daemon=not block_exit)
+                self._refresh_thread.start()
+            return self._refresh_thread
+
+    def get_ids(self, enumerate_ids, background_refresh=False, force_refresh=False, block_exit=True):
+        """
+        The ids to fetch details for. Stored ids are used while the index is fresh. Once it is stale the ids are
+        enumerated again first, or, with background_refresh, on a thread while the stored ids are returned straight away
+        (the next run picks the refreshed index up)
+        :param enumerate_ids: Function returning every id of the license type
+        :param background_refresh: Off by default. See refresh_in_background for how the thread holds up the process exit
+        :param force_refresh: Enumerate even when the index is fresh
+        :param block_exit: With background_refresh, let the process wait for the refresh at exit (see refresh_in_background)
+        :return: list of ids
+        """
+        stored_ids = self.ids()
+        if stored_ids and not force_refresh and not self.is_stale():
+            logger.info(f"INFO: Using {len(stored_ids)} ids from id index {self.path}")
+            return stored_ids
+
+        if stored_ids and background_refresh:
+            logger.info(f"INFO: Id index {self.path} is stale. Using its {len(stored_ids)} ids while it is refreshed in the background")
+            self.refresh_in_background(enumerate_ids, block_exit)
+            return stored_ids
+
+        self.refresh(enumerate_ids)
+        return self.ids()
@@ -0,0 +1,84 @@
+import os
+import json
+import threading
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+
+class JsonStore:
+    """
+    Base of the state kept on disk under .scraper_cache as one JSON file (cookie jars, id indexes, code tables).
+    Gives subclasses the shared instance per site (shared), reading the file with a check of its layout version
+    (read_file) and atomic writes (write_file). Subclasses turn the file contents into their own state in load/save
+    and guard that state with self._lock
+    """
+    # Name used in log lines
+    DESCRIPTION = "store"
+    # Layout version written into the file. Files of another version are ignored. None to store the contents as they are
+    VERSION = None
+
+    _instances = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path):
+        """
+        :param path: JSON file
+        """
+        self.path = path
+        self._lock = threading.RLock()
+
+    @classmethod
+    def shared(cls, key, path, **kwargs):
+        """
+        Instance of the class for key shared by everything in the process, created from path and kwargs on first use
+        """
+        with JsonStore._registry_lock:
+            store = JsonStore._instances.get((cls, key))
+            if store is None:
+                store = cls(path, **kwargs)
+                JsonStore._instances[(cls, key)] = store
+            return store
+
+    def read_file(self):
+        """
+        :return: contents of the JSON file. None when there is no file, it cannot be read or it is of another VERSION
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r') as store_file:
+                stored = json.load(store_file)
+        except Exception as e:
+            logger.info(f"ERROR: Could not load {self.DESCRIPTION} {self.path}. DETAILS: {e}")
+            return None
+
+        if self.VERSION is not None and stored.get("version") != self.VERSION:
+            logger.info(f"INFO: {self.DESCRIPTION.capitalize()} {self.path} is version {stored.get('version')}, expected {self.VERSION}. Ignoring it")
+            return None
+        return stored
+
+    def write_file(self, contents, indent=None):
+        """
+        Writes contents (with VERSION added) to a temporary file and renames it over the JSON file, so readers never see
+        a half written file
+        :param contents: dict. Serialized under self._lock, so it may refer to the live state
+        :return: True when the file was written
+        """
+        with self._lock:
+            if self.VERSION is not None:
+                contents = {"version": self.VERSION, **contents}
+            payload = json.dumps(contents, indent=indent)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w') as store_file:
+                store_file.write(payload)
+            os.replace(temp_path, self.path)
+            return True
+        except Exception as e:
+            logger.info(f"ERROR: Could not save {self.DESCRIPTION} {self.path}. DETAILS: {e}")
+            return False
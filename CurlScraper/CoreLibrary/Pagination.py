@@ -0,0 +1,13 @@
+class IncompleteResultsError(Exception):
+    """
+    Some pages of a result fetched page by page could not be got, even after retries
+    """
+
+    def __init__(self, missing, results=None):
+        """
+        :param missing: Keys of the missing pages (offsets, page numbers...)
+        :param results: What was got, for callers that can use a partial result
+        """
+        self.missing = sorted(missing)
+        self.results = results
+        super().__init__(f"{len(self.missing)} pages could not be fetched: {self.missing}")
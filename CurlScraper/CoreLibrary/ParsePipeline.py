@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+# Put on the page queue by the fetch stage when it has no more pages
+_FETCH_DONE = object()
+
+
+def parse_chunk(parse_function, chunk):
+    """
+    Runs in a worker process. Parses a chunk of pages, so one round trip to the worker carries several pages
+    :param parse_function: Module level function taking (page, key), eg ARMedBoardCurl.parse_license_page
+    :param chunk: list of (key, page)
+    :return: list of (key, parsed dict). A page that could not be parsed gives an empty dict
+    """
+    results = []
+    for key, page in chunk:
+        try:
+            results.append((key, parse_function(page, key)))
+        except Exception as e:
+            logger.info(f"ERROR: Could not parse page of {key}. DETAILS: {e}")
+            results.append((key, {}))
+    return results
+
+
+class ParsePipeline:
+    """
+    Parse stage run in worker processes, so extracting fields from pages is spread over every core instead of running
+    behind the GIL in the threads that send the requests.
+    The fetch stage (any iterable of (key, page), eg pages coming out of send_many) is read by a thread into a bounded
+    queue, pages are handed to the workers in chunks and at most max_pending_chunks are being parsed at any time.
+    When parsing falls behind, the queue fills up and the fetch stage waits, so memory stays bounded on big crawls.
+    Worker processes are started once and reused, so keep one pipeline for a whole crawl (it is a context manager)
+    """
+
+    def __init__(self, parse_function, max_workers=None, chunk_size=8, max_pending_chunks=None, queue_size=None, flush_interval=0.5, start_method="spawn"):
+        """
+        :param parse_function: Module level function taking (page, key). Must be importable by the workers
+        :param max_workers: Worker processes. Defaults to the number of cores
+        :param chunk_size: Pages sent to a worker at once
+        :param max_pending_chunks: Chunks being parsed at the same time. Defaults to twice the workers, so none sits idle
+        :param queue_size: Pages the fetch stage can get ahead of the parse stage. Defaults to one chunk per pending chunk
+        :param flush_interval: Seconds to wait for a chunk to fill up before a partial one is sent, so slow fetches do not hold back results
+        :param start_method: multiprocessing start method. spawn, as forking a process that runs request threads can copy held locks
+        """
+        self.parse_function = parse_function
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_pending_chunks = max_pending_chunks or 2 * self.max_workers
+        self.queue_size = queue_size or self.chunk_size * self.max_pending_chunks
+        self.flush_interval = flush_interval
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context(start_method))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _put(page_queue, item, stop):
+        """
+        Blocks while the queue is full, unless the consumer went away
+        :return: False when the pipeline was stopped
+        """
+        while not stop.is_set():
+            try:
+                page_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, pages, page_queue, stop):
+        """
+        Fetch stage thread. Moves pages from the fetch iterable to the queue
+        """
+        try:
+            for item in pages:
+                if not self._put(page_queue, item, stop):
+                    return
+        except Exception as e:
+            logger.info(f"ERROR: Fetch stage stopped. DETAILS: {e}")
+        self._put(page_queue, _FETCH_DONE, stop)
+
+    def parse_pages(self, pages):
+        """
+        Parses pages as they are fetched
+        :param pages: iterable of (key, page html). Read by a separate thread, so it can block on the network
+        :return: Generator of (key, parsed dict) tuples, in completion order
+        """
+        page_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        feeder = threading.Thread(target=self._feed, args=(pages, page_queue, stop), name="fetch-stage", daemon=True)
+        feeder.start()
+
+        in_flight = set()
+        chunk = []
+        fetching = True
+        try:
+            while fetching or in_flight:
+                if fetching and len(in_flight) < self.max_pending_chunks:
+                    try:
+                        item = page_queue.get(timeout=self.flush_interval)
+                    except queue.Empty:
+                        item = None
+
+                    if item is _FETCH_DONE:
+                        fetching = False
+                    elif item is not None:
+                        chunk.append(item)
+
+                    # Full chunks go out right away. Partial ones when the fetch stage is slow or done
+                    if chunk and (len(chunk) >= self.chunk_size or item is None or not fetching):
+                        in_flight.add(self._executor.submit(parse_chunk, self.parse_function, chunk))
+                        chunk = []
+
+                if in_flight:
+                    # Only block on the workers when no more pages can be taken in
+                    block = not fetching or len(in_flight) >= self.max_pending_chunks
+                    done, in_flight = wait(in_flight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+        finally:
+            stop.set()
+            for future in in_flight:
+                future.cancel()
@@ -0,0 +1,159 @@
+import time
+import random
+import threading
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+# Statuses that mean the site blocked the proxy rather than the request
+BAN_STATUSES = (403, 407, 429)
+
+
+class ProxyStats:
+    """
+    Health of one proxy: moving averages of latency and success, plus cool down state
+    """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.latency = 1.0
+        self.success_rate = 1.0
+        self.requests = 0
+        self.consecutive_failures = 0
+        self.bans = 0
+        self.cooldown_until = 0.0
+        self.evicted = False
+
+    def score(self):
+        """
+        Higher is better. Fast proxies that rarely fail get most of the traffic, slow or flaky ones still get a little so they can recover
+        """
+        return max(self.success_rate, 0.05) / max(self.latency, 0.05)
+
+    def as_dict(self):
+        return {
+            "proxy": self.proxy,
+            "latency": round(self.latency, 3),
+            "success_rate": round(self.success_rate, 3),
+            "requests": self.requests,
+            "bans": self.bans,
+            "cooling_down": self.cooldown_until > time.time(),
+            "evicted": self.evicted
+        }
+
+
+class ProxyPool:
+    """
+    Set of proxies shared by every request and worker thread that is given the pool.
+    Can be passed anywhere a single proxy string is accepted (curl_proxy of the site classes, proxy of send_curl_request).
+    Each attempt picks a proxy weighted by its health score. Proxies that get banned (403/407/429) are cooled down,
+    with the cool down doubling on every ban in a row. Proxies that fail max_failures times in a row are evicted.
+    With sticky=True a session (one CurlRequests instance, so one site object) keeps its proxy until that proxy goes bad,
+    for sites that tie the session cookie to the client IP
+    """
+
+    def __init__(self, proxies, sticky=False, cooldown=60, max_cooldown=1800, failure_cooldown=5, max_failures=5, smoothing=0.2):
+        """
+        :param proxies: list of proxies, eg ["http://38.109.22.251:21270", "socks5://10.0.0.2:1080"]
+        :param sticky: Keep one proxy per session instead of picking one per request
+        :param cooldown: Seconds a proxy is left out after its first ban
+        :param max_cooldown:
+        :param failure_cooldown: Seconds a proxy is left out after a connection error or timeout, so the retry goes through another one
+        :param max_failures: Failures in a row (connection errors, timeouts) after which the proxy is evicted
+        :param smoothing: Weight of the newest sample in the latency and success moving averages
+        """
+        self.sticky = sticky
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failure_cooldown = failure_cooldown
+        self.max_failures = max_failures
+        self.smoothing = smoothing
+        self._stats = {proxy: ProxyStats(proxy) for proxy in proxies}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stats)
+
+    def add(self, proxy):
+        """
+        Adds a proxy, or brings an evicted one back
+        """
+        with self._lock:
+            self._stats[proxy] = ProxyStats(proxy)
+
+    def _available(self, now):
+        return [stats for stats in self._stats.values() if not stats.evicted and stats.cooldown_until <= now]
+
+    def acquire(self, session_key=None):
+        """
+        Picks the proxy for one attempt
+        :param session_key: Identifies the session for sticky pools
+        :return: proxy string. When every proxy is cooling down, the one that comes back first
+        """
+        now = time.time()
+        with self._lock:
+            if self.sticky and session_key in self._sessions:
+                stats = self._stats.get(self._sessions[session_key])
+                if stats and not stats.evicted and stats.cooldown_until <= now:
+                    return stats.proxy
+
+            available = self._available(now)
+            if available:
+                stats = random.choices(available, weights=[candidate.score() for candidate in available])[0]
+            else:
+                candidates = [stats for stats in self._stats.values() if not stats.evicted]
+                if not candidates:
+                    raise LookupError("Every proxy in the pool was evicted")
+                stats = min(candidates, key=lambda candidate: candidate.cooldown_until)
+                logger.info(f"INFO: Every proxy is cooling down. Using {stats.proxy}, the first one due back")
+
+            if self.sticky and session_key is not None:
+                self._sessions[session_key] = stats.proxy
+            return stats.proxy
+
+    def report(self, proxy, status, latency):
+        """
+        Records the outcome of an attempt made through proxy
+        :param proxy:
+        :param status: HTTP status, or None when the attempt failed without a response
+        :param latency: Seconds the attempt took
+        :return:
+        """
+        with self._lock:
+            stats = self._stats.get(proxy)
+            if stats is None:
+                return
+            stats.requests += 1
+
+            if status is None:
+                stats.success_rate = (1 - self.smoothing) * stats.success_rate
+                stats.consecutive_failures += 1
+                stats.cooldown_until = time.time() + self.failure_cooldown
+                if stats.consecutive_failures >= self.max_failures and not stats.evicted:
+                    stats.evicted = True
+                    logger.info(f"INFO: Evicted proxy {proxy} after {stats.consecutive_failures} failures in a row")
+                return
+
+            if status in BAN_STATUSES:
+                stats.bans += 1
+                stats.consecutive_failures += 1
+                stats.success_rate = (1 - self.smoothing) * stats.success_rate
+                cooldown = min(self.max_cooldown, self.cooldown * (2 ** (stats.consecutive_failures - 1)))
+                stats.cooldown_until = time.time() + cooldown
+                logger.info(f"INFO: Proxy {proxy} got status {status}. Cooling it down for {cooldown}s")
+                return
+
+            stats.consecutive_failures = 0
+            stats.success_rate = (1 - self.smoothing) * stats.success_rate + self.smoothing
+            if latency is not None:
+                stats.latency = (1 - self.smoothing) * stats.latency + self.smoothing * latency
+
+    def stats(self):
+        """
+        Health of every proxy, best first
+        :return: list of dicts
+        """
+        with self._lock:
+            ranked = sorted(self._stats.values(), key=lambda stats: stats.score(), reverse=True)
+            return [stats.as_dict() for stats in ranked]
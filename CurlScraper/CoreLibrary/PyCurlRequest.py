@@ -1,29 +1,130 @@
+import time
+import uuid
 import shlex
+import logging
+import threading
 import subprocess
-import json
-import gzip
-from LoggingModule import set_logging
+from contextlib import ExitStack
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from CurlScraper.CoreLibrary.CurlResponse import CurlResponse, finalize_response
+from CurlScraper.CoreLibrary.RequestTemplate import RequestTemplate
+from CurlScraper.CoreLibrary.RetryPolicy import RetryPolicy
+from CurlScraper.CoreLibrary.ProxyPool import ProxyPool
+from CurlScraper.CoreLibrary.Transports import PooledHttpTransport, SubprocessCurlTransport, UnsupportedRequestError, urlencode_form_data
+from LoggingModule import set_logging, REQUEST_LOGGER_NAME
 
 logger = set_logging()
+# Per request lines go through their own logger so they can be sampled (see LoggingModule.set_request_log_sampling)
+request_logger = set_logging(REQUEST_LOGGER_NAME)
 
 class CurlRequests:
     """
     Alternative to using python requests where curl works but equivalent python request code does not get a result
+    By default requests are sent with the curl binary (SubprocessCurlTransport), so every site keeps curl's TLS and HTTP fingerprint.
+    Sites that answer plain python clients can opt into the in-process transport with keep-alive connection pooling
+    by passing transport=PooledHttpTransport() (see get_shared_pooled_transport)
     """
-
-    def __init__(self, cookies_dict: dict, headers_dict):
+    default_transport = None
+    # In-process transport shared by the sites that opt into it. See get_shared_pooled_transport
+    shared_pooled_transport = None
+    _transport_lock = threading.Lock()
+    # Optional ResponseCache used by instances created without one. See set_default_cache
+    default_cache = None
+    # Optional HostRateLimiter used by instances created without one. See set_default_rate_limiter
+    default_rate_limiter = None
+    # Retries with backoff for every instance created without a policy. See set_default_retry_policy
+    default_retry_policy = RetryPolicy()
+    fallback_transport = SubprocessCurlTransport()
+    # Ask servers for compressed bodies unless the caller's headers already set Accept-Encoding
+    negotiate_compression = True
+
+    def __init__(self, cookies_dict: dict, headers_dict=None, transport=None, template=None, cache=None, rate_limiter=None, retry_policy=None):
         """
         :param cookies_dict:
-        :param headers_dict: Use Classes from "CurlSiteTemplates" to get default curl_headers for certain sites. If you know the curl_headers, you can just supply them as a dictionary
-        If you dont have a dict of either parameter, you can pass and empty dict into the constructor and set the curl "curl_headers" and "curl_cookie_header" manually
+        :param headers_dict: Site headers as a dictionary. Ignored when a template is given
+        If you dont have a dict of either parameter, you can pass and empty dict into the constructor. Empty headers get a regular browser set
+        :param transport: Backend used to send requests. Defaults to the shared transport from get_default_transport
+        :param template: Precompiled RequestTemplate for the site. Site classes build one per class and reuse it for every request
+        :param cache: ResponseCache for this instance. Defaults to the shared cache from set_default_cache (None means no caching)
+        :param rate_limiter: HostRateLimiter for this instance. Defaults to the shared one from set_default_rate_limiter (None means no limiting)
+        :param retry_policy: RetryPolicy for this instance. Defaults to the shared one from set_default_retry_policy
+        """
+        self.cookies_dict = cookies_dict if cookies_dict is not None else {}
+        self.headers_dict = dict(template.headers) if template else headers_dict
+        self.transport = transport if transport else self.get_default_transport()
+        self.template = template
+        self.cache = cache if cache else self.default_cache
+        self.rate_limiter = rate_limiter if rate_limiter else self.default_rate_limiter
+        self.retry_policy = retry_policy if retry_policy else self.default_retry_policy
+        # Session key for sticky proxy pools. Every request of this instance keeps the same proxy
+        self.proxy_session = uuid.uuid4().hex
+
+        if not template:
+            self.set_headers_dict_if_empty()
+            self.template = RequestTemplate(self.headers_dict, negotiate_compression=self.negotiate_compression)
+
+    @classmethod
+    def get_default_transport(cls):
+        """
+        Transport used by every instance that is not given one. The curl binary unless changed with set_default_transport
+        :return:
+        """
+        with cls._transport_lock:
+            if cls.default_transport is None:
+                cls.default_transport = SubprocessCurlTransport()
+            return cls.default_transport
+
+    @classmethod
+    def get_shared_pooled_transport(cls):
+        """
+        PooledHttpTransport shared by every site that opts into it, so pooled connections outlive the short lived CurlRequests objects the site classes create
+        :return:
+        """
+        with cls._transport_lock:
+            if cls.shared_pooled_transport is None:
+                cls.shared_pooled_transport = PooledHttpTransport()
+            return cls.shared_pooled_transport
+
+    @classmethod
+    def set_default_cache(cls, cache):
+        """
+        Turns on response caching for every instance created without a cache, so the site classes get it without changes.
+        eg CurlRequests.set_default_cache(ResponseCache(ttl=7 * 24 * 3600))
+        :param cache: ResponseCache, or None to turn caching off
+        :return:
         """
-        self.cookies_dict = cookies_dict
-        self.headers_dict = headers_dict
-        self.cookies_as_single_str = ""
-        self.curl_headers = ""
-        self.curl_cookie_header = None
+        cls.default_cache = cache
 
-        self.set_headers_dict_if_empty()
+    @classmethod
+    def set_default_rate_limiter(cls, rate_limiter):
+        """
+        Puts every instance created without a limiter behind the same per-host budget.
+        eg CurlRequests.set_default_rate_limiter(HostRateLimiter(rate=2, max_concurrency=8))
+        :param rate_limiter: HostRateLimiter, or None to turn limiting off
+        :return:
+        """
+        cls.default_rate_limiter = rate_limiter
+
+    @classmethod
+    def set_default_retry_policy(cls, retry_policy):
+        """
+        Changes the retry behaviour of instances created without a policy.
+        eg CurlRequests.set_default_retry_policy(RetryPolicy(max_attempts=5, hedge=True)), or RetryPolicy(max_attempts=1) to send every request once
+        :param retry_policy: RetryPolicy
+        :return:
+        """
+        cls.default_retry_policy = retry_policy
+
+    @classmethod
+    def set_default_transport(cls, transport):
+        """
+        Changes the backend used by instances created without a transport.
+        eg CurlRequests.set_default_transport(CurlRequests.get_shared_pooled_transport()) to send every site's requests in process
+        :param transport:
+        :return:
+        """
+        cls.default_transport = transport
 
     def set_headers_dict_if_empty(self):
         """
@@ -63,201 +164,386 @@ class CurlRequests:
         }
         return headers_dict
 
-    def build_headers(self):
+    def get_template(self):
         """
-        Formats the header dictionary into the format used by curl requests
-        :return:String representing formatted curl_headers for curl command
+        Template for the current cookies. A new one is derived only when the cookies changed since the last request
+        :return: RequestTemplate
         """
-        for key, value in self.headers_dict.items():
-            if not self.curl_headers:
-                self.curl_headers = f'-H "{key}: {value}" '
-            else:
-                self.curl_headers = f'{self.curl_headers}  -H "{key}: {value}" '
-
-        return self.curl_headers
+        if self.template.cookies != self.cookies_dict:
+            self.template = self.template.with_cookies(self.cookies_dict)
+        return self.template
 
-    def build_cookie_header(self):
+    def build_request_body(self, data, form_data, url_encode_data):
         """
-        Formats the cookie dictionary into the format used by the curl request
-        :return: String representing formatted cookies_as_single_str for curl command
+        Body bytes sent by both transports. Follows curl's rules for --data-binary, -d and --data-urlencode
+        :return: bytes, or None when the request has no body
         """
-        for key, value in self.cookies_dict.items():
-            if not self.cookies_as_single_str:
-                self.cookies_as_single_str = f'{key}={value}'
+        if data:
+            return str(data).encode()
+
+        if form_data:
+            if url_encode_data:
+                form_data = urlencode_form_data(form_data)
             else:
-                self.cookies_as_single_str = f'{self.cookies_as_single_str}; {key}={value}'
+                # curl -d strips carriage returns and newlines
+                form_data = form_data.replace("\r", "").replace("\n", "")
+            return form_data.encode()
 
-        self.curl_cookie_header = f' -H "cookie: {self.cookies_as_single_str}" '
-        return self.curl_cookie_header
+        return None
 
-    def build_body_data(self, data):
+    def build_full_curl_cmd(self, request_url, data=None, add_compression=False, proxy=None, specified_method=None, form_data=None, page_redirects=False, include=False, url_encode_data=False, download_file=False):
         """
-        Formats the body data into the format used by curl requests.
-        Used internally by the build_full_curl_cmd method
-        :param data:
-        :return: String representing formatted body/data portion of curl command
+        Command line equivalent of a request, for logging or to paste into a terminal. Requests are not sent through this string
+        :return: String representing curl command
         """
-        return f" --data-binary '{data}' "
+        prepared_request = self.prepare_request(request_url, data, add_compression, proxy, specified_method, form_data, page_redirects, include, url_encode_data, download_file)
+        return shlex.join(self.fallback_transport.build_argv(prepared_request))
 
-    def build_form_data(self, form_data, url_encode_data):
+    def prepare_request(self, request_url, data=None, add_compression=False, proxy=None, specified_method=None, form_data=None, page_redirects=False, include=False, url_encode_data=False, download_file=False, timeout=8, shell_needed=False):
         """
-        Formats form data into the proper format for curl.
-        This involes appending the proper tag
-        :param form_data:
-        :return:
+        Collects everything a transport needs to send the request: method, url, headers, body and flags.
+        The subprocess transport turns it into an argv list, the in-process transport sends it as is
+        :param shell_needed: No longer used. Requests are built as argv lists so bodies never go through shell quoting
+        :return: dict describing the request
         """
-        if url_encode_data:
-            return f"--data-urlencode {form_data}"
-        return f" -d {form_data}"
+        template = self.get_template()
+        proxy = proxy if proxy else template.proxy
+        proxy_pool = proxy if isinstance(proxy, ProxyPool) else None
+        body = self.build_request_body(data, form_data, url_encode_data)
+        headers = template.request_headers(body is not None)
+        compressed = template.negotiate_compression or bool(add_compression)
 
-    def build_full_curl_cmd(self, request_url, data, add_compression, proxy, specified_method, form_data, page_redirects, include, url_encode_data, download_file):
-        """
-        Builds the full curl request. Used by the send_curl_request method. (Not externally)
-        :param proxy:
-        :param include:
-        :param page_redirects:
-        :param specified_method:
-        :param add_compression:
-        :param request_url:
-        :param data:
-        :param form_data: curl form data
-        :return: String representin curl command
-        """
-        "proxy: Should be specified as follows in example: http://38.109.22.251:21270"
-
-        if download_file:
-            download_file_option = " -O "
-        else:
-            download_file_option = ""
-
-        # Add location header for pages that redirect
-        if page_redirects is True:
-            location_option = " --location "
-        else:
-            location_option = ""
-
-        # Add option to include connection information
-        if include:
-            include_option = " -i "
+        if specified_method:
+            method = specified_method.upper()
+        elif body is not None:
+            method = "POST"
         else:
-            include_option = ""
+            method = "GET"
+
+        prepared_request = {
+            "url": request_url,
+            "method": method,
+            "method_forced": bool(specified_method),
+            "headers": headers,
+            "body": body,
+            # Picked from proxy_pool on every attempt when a pool was given
+            "proxy": None if proxy_pool else proxy,
+            "proxy_pool": proxy_pool,
+            "template": template,
+            # Per request headers on top of the template ones (eg cache revalidation)
+            "extra_headers": {},
+            "follow_redirects": page_redirects,
+            "include": include,
+            "compressed": compressed,
+            "download_file": download_file,
+            "timeout": timeout,
+            # Set from the retry policy when the request is sent
+            "connect_timeout": None
+        }
+        return prepared_request
 
-        # Add proxy information to curl request
-        if proxy:
-            proxy_option = f" --proxy {proxy} "
-        else:
-            proxy_option = ""
+    def send_prepared_request(self, prepared_request):
+        """
+        Sends the request through this instance's transport, going through the response cache when one is set.
+        Failed attempts are retried as the retry policy allows.
+        Falls back to the curl binary when the transport cannot handle the request (eg socks proxies)
+        :return: CurlResponse
+        """
+        use_cache = self.cache is not None and self.cache.is_cacheable(prepared_request)
+        if use_cache:
+            cached_response, conditional_headers = self.cache.lookup(prepared_request)
+            if cached_response is not None:
+                request_logger.info("INFO: Served %s from response cache", prepared_request["url"])
+                return cached_response
+            if conditional_headers:
+                prepared_request["headers"].update(conditional_headers)
+                prepared_request["extra_headers"].update(conditional_headers)
+
+        response = self.retry_policy.execute(self.send_attempt, prepared_request)
+
+        if use_cache:
+            response = self.cache.update(prepared_request, response)
+        return response
 
-        # Build curl headers
-        if not self.curl_headers:
-            self.build_headers()
+    def send_attempt(self, prepared_request):
+        """
+        One attempt at the request, holding a rate limited slot while it runs
+        :return: CurlResponse
+        """
+        proxy_pool = prepared_request["proxy_pool"]
+        if proxy_pool:
+            prepared_request["proxy"] = proxy_pool.acquire(self.proxy_session)
 
-        # Build cookie header
-        if not self.curl_cookie_header:
-            self.build_cookie_header()
+        started = time.time()
+        response = None
+        try:
+            with ExitStack() as stack:
+                rate_limit_lease = stack.enter_context(self.rate_limiter.slot(prepared_request["url"])) if self.rate_limiter else None
+                response = self.send_through_transport(prepared_request)
+                if rate_limit_lease:
+                    rate_limit_lease.done(response)
+        finally:
+            if proxy_pool:
+                proxy_pool.report(prepared_request["proxy"], response.status if response is not None else None, time.time() - started)
+        return response
 
-        curl_command_prefix = f"curl{download_file_option}{location_option}{include_option}{proxy_option}"
+    def send_through_transport(self, prepared_request):
+        try:
+            return self.transport.send(prepared_request)
+        except UnsupportedRequestError as e:
+            logger.info(f"INFO: Transport cannot send this request, falling back to curl subprocess. DETAILS: {e}")
+            return self.fallback_transport.send(prepared_request)
 
-        # Add specified method if one is specified
-        if specified_method:
-            logger.info(f"INFO: Applying specified method to prefix: {specified_method}")
-            specified_method_flag = f"-X '{specified_method}'"
-        else:
-            specified_method_flag = ""
+    def send_transport_batch(self, prepared_requests):
+        """
+        Sends a batch through the transport. Requests given a ProxyPool get their proxy picked here and report back to the pool
+        """
+        proxy_pools = [prepared_request["proxy_pool"] for prepared_request in prepared_requests]
+        for prepared_request, proxy_pool in zip(prepared_requests, proxy_pools):
+            if proxy_pool:
+                prepared_request["proxy"] = proxy_pool.acquire(self.proxy_session)
+
+        started = time.time()
+        responses = self.send_transport_batch_limited(prepared_requests)
+        for prepared_request, proxy_pool, response in zip(prepared_requests, proxy_pools, responses):
+            if proxy_pool:
+                proxy_pool.report(prepared_request["proxy"], response.status, time.time() - started)
+        return responses
+
+    def send_transport_batch_with_retries(self, prepared_requests):
+        """
+        Sends a batch, then sends the entries that failed again with the same retry rules and backoff as single requests
+        (see RetryPolicy). Each retry is one batch of the entries still failing. When the whole batch fails (eg the curl
+        process timed out) every entry counts as failed with that error
+        :return: list of CurlResponse, in the order of prepared_requests. Entries that got no response on any attempt get an empty one
+        """
+        responses = [None] * len(prepared_requests)
+        pending = list(range(len(prepared_requests)))
+        started = time.time()
 
-        # If data needs to be sent, with request, add it to the request
-        request_url = f'\"{request_url}\"'
-        if data:
-            body = self.build_body_data(data)
-            full_cmd = f'{curl_command_prefix} {request_url} {specified_method_flag} {self.curl_headers} {self.curl_cookie_header} {body}'
-        elif form_data:
-            form_data = self.build_form_data(form_data, url_encode_data)
-            full_cmd = f'{curl_command_prefix} {request_url} {specified_method_flag} {self.curl_headers} {self.curl_cookie_header} {form_data}'
-        else:
-            full_cmd = f'{curl_command_prefix} {request_url} {specified_method_flag} {self.curl_headers} {self.curl_cookie_header}'
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            batch_error = None
+            try:
+                sent_responses = self.send_transport_batch([prepared_requests[idx] for idx in pending])
+            except Exception as e:
+                batch_error = e
+                sent_responses = [None] * len(pending)
+
+            failed = []
+            for idx, response in zip(pending, sent_responses):
+                if response is not None:
+                    response.attempts = attempt
+                    responses[idx] = response
+                if self.retry_policy.should_retry(prepared_requests[idx], response, batch_error):
+                    failed.append(idx)
+
+            if not failed or attempt == self.retry_policy.max_attempts:
+                if failed:
+                    logger.info(f"ERROR: {len(failed)} of {len(prepared_requests)} batched requests still failed after {attempt} attempts")
+                break
+
+            retry_after = max((self.retry_policy.retry_after(responses[idx]) or 0 for idx in failed), default=0)
+            delay = self.retry_policy.backoff(attempt, retry_after)
+            logger.info(f"INFO: {len(failed)} of {len(pending)} batched requests failed ({batch_error if batch_error else 'bad status or no response'}). Retrying them in {delay:.2f}s")
+            time.sleep(delay)
+            pending = failed
+
+        for idx, prepared_request in enumerate(prepared_requests):
+            if responses[idx] is None:
+                responses[idx] = CurlResponse(include=prepared_request["include"])
+                responses[idx].attempts = self.retry_policy.max_attempts
+            responses[idx].latency = time.time() - started
+        return responses
+
+    def send_transport_batch_limited(self, prepared_requests):
+        """
+        With a rate limiter, each host of the batch gives one token per transfer and one in-flight slot per transfer
+        the transport runs at the same time. Curl runs no more transfers at once than every host has slots for
+        """
+        if not self.rate_limiter or not prepared_requests:
+            return self.transport.send_batch(prepared_requests)
+
+        transfers_per_url = {}
+        for prepared_request in prepared_requests:
+            host_url = prepared_request["url"]
+            host = urlsplit(host_url).hostname
+            transfers_per_url.setdefault(host, [host_url, 0])[1] += 1
+
+        with ExitStack() as stack:
+            parallel_max = getattr(self.transport, "parallel_max", 1)
+            leases = [stack.enter_context(self.rate_limiter.slot(host_url, cost, slots=min(parallel_max, cost)))
+                      for host_url, cost in transfers_per_url.values()]
+            responses = self.transport.send_batch(prepared_requests, parallel_max=min(lease.slots for lease in leases))
+            # The worst status of the batch decides how each host is treated
+            failed = [response for response in responses if response.status is None or response.status >= 429]
+            for lease in leases:
+                lease.done(failed[0] if failed else responses[-1])
+        return responses
+
+    def send_prepared_batch(self, prepared_requests):
+        """
+        Sends several prepared requests with a single curl process (see SubprocessCurlTransport.send_batch).
+        Entries that fail are sent again as the retry policy allows, see send_transport_batch_with_retries.
+        Downloads and transports without batch support go through send_prepared_request one at a time
+        :return: list of CurlResponse, in the order of prepared_requests
+        """
+        if not hasattr(self.transport, "send_batch") or any(prepared_request["download_file"] for prepared_request in prepared_requests):
+            return [self.send_prepared_request(prepared_request) for prepared_request in prepared_requests]
+
+        for prepared_request in prepared_requests:
+            prepared_request["connect_timeout"] = prepared_request["connect_timeout"] or self.retry_policy.connect_timeout
+
+        if self.cache is None:
+            return self.send_transport_batch_with_retries(prepared_requests)
+
+        # Serve fresh cache entries directly and only batch the rest
+        responses = [None] * len(prepared_requests)
+        to_send = []
+        for idx, prepared_request in enumerate(prepared_requests):
+            if not self.cache.is_cacheable(prepared_request):
+                to_send.append(idx)
+                continue
+            cached_response, conditional_headers = self.cache.lookup(prepared_request)
+            if cached_response is not None:
+                responses[idx] = cached_response
+                continue
+            prepared_request["headers"].update(conditional_headers)
+            prepared_request["extra_headers"].update(conditional_headers)
+            to_send.append(idx)
+
+        sent_responses = self.send_transport_batch_with_retries([prepared_requests[idx] for idx in to_send])
+        for idx, response in zip(to_send, sent_responses):
+            if self.cache.is_cacheable(prepared_requests[idx]):
+                response = self.cache.update(prepared_requests[idx], response)
+            responses[idx] = response
+        return responses
+
+    def send_batch(self, request_specs):
+        """
+        Sends a list of requests through one transport call and returns the response dicts.
+        With the subprocess transport this is one curl process for the whole list instead of one per request
+        :param request_specs: list of (key, spec) pairs. Each spec is a dict of send_curl_request keyword arguments
+        :return: list of (key, response) tuples, in input order
+        """
+        keys = []
+        prepared_requests = []
+        for key, spec in request_specs:
+            spec = dict(spec)
+            spec.pop("verbose", None)
+            keys.append(key)
+            prepared_requests.append(self.prepare_request(**spec))
 
-        # Add compression if need. Never really used
-        if add_compression:
-            full_cmd = full_cmd + " --compressed"
+        try:
+            raw_responses = self.send_prepared_batch(prepared_requests)
+        except Exception as e:
+            logger.info(f"ERROR: Occurred while sending batch of {len(prepared_requests)} requests: DETAILS {e}")
+            return [(key, CurlResponse()) for key in keys]
 
-        logger.info(f"INFO: Full command formed:\n\t{full_cmd}\n\nINFO: Ready to send")
-        return full_cmd
+        return [(key, finalize_response(raw_response)) for key, raw_response in zip(keys, raw_responses)]
 
     def send_curl_request(self, request_url, data=None, add_compression=False, proxy=None, specified_method=None, form_data=None, page_redirects=False, include=False, verbose=True, url_encode_data=False, download_file=False, timeout=8, shell_needed=False):
 
         """
         Will build and send a curl request to the specified request url using the curl_headers and dict supplied
         in the init method and optional data supplied in this method
-        :param verbose:
+        :param verbose: Log the full server response. Only written when the log level is DEBUG
         :param form_data:
         :param page_redirects:
         :param include:
         :param request_url:
         :param data:
-        :param add_compression:Always set to False. Output can be received without compression even when running curl from terminal requires compression to receive output (eg html document)
-        :param proxy: Should be specified as follows in example: http://38.109.22.251:21270
+        :param add_compression: Compression is negotiated by default (see negotiate_compression). Set to True to force it when that is turned off
+        :param proxy: Should be specified as follows in example: http://38.109.22.251:21270. A ProxyPool can be passed instead to spread requests over several proxies
         :param specified_method: If no method specified, will send a default curl request
         :return:
         """
-        full_cmd = self.build_full_curl_cmd(request_url, data, add_compression, proxy, specified_method, form_data, page_redirects, include, url_encode_data, download_file)
-        args = shlex.split(full_cmd)
-        logger.info(f"INFO: Sending command as args:\n\t{args}\n\n")
-        response = {}
+        prepared_request = self.prepare_request(request_url, data, add_compression, proxy, specified_method, form_data, page_redirects, include, url_encode_data, download_file, timeout, shell_needed)
+        response = CurlResponse()
         try:
-            if download_file:
-                # No timeout enforced for downloads
-                response = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell_needed)
-            else:
-                # For getting simple html or json response, a default timeout of 8 seconds is enforced
-                response = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, shell=shell_needed)
-
-            stderr = response.stderr
-            stdout = response.stdout
-
-            if stdout and stderr:
-                # If both stdout and stderr exist, there is a valid response/ output data we need to see.
-                # Stderr in this case will just be diagnostics. So will only grab stdout
-                response = stdout
-            elif stderr:
-                response = stderr
-            elif stdout:
-                response = stdout
-            else:
-                response = b''
+            # For getting simple html or json response, a default timeout of 8 seconds is enforced
+            response = self.send_prepared_request(prepared_request)
+            request_logger.info("INFO: Received status %s from %s (%s, %s bytes, %s attempts)", response.status, request_url, response.content_type, len(response.body), response.attempts)
+            response = finalize_response(response)
 
-            # Try decompressing data
-            try:
-                logger.info(f"INFO: Trying to decompress the data")
-                response = gzip.decompress(response)
-                logger.info(f"INFO: Successfully decompressed data")
-            except Exception as e:
-                logger.info(f"ERROR: Data decompression failed. DETAILS {e}")
-
-            try:
-                logger.info(f"INFO: Trying regular decoding.")
-                response = response.decode()
-                logger.info(f"INFO: Successfully decoded data")
-            except Exception as e:
-                logger.info(f"ERROR: Regular decoding failed ! DETAILS {e}")
-
-            # Convert JSON string to actual JSON (If response is JSON string)
-            try:
-                logger.info(f"INFO: Converting any JSON string response to actual JSON")
-                response = json.loads(response)
-                logger.info(f"INFO: JSON loads applied successfully to response. Returning JSON loaded response.")
-            except Exception as e:
-                logger.info(f"ERROR: Could not apply JSON loads to decoded response. Server is not returning JSON formatted response. DETAILS: {e}")
-                # Conversion will fail if not JSON formatted string.
-                # Make our own JSON (dictionary) and put the entire response as the value of the "response" key
-                response = {"response": response}
-
-        except TimeoutError as e:
+        except (TimeoutError, subprocess.TimeoutExpired) as e:
             logger.info(f"ERROR: Occurred while send request: DETAILS {e}")
             response['Timeout'] = True
 
         except Exception as e:
             logger.info(f"ERROR: Occurred while send request: DETAILS {e}")
 
-        if verbose:
-            logger.info(f"INFO:\t\nServer Response: {response}")
+        if verbose and request_logger.isEnabledFor(logging.DEBUG):
+            request_logger.debug("INFO:\t\nServer Response: %s", response.text if isinstance(response, CurlResponse) else response)
         return response
+
+    def send_many(self, request_specs, max_in_flight=10, batch_size=None):
+        """
+        Sends a batch of requests concurrently and yields the responses as they complete.
+        At most max_in_flight requests are running at any time. Specs are pulled lazily, so request_specs can be a generator
+        :param request_specs: dict of {key: spec} or iterable of (key, spec) pairs.
+        Each spec is a dict of send_curl_request keyword arguments and must contain "request_url"
+        :param max_in_flight: Maximum number of requests (or batches, when batch_size is set) sent at the same time
+        :param batch_size: When set, specs are grouped and each group is sent with send_batch (one curl process per group on the subprocess transport)
+        :return: Generator of (key, response) tuples, in completion order
+        """
+        if isinstance(request_specs, dict):
+            request_specs = request_specs.items()
+
+        if batch_size:
+            yield from self._send_many_batched(iter(request_specs), max_in_flight, batch_size)
+            return
+
+        pending_specs = iter(request_specs)
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = {}
+            for key, spec in pending_specs:
+                in_flight[executor.submit(self.send_curl_request, **spec)] = key
+                if len(in_flight) >= max_in_flight:
+                    break
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = in_flight.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        logger.info(f"ERROR: Request {key} failed in batch. DETAILS: {e}")
+                        response = {}
+
+                    # Top the in flight set back up before handing the result to the caller
+                    for next_key, next_spec in pending_specs:
+                        in_flight[executor.submit(self.send_curl_request, **next_spec)] = next_key
+                        break
+
+                    yield key, response
+
+    def _send_many_batched(self, pending_specs, max_in_flight, batch_size):
+        """
+        Batch mode of send_many. Groups specs into lists of batch_size and runs up to max_in_flight groups at the same time
+        """
+        def next_group():
+            group = []
+            for key, spec in pending_specs:
+                group.append((key, spec))
+                if len(group) >= batch_size:
+                    break
+            return group
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = set()
+            for _ in range(max_in_flight):
+                group = next_group()
+                if not group:
+                    break
+                in_flight.add(executor.submit(self.send_batch, group))
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    group = next_group()
+                    if group:
+                        in_flight.add(executor.submit(self.send_batch, group))
+
+                    yield from future.result()
@@ -0,0 +1,213 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+# Statuses that mean the host wants us to slow down
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HostRateLimiter:
+    """
+    Per-host token bucket plus an AIMD concurrency limit.
+    Requests to a host are spaced by the bucket (rate per second, with a burst) and capped at the host's current
+    concurrency limit. The limit grows by one per window of healthy responses and is halved on 429/5xx/timeouts.
+    State lives in a small sqlite file so every thread and every worker process on the box shares the same budget
+    """
+
+    def __init__(self, path=".scraper_cache/rate_limits.sqlite", rate=2.0, burst=4, initial_concurrency=2, min_concurrency=1, max_concurrency=16,
+                 latency_tolerance=2.0, lease_timeout=120, host_limits=None):
+        """
+        :param path: sqlite file shared by the processes that should share the budget
+        :param rate: Requests per second per host
+        :param burst: Bucket size
+        :param initial_concurrency: In-flight limit for a host seen for the first time
+        :param min_concurrency:
+        :param max_concurrency:
+        :param latency_tolerance: A response slower than this multiple of the best average latency seen counts as congestion and stops the limit from growing
+        :param lease_timeout: Seconds after which an in-flight slot of a crashed process is reclaimed
+        :param host_limits: Overrides per host, eg {"www.pals.pa.gov": {"rate": 1, "max_concurrency": 4}}
+        """
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.lease_timeout = lease_timeout
+        self.host_limits = host_limits if host_limits else {}
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS hosts ("
+            "host TEXT PRIMARY KEY, tokens REAL, updated REAL, concurrency_limit REAL, blocked_until REAL, avg_latency REAL, best_latency REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY AUTOINCREMENT, host TEXT, expires REAL)")
+
+    def _connection(self):
+        """
+        One connection per thread. Transactions are opened with BEGIN IMMEDIATE so read-modify-write is atomic across processes
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _setting(self, host, name):
+        return self.host_limits.get(host, {}).get(name, getattr(self, name))
+
+    def _host_row(self, connection, host, now):
+        row = connection.execute("SELECT tokens, updated, concurrency_limit, blocked_until, avg_latency, best_latency FROM hosts WHERE host = ?", (host,)).fetchone()
+        if row:
+            return row
+        row = (float(self._setting(host, "burst")), now, float(self._setting(host, "initial_concurrency")), 0.0, None, None)
+        connection.execute("INSERT INTO hosts VALUES (?, ?, ?, ?, ?, ?, ?)", (host,) + row)
+        return row
+
+    def acquire(self, host, cost=1, slots=1):
+        """
+        Blocks until the host has tokens in its bucket and enough free in-flight slots.
+        The full cost is always taken. A cost above the bucket size waits for a full bucket and leaves the bucket in
+        debt, so the requests after it wait until the debt is paid back at the host's rate
+        :param host:
+        :param cost: Tokens to take. A batch of n transfers sent with one curl process takes n tokens
+        :param slots: In-flight slots to hold, eg the transfers a batch runs at the same time. Capped at the host's
+        current concurrency limit, otherwise a large batch could never start
+        :return: list of lease ids, to pass to release. Its length is the number of slots held
+        """
+        connection = self._connection()
+        rate = self._setting(host, "rate")
+        burst = self._setting(host, "burst")
+        tokens_needed = min(cost, burst)
+
+        while True:
+            now = time.time()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, updated, concurrency_limit, blocked_until, _, _ = self._host_row(connection, host, now)
+                tokens = min(burst, tokens + (now - updated) * rate)
+                connection.execute("DELETE FROM leases WHERE host = ? AND expires < ?", (host, now))
+                in_flight = connection.execute("SELECT COUNT(*) FROM leases WHERE host = ?", (host,)).fetchone()[0]
+                slots_needed = max(1, min(slots, int(concurrency_limit)))
+
+                if now >= blocked_until and tokens >= tokens_needed and in_flight + slots_needed <= int(concurrency_limit):
+                    connection.execute("UPDATE hosts SET tokens = ?, updated = ? WHERE host = ?", (tokens - cost, now, host))
+                    lease_ids = [connection.execute("INSERT INTO leases (host, expires) VALUES (?, ?)", (host, now + self.lease_timeout)).lastrowid
+                                 for _ in range(slots_needed)]
+                    connection.execute("COMMIT")
+                    return lease_ids
+
+                connection.execute("UPDATE hosts SET tokens = ?, updated = ? WHERE host = ?", (tokens, now, host))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+            # Sleep until the next token is due (or a short poll while waiting for a free slot)
+            if now < blocked_until:
+                wait_time = blocked_until - now
+            elif tokens < tokens_needed:
+                wait_time = (tokens_needed - tokens) / rate
+            else:
+                wait_time = 0.05
+            time.sleep(min(max(wait_time, 0.01), 1.0))
+
+    def release(self, host, lease_ids, status=None, latency=None, retry_after=None):
+        """
+        Frees the slots and adapts the host's concurrency limit to the outcome
+        :param lease_ids: list returned by acquire
+        :param status: HTTP status, or None when the request timed out/failed
+        :param latency: Seconds the request took
+        :param retry_after: Seconds from a Retry-After header. Pauses the host for everyone
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("DELETE FROM leases WHERE id = ?", [(lease_id,) for lease_id in lease_ids])
+            tokens, updated, concurrency_limit, blocked_until, avg_latency, best_latency = self._host_row(connection, host, now)
+
+            if status is None or status in THROTTLE_STATUSES:
+                # Multiplicative decrease
+                concurrency_limit = max(self._setting(host, "min_concurrency"), concurrency_limit / 2)
+                if retry_after:
+                    blocked_until = max(blocked_until, now + retry_after)
+                logger.info(f"INFO: Backing off {host} (status {status}). Concurrency limit now {concurrency_limit:.1f}")
+            elif latency is not None:
+                avg_latency = latency if avg_latency is None else 0.8 * avg_latency + 0.2 * latency
+                best_latency = avg_latency if best_latency is None else min(best_latency, avg_latency)
+                if avg_latency <= best_latency * self.latency_tolerance:
+                    # Additive increase: about +1 once a full window of requests came back healthy
+                    concurrency_limit = min(self._setting(host, "max_concurrency"), concurrency_limit + 1 / max(concurrency_limit, 1))
+
+            connection.execute("UPDATE hosts SET concurrency_limit = ?, blocked_until = ?, avg_latency = ?, best_latency = ? WHERE host = ?",
+                               (concurrency_limit, blocked_until, avg_latency, best_latency, host))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def concurrency_limit(self, host):
+        """
+        Current in-flight limit of the host
+        """
+        row = self._connection().execute("SELECT concurrency_limit FROM hosts WHERE host = ?", (host,)).fetchone()
+        return row[0] if row else float(self._setting(host, "initial_concurrency"))
+
+    @contextmanager
+    def slot(self, url, cost=1, slots=1):
+        """
+        Holds rate limited slots for the host of url while the request runs, see acquire.
+        Record the outcome with slot.done(response). A request that raises counts as a timeout
+        """
+        host = urlsplit(url).hostname or url
+        lease = RateLimitLease(self, host, self.acquire(host, cost, slots))
+        try:
+            yield lease
+        finally:
+            # No-op when the caller already recorded the outcome
+            lease.done(None)
+
+
+class RateLimitLease:
+    """
+    Slots handed out by HostRateLimiter.slot. Released once, on the first call to done
+    """
+
+    def __init__(self, limiter, host, lease_ids):
+        self.limiter = limiter
+        self.host = host
+        self.lease_ids = lease_ids
+        # Number of in-flight slots held, the most transfers that may run at the same time
+        self.slots = len(lease_ids)
+        self.started = time.time()
+        self.released = False
+
+    def done(self, response):
+        """
+        :param response: CurlResponse (or anything with status and headers), None for a failed request
+        """
+        if self.released:
+            return
+        self.released = True
+
+        status = getattr(response, "status", None)
+        retry_after = None
+        headers = getattr(response, "headers", None) or {}
+        try:
+            retry_after = float(headers.get("retry-after", ""))
+        except ValueError:
+            pass
+        self.limiter.release(self.host, self.lease_ids, status, time.time() - self.started, retry_after)
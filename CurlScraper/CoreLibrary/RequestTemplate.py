@@ -0,0 +1,82 @@
+from types import MappingProxyType
+from CurlScraper.CoreLibrary.CurlResponse import ACCEPT_ENCODING
+
+
+class RequestTemplate:
+    """
+    Immutable, precompiled request settings for one site (headers, cookies, proxy, compression).
+    Built once per site class and shared by every request of that site. Produces the header argv for the curl binary
+    and the header dict for the in-process transport directly, with no shell string in between
+    """
+    __slots__ = ("headers", "header_args", "cookies", "cookie_header", "proxy", "negotiate_compression", "_header_names")
+
+    def __init__(self, headers_dict, cookies_dict=None, proxy=None, negotiate_compression=True):
+        """
+        :param headers_dict: Site headers
+        :param cookies_dict: Cookies to send with every request. Use with_cookies to get a template for a new set of cookies
+        :param proxy: Default proxy. A proxy passed to send_curl_request wins over this one
+        :param negotiate_compression: Add Accept-Encoding (in process) / --compressed (curl binary) unless the headers already set Accept-Encoding
+        """
+        headers = dict(headers_dict)
+        cookies = dict(cookies_dict) if cookies_dict else {}
+        set_attribute = super().__setattr__
+
+        set_attribute("_header_names", frozenset(key.lower() for key in headers))
+        compress = negotiate_compression and "accept-encoding" not in self._header_names
+        if compress:
+            headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+        set_attribute("headers", MappingProxyType(headers))
+        set_attribute("cookies", MappingProxyType(cookies))
+        set_attribute("cookie_header", "; ".join(f"{key}={value}" for key, value in cookies.items()))
+        set_attribute("proxy", proxy)
+        set_attribute("negotiate_compression", compress)
+
+        header_args = []
+        for key, value in headers.items():
+            if compress and key == "Accept-Encoding":
+                # curl --compressed sets its own Accept-Encoding and decodes the body
+                continue
+            header_args.extend(("-H", f"{key}: {value}"))
+        set_attribute("header_args", tuple(header_args))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("RequestTemplate is immutable. Use with_cookies or with_proxy to derive a new one")
+
+    def with_cookies(self, cookies_dict):
+        """
+        :return: Copy of this template that sends cookies_dict
+        """
+        return RequestTemplate(self._base_headers(), cookies_dict, self.proxy, self.negotiate_compression)
+
+    def with_proxy(self, proxy):
+        """
+        :return: Copy of this template that uses proxy by default
+        """
+        return RequestTemplate(self._base_headers(), self.cookies, proxy, self.negotiate_compression)
+
+    def _base_headers(self):
+        if self.negotiate_compression:
+            return {key: value for key, value in self.headers.items() if key != "Accept-Encoding"}
+        return dict(self.headers)
+
+    def has_header(self, name):
+        return name.lower() in self._header_names
+
+    def request_headers(self, has_body):
+        """
+        Header dict for one request, in the order curl would send them
+        :param has_body: True when the request sends a body. Adds the form Content-Type curl uses when none is set
+        :return:
+        """
+        headers = dict(self.headers)
+        if self.cookie_header:
+            headers["cookie"] = self.cookie_header
+        if has_body and not self.has_header("content-type"):
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        return headers
+
+    def cookie_args(self):
+        if self.cookie_header:
+            return ("-H", f"cookie: {self.cookie_header}")
+        return ()
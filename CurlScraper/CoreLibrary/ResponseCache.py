@@ -0,0 +1,170 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from CurlScraper.CoreLibrary.CurlResponse import CurlResponse
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache of responses sent through CurlRequests, stored in sqlite.
+    Keyed by method, url and body. Fresh entries are served without a request. Stale entries that have an ETag or
+    Last-Modified are revalidated with a conditional request, so an unchanged page costs a 304 instead of the whole body.
+    Size bounded: least recently used entries are evicted once max_bytes is exceeded
+    """
+
+    def __init__(self, path=".scraper_cache/responses.sqlite", ttl=24 * 3600, max_bytes=512 * 1024 * 1024, cacheable_methods=("GET", "POST")):
+        """
+        :param path: sqlite file. Its directory is created if needed
+        :param ttl: Seconds an entry is served without contacting the server
+        :param max_bytes: Total body size kept before the least recently used entries are evicted
+        :param cacheable_methods: POST is included because the aura and PALS search endpoints are read only POSTs
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cacheable_methods = tuple(method.upper() for method in cacheable_methods)
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stores = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, method TEXT, url TEXT, header_block BLOB, body BLOB, etag TEXT, last_modified TEXT, "
+            "stored_at REAL, expires_at REAL, last_access REAL, size INTEGER)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def stats(self):
+        """
+        Hit/miss counters for this process
+        :return: dict
+        """
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.revalidated) / lookups if lookups else 0.0
+        }
+
+    def cache_key(self, prepared_request):
+        key_source = b"\n".join((prepared_request["method"].encode(), prepared_request["url"].encode(), prepared_request["body"] or b""))
+        return hashlib.sha256(key_source).hexdigest()
+
+    def is_cacheable(self, prepared_request):
+        """
+        Warm-up requests (include=True) always go to the server so cookies are fresh. Downloads are not cached
+        """
+        return prepared_request["method"] in self.cacheable_methods and not prepared_request["include"] and not prepared_request["download_file"]
+
+    def lookup(self, prepared_request):
+        """
+        Looks the request up in the cache
+        :return: (CurlResponse or None, conditional headers to send or {}).
+        A response is only returned when the entry is fresh. For stale entries the conditional headers are returned instead
+        """
+        key = self.cache_key(prepared_request)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT header_block, body, etag, last_modified, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if not row:
+                self.misses += 1
+                return None, {}
+
+            self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            header_block, body, etag, last_modified, expires_at = row
+            if expires_at > now:
+                self.hits += 1
+                return self._build_response(header_block, body, prepared_request), {}
+
+            conditional_headers = {}
+            if etag:
+                conditional_headers["If-None-Match"] = etag
+            if last_modified:
+                conditional_headers["If-Modified-Since"] = last_modified
+            if not conditional_headers:
+                self.misses += 1
+            return None, conditional_headers
+
+    def update(self, prepared_request, response):
+        """
+        Feeds a server response back into the cache
+        :return: Response to hand to the caller. For a 304 this is the cached entry, with its expiry pushed back
+        """
+        key = self.cache_key(prepared_request)
+        now = time.time()
+
+        if response.status == 304:
+            with self._lock:
+                row = self._connection.execute("SELECT header_block, body FROM responses WHERE key = ?", (key,)).fetchone()
+                if not row:
+                    self.misses += 1
+                    return response
+                self._connection.execute("UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?", (now + self.ttl, now, key))
+                self.revalidated += 1
+            return self._build_response(row[0], row[1], prepared_request)
+
+        if response.status != 200 or "no-store" in response.headers.get("cache-control", ""):
+            return response
+
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        # Only the final response's headers are kept. Redirect hops are not needed to rebuild it.
+        # Set-Cookie lines are dropped so a cached page never replays an old session cookie into the CookieStore
+        header_block = response.header_blocks[-1] if response.header_blocks else b""
+        header_block = b"\r\n".join(line for line in header_block.split(b"\r\n") if not line.lower().startswith(b"set-cookie:"))
+        size = len(response.body) + len(header_block)
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, prepared_request["method"], prepared_request["url"], header_block, response.body, etag, last_modified, now, now + self.ttl, now, size))
+            self._total_bytes = self._total_bytes + size - (previous[0] if previous else 0)
+            self.stores += 1
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+        return response
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the cache is under max_bytes. Caller holds the lock
+        """
+        total = self._total_bytes
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted_keys = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            total = total - size
+
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        self._total_bytes = total
+        self.evictions += len(evicted_keys)
+        logger.info(f"INFO: Evicted {len(evicted_keys)} cached responses to stay under {self.max_bytes} bytes")
+
+    def _build_response(self, header_block, body, prepared_request):
+        # Bodies are stored decoded, so the Content-Encoding header of the stored block must not be applied again
+        return CurlResponse([header_block] if header_block else [], body, include=prepared_request["include"], content_decoded=True)
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._total_bytes = 0
@@ -0,0 +1,204 @@
+import time
+import random
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from CurlScraper.CoreLibrary.Transports import ConnectError
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the last requests per host to work out when a request is slow enough to hedge
+    """
+
+    def __init__(self, window=200):
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, host, latency):
+        with self._lock:
+            self._latencies.setdefault(host, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, host, fraction, min_samples=20):
+        """
+        :return: Latency at the given fraction (eg 0.95), or None until min_samples requests were seen
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(host, ()))
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+class RetryPolicy:
+    """
+    Retries failed requests with exponential backoff and full jitter, and optionally hedges slow ones.
+    Non idempotent requests (POST...) are only retried when they never reached the server (connection refused, dns, connect timeout),
+    unless retry_non_idempotent is set, eg for read only search POSTs
+    """
+
+    def __init__(self, max_attempts=3, connect_timeout=4, backoff_base=0.5, backoff_cap=15, retry_statuses=RETRY_STATUSES,
+                 retry_non_idempotent=False, hedge=False, hedge_percentile=0.95, max_hedge_workers=16):
+        """
+        :param max_attempts: Attempts per request, including the first one
+        :param connect_timeout: Seconds allowed to open the connection. The timeout passed to send_curl_request stays the limit for the whole transfer
+        :param backoff_base: First backoff in seconds. Doubles on each attempt, capped at backoff_cap, then a random fraction of it is used
+        :param backoff_cap:
+        :param retry_statuses: HTTP statuses that are worth another attempt
+        :param retry_non_idempotent: Also retry POST/PATCH requests that reached the server
+        :param hedge: Send a duplicate of an idempotent request that is still running after the host's hedge_percentile latency. The first answer wins
+        :param hedge_percentile:
+        :param max_hedge_workers: Threads used to run hedged requests
+        """
+        self.max_attempts = max_attempts
+        self.connect_timeout = connect_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_statuses = retry_statuses
+        self.retry_non_idempotent = retry_non_idempotent
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_workers = max_hedge_workers
+        self.latency_tracker = LatencyTracker()
+        self._hedge_executor = None
+        self._executor_lock = threading.Lock()
+
+    def is_idempotent(self, prepared_request):
+        return prepared_request["method"] in IDEMPOTENT_METHODS or self.retry_non_idempotent
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Seconds to wait before the next attempt. A Retry-After from the server wins when it is longer
+        """
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** (attempt - 1))))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_cap))
+        return delay
+
+    def retry_after(self, response):
+        """
+        :return: Seconds the server asked to wait in its Retry-After header, None when it did not say
+        """
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get("retry-after", ""))
+        except (ValueError, AttributeError):
+            return None
+
+    def should_retry(self, prepared_request, response, error):
+        """
+        Decides from the outcome of an attempt whether another one is allowed
+        """
+        if error is not None:
+            # Requests that never left the machine can always be retried
+            return isinstance(error, ConnectError) or self.is_idempotent(prepared_request)
+
+        if response.status is None:
+            return getattr(response, "error_phase", None) == "connect" or self.is_idempotent(prepared_request)
+
+        return response.status in self.retry_statuses and self.is_idempotent(prepared_request)
+
+    def execute(self, send, prepared_request):
+        """
+        Sends the request with send(prepared_request), retrying as the policy allows
+        :param send: Function sending one attempt and returning a CurlResponse
+        :param prepared_request:
+        :return: CurlResponse with attempts and latency set. The error of the last attempt is raised when every attempt raised
+        """
+        if not prepared_request["connect_timeout"]:
+            prepared_request["connect_timeout"] = self.connect_timeout
+        host = urlsplit(prepared_request["url"]).hostname
+        started = time.time()
+        response = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            error = None
+            attempt_started = time.time()
+            try:
+                response = self._send_attempt(send, prepared_request, host)
+            except Exception as e:
+                response = None
+                error = e
+
+            if error is None and response.status is not None:
+                self.latency_tracker.record(host, time.time() - attempt_started)
+
+            if attempt == self.max_attempts or not self.should_retry(prepared_request, response, error):
+                break
+
+            delay = self.backoff(attempt, self.retry_after(response))
+            logger.info(f"INFO: Attempt {attempt} for {prepared_request['url']} failed ({error if error else response.status}). Retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+        if response is None:
+            error.attempts = attempt
+            raise error
+
+        response.attempts = attempt
+        response.latency = time.time() - started
+        return response
+
+    def call(self, fetch, description, should_stop=None):
+        """
+        Calls fetch() with the policy's attempts and backoff, for work only the caller can tell failed, eg a search POST
+        the site answered with an error payload (POSTs that reached the server are not retried by execute)
+        :param fetch: Function returning the result, raising when the attempt failed
+        :param description: What is fetched, for the log
+        :param should_stop: Function returning True when no further attempt should be made, eg the caller went away
+        :return: what fetch returned. The error of the last attempt is raised when every attempt failed
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return fetch()
+            except Exception as e:
+                if attempt == self.max_attempts or (should_stop and should_stop()):
+                    raise
+                delay = self.backoff(attempt)
+                logger.info(f"INFO: Attempt {attempt} for {description} failed ({e}). Retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _executor(self):
+        with self._executor_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=self.max_hedge_workers, thread_name_prefix="hedge")
+            return self._hedge_executor
+
+    def _send_attempt(self, send, prepared_request, host):
+        """
+        One attempt. When hedging is on and the host has enough latency history, a duplicate is sent once the
+        first request outlives the host's percentile latency, and whichever finishes first is used
+        """
+        hedge_delay = self.latency_tracker.percentile(host, self.hedge_percentile) if self.hedge and prepared_request["method"] in IDEMPOTENT_METHODS else None
+        if hedge_delay is None:
+            return send(prepared_request)
+
+        executor = self._executor()
+        primary = executor.submit(send, prepared_request)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        logger.info(f"INFO: {prepared_request['url']} slower than {hedge_delay:.2f}s. Sending hedged request")
+        hedged = executor.submit(send, dict(prepared_request))
+        pending = {primary, hedged}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if response.status is not None or not pending:
+                    return response
+        raise last_error
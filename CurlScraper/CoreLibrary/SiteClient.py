@@ -0,0 +1,61 @@
+from CurlScraper.CoreLibrary.PyCurlRequest import CurlRequests
+from CurlScraper.CoreLibrary.RequestTemplate import RequestTemplate
+from CurlScraper.CoreLibrary.SiteSession import SiteSession
+
+
+class SiteClient:
+    """
+    Base of the curl site classes. Builds the request template, the requester and the cookie session the same way for
+    every site. A site class sets SITE_NAME, MAIN_PAGE and get_site_request_headers, and overrides the constants below
+    where it differs
+    """
+    SITE_NAME = None
+    MAIN_PAGE = None
+    # Proxy pools built from a list of proxies keep one proxy per session when True. Sites whose requests carry state
+    # from the main page (eg aura sessions) need it, stateless GETs and searches do not
+    STICKY_PROXY = False
+    # Strings in a response body that show the site dropped the session, see SiteSession
+    AUTH_FAILURE_MARKERS = ()
+    # Send the site's requests with the in-process PooledHttpTransport instead of the curl binary. Only for sites that
+    # answer plain python clients
+    USE_POOLED_TRANSPORT = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every site class builds its own template on first use, see get_request_template
+        cls._request_template = None
+
+    def get_site_request_headers(self):
+        """
+        Headers sent with every request to the site
+        :return: dictionary of curl_headers
+        """
+        raise NotImplementedError
+
+    def get_session(self):
+        """
+        Cookie session shared by every instance of the class, see SiteSession
+        :return: SiteSession
+        """
+        return SiteSession.for_site(self.SITE_NAME, self.MAIN_PAGE, auth_failure_markers=self.AUTH_FAILURE_MARKERS)
+
+    def get_request_template(self):
+        """
+        Precompiled request template for the site. Built on first use and shared by every instance of the class
+        :return: RequestTemplate
+        """
+        cls = type(self)
+        if cls._request_template is None:
+            cls._request_template = RequestTemplate(self.get_site_request_headers())
+        return cls._request_template
+
+    def get_requester(self):
+        """
+        CurlRequests instance reused by every request this client sends
+        :return:
+        """
+        if self.requester is None:
+            transport = CurlRequests.get_shared_pooled_transport() if self.USE_POOLED_TRANSPORT else None
+            self.requester = CurlRequests(self.cookies_dict, transport=transport, template=self.get_request_template())
+        self.requester.cookies_dict = self.cookies_dict
+        return self.requester
@@ -0,0 +1,217 @@
+import time
+import atexit
+import threading
+from CurlScraper.CoreLibrary.CookieStore import CookieStore
+from LoggingModule import set_logging, LazyJson
+
+logger = set_logging()
+
+# Statuses that mean the site no longer accepts the session cookies
+AUTH_FAILURE_STATUSES = (401, 403, 440)
+
+
+class SiteSession:
+    """
+    Long lived cookie session for one site, shared by every client object of that site in the process.
+    Cookies live in the site's CookieStore. The main page is only requested when the stored cookies are missing or
+    about to expire, or when a response shows the site dropped the session.
+    Every change is written back to disk by a background thread, so requests never wait on the cookie file
+    """
+    _sessions = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, site_name, main_page, auth_failure_markers=(), persist_delay=1.0):
+        """
+        :param site_name: Name of the site's CookieStore
+        :param main_page: Page requested to get the site's cookies
+        :param auth_failure_markers: Strings that show up in a response body when the site rejected the session (eg aura:invalidSession)
+        :param persist_delay: Changes are written to disk at most once per this many seconds
+        """
+        self.site_name = site_name
+        self.main_page = main_page
+        self.auth_failure_markers = tuple(auth_failure_markers)
+        self.persist_delay = persist_delay
+        self.store = CookieStore.for_site(site_name)
+
+        # Cookies handed in by callers. They win over the stored ones and survive a refresh
+        self._caller_cookies = {}
+        self._warmed_at = None
+        # Bumped on every warm-up, so threads that saw the same rejected session refresh it only once
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._persist_timer = None
+        atexit.register(self.flush)
+
+    @classmethod
+    def for_site(cls, site_name, main_page, **kwargs):
+        """
+        Session shared by every client of the site in this process. Created on first use
+        :return: SiteSession
+        """
+        with cls._registry_lock:
+            session = cls._sessions.get(site_name)
+            if session is None:
+                session = cls(site_name, main_page, **kwargs)
+                cls._sessions[site_name] = session
+            return session
+
+    def cookies(self):
+        """
+        Snapshot of the cookies to send. Safe to hand to a requester while other threads update the session
+        :return: dict
+        """
+        cookies = self.store.as_dict()
+        with self._lock:
+            cookies.update(self._caller_cookies)
+        return cookies
+
+    def add_caller_cookies(self, cookies_dict):
+        """
+        Cookies passed to a client constructor. They win over the ones from disk and from the site
+        """
+        if not cookies_dict:
+            return
+        with self._lock:
+            logger.info(f"INFO: Cookies passed in to init. Will merge with ones from disk or new ones from site")
+            self._caller_cookies.update(cookies_dict)
+
+    def is_expired(self):
+        """
+        True when the stored cookies are missing or about to expire
+        """
+        if self.store.is_valid():
+            return False
+        # A site that sets no cookies at all leaves the store empty. Warm it once per session cookie lifetime, not before every request
+        recently_warmed = self._warmed_at is not None and time.time() - self._warmed_at < self.store.session_cookie_ttl
+        return not (recently_warmed and not self.store.as_dict())
+
+    def ensure_warm(self, requester, proxy=None):
+        """
+        Warms the session unless the stored cookies are still valid. Only one thread does the warm-up, the others wait for it
+        :param requester: CurlRequests of the calling client, used for the main page request
+        :param proxy:
+        :return: cookies snapshot
+        """
+        if not self.is_expired():
+            return self.cookies()
+        with self._lock:
+            if self.is_expired():
+                self.warm(requester, proxy)
+            return self.cookies()
+
+    def warm(self, requester, proxy=None):
+        """
+        Gets fresh cookies from the site's main page
+        :return:
+        """
+        with self._lock:
+            logger.info(f"\nINFO: SETTING COOKIES FOR {self.site_name} SESSION")
+            requester.cookies_dict = self.cookies()
+            response = requester.send_curl_request(request_url=self.main_page, page_redirects=True, include=True, proxy=proxy)
+            self.add_cookies_from_response(response)
+            logger.info("\nINFO: Cookies for %s session\n\t%s", self.site_name, LazyJson(self.cookies()))
+            self._warmed_at = time.time()
+            self._generation += 1
+
+    def refresh(self, requester, proxy=None, generation=None):
+        """
+        Drops the stored cookies (keeping the ones passed in by callers) and warms the session again
+        :param generation: Generation the caller's rejected cookies came from. Nothing is done when another thread already refreshed since
+        :return: cookies snapshot
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return self.cookies()
+            logger.info(f"INFO: Refreshing {self.site_name} session")
+            self.store.clear()
+            self.warm(requester, proxy)
+            return self.cookies()
+
+    def invalidate(self):
+        """
+        Makes the next request warm the session again
+        """
+        with self._lock:
+            self.store.clear()
+            self._warmed_at = None
+
+    def add_cookies_from_response(self, response):
+        """
+        Applies the Set-Cookie headers of a response. New values replace the stored ones
+        :param response: CurlResponse
+        :return:
+        """
+        names = self.store.add_from_response(response)
+        if names:
+            logger.debug(f"INFO: Found cookies to add {names}")
+            self.schedule_persist()
+
+    def is_auth_failure(self, response):
+        """
+        True when the response shows the site did not accept the session cookies
+        """
+        if getattr(response, "status", None) in AUTH_FAILURE_STATUSES:
+            return True
+        if self.auth_failure_markers:
+            text = getattr(response, "text", "")
+            return any(marker in text for marker in self.auth_failure_markers)
+        return False
+
+    def send(self, requester, request_url, proxy=None, **kwargs):
+        """
+        Sends a request with the session cookies and keeps any cookie the site sets on the way.
+        When the site rejects the session, it is refreshed and the request sent once more
+        :param requester: CurlRequests of the calling client
+        :param request_url:
+        :param proxy:
+        :param kwargs: send_curl_request keyword arguments
+        :return: response of send_curl_request
+        """
+        requester.cookies_dict = self.ensure_warm(requester, proxy)
+        generation = self._generation
+        response = requester.send_curl_request(request_url, proxy=proxy, **kwargs)
+        if self.is_auth_failure(response):
+            logger.info(f"INFO: {self.site_name} rejected the session cookies. Refreshing and sending again")
+            requester.cookies_dict = self.refresh(requester, proxy, generation)
+            response = requester.send_curl_request(request_url, proxy=proxy, **kwargs)
+        self.add_cookies_from_response(response)
+        return response
+
+    def load(self):
+        """
+        Loads the stored cookies from disk
+        :return: dict of cookies, or None when there were none
+        """
+        logger.info(f"INFO: LOADING COOKIE FROM DISK")
+        if self.store.load():
+            return self.store.as_dict()
+        return None
+
+    def update(self, cookies_dict):
+        """
+        Stores cookies, replacing the values already there
+        """
+        self.store.update(cookies_dict)
+        self.schedule_persist()
+
+    def schedule_persist(self):
+        """
+        Writes the store to disk in the background. Changes made within persist_delay are written together
+        """
+        with self._lock:
+            if self._persist_timer is not None:
+                return
+            self._persist_timer = threading.Timer(self.persist_delay, self.flush)
+            self._persist_timer.daemon = True
+            self._persist_timer.start()
+
+    def flush(self):
+        """
+        Writes pending changes to disk now instead of waiting for the background write
+        """
+        with self._lock:
+            timer = self._persist_timer
+            self._persist_timer = None
+        if timer is not None:
+            timer.cancel()
+            self.store.save()
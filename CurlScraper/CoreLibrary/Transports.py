@@ -0,0 +1,458 @@
+import os
+import math
+import logging
+import shutil
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, urljoin, unquote, quote_plus
+from base64 import b64encode
+from CurlScraper.CoreLibrary.CurlResponse import CurlResponse, split_header_blocks
+from LoggingModule import set_logging, REQUEST_LOGGER_NAME
+
+logger = set_logging()
+request_logger = set_logging(REQUEST_LOGGER_NAME)
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Bodies bigger than this go to curl through stdin instead of argv (Windows caps a command line at 32767 characters)
+ARGV_BODY_LIMIT = 16384
+# curl exit codes for failures before anything was sent: proxy not resolved, host not resolved, could not connect
+CONNECT_EXIT_CODES = (5, 6, 7)
+
+
+class UnsupportedRequestError(Exception):
+    """
+    Raised by a transport when it cannot send a prepared request (eg a socks proxy on the in-process transport).
+    CurlRequests catches this and sends the request through the subprocess fallback instead
+    """
+
+
+class ConnectError(ConnectionError):
+    """
+    Raised by a transport when the connection could not be opened, so the request never reached the server.
+    RetryPolicy retries these even for non idempotent requests
+    """
+
+
+class SubprocessCurlTransport:
+    """
+    Default backend. Runs the curl binary once per request, so requests carry curl's TLS and HTTP fingerprint.
+    Also the fallback for the in-process transport when it cannot send a request.
+    send_batch runs many transfers through a single curl process to keep curl's fingerprint without one spawn per url
+    """
+
+    def __init__(self, parallel_max=10, curl_binary="curl"):
+        """
+        :param parallel_max: Number of transfers curl runs at the same time inside one batch (--parallel-max)
+        :param curl_binary:
+        """
+        self.parallel_max = parallel_max
+        self.curl_binary = curl_binary
+
+    def build_argv(self, prepared_request):
+        """
+        Builds the curl argument list for the prepared request. No shell is involved, so values need no quoting
+        :param prepared_request: dict built by CurlRequests.prepare_request
+        :return: list of arguments
+        """
+        template = prepared_request["template"]
+        args = [self.curl_binary, "--silent", "--show-error"]
+
+        # Headers are always requested so the response knows its status and content type. Downloads print them on
+        # their own (--dump-header -), with -i they would end up in the file
+        if prepared_request["download_file"]:
+            args.extend(("-O", "--dump-header", "-"))
+        else:
+            args.append("-i")
+        if prepared_request["follow_redirects"]:
+            args.append("--location")
+        if prepared_request["proxy"]:
+            args.extend(("--proxy", prepared_request["proxy"]))
+        if prepared_request["connect_timeout"]:
+            args.extend(("--connect-timeout", str(prepared_request["connect_timeout"])))
+
+        args.append(prepared_request["url"])
+        if prepared_request["method_forced"]:
+            args.extend(("-X", prepared_request["method"]))
+
+        args.extend(template.header_args)
+        args.extend(template.cookie_args())
+        for key, value in prepared_request["extra_headers"].items():
+            args.extend(("-H", f"{key}: {value}"))
+
+        body = prepared_request["body"]
+        if body is not None:
+            if len(body) > ARGV_BODY_LIMIT:
+                args.extend(("--data-binary", "@-"))
+            else:
+                args.extend(("--data-binary", body.decode("utf-8", "surrogateescape")))
+
+        if prepared_request["compressed"]:
+            args.append("--compressed")
+
+        return args
+
+    def send(self, prepared_request):
+        """
+        Runs curl for the prepared request
+        :param prepared_request: dict built by CurlRequests.prepare_request
+        :return: CurlResponse built from the output printed by curl
+        """
+        args = self.build_argv(prepared_request)
+        if request_logger.isEnabledFor(logging.DEBUG):
+            request_logger.debug("INFO: Sending command as args:\n\t%s\n\n", args)
+
+        body = prepared_request["body"]
+        stdin_body = body if body is not None and len(body) > ARGV_BODY_LIMIT else None
+
+        if prepared_request["download_file"]:
+            # No timeout enforced for downloads
+            response = subprocess.run(args, input=stdin_body, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            response = subprocess.run(args, input=stdin_body, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=prepared_request["timeout"])
+
+        return self._build_response(prepared_request, response.stdout, response.stderr, response.returncode)
+
+    def _build_response(self, prepared_request, stdout, stderr=b'', returncode=0):
+        """
+        Splits the header blocks curl printed (the command always asks for them with -i, or --dump-header for downloads)
+        from the body
+        """
+        if not stdout or (prepared_request["download_file"] and returncode):
+            # Nothing received, or a download that broke off after its headers and left a partial file.
+            # Stderr holds curl's diagnostics, which is what callers got before
+            response = CurlResponse(body=stderr, include=prepared_request["include"])
+            if returncode:
+                response.error_phase = "connect" if returncode in CONNECT_EXIT_CODES else "transfer"
+            return response
+
+        header_blocks, body = split_header_blocks(stdout)
+        return CurlResponse(header_blocks, body, include=prepared_request["include"], content_decoded=prepared_request["compressed"])
+
+    def send_batch(self, prepared_requests, parallel_max=None):
+        """
+        Sends all the prepared requests with one curl invocation.
+        Each transfer is written to the curl config file and separated with "next". Transfers run with --parallel
+        and each one writes to its own output file so the outputs can be split back per request
+        :param prepared_requests: list of dicts built by CurlRequests.prepare_request
+        :param parallel_max: Transfers to run at the same time for this batch. Defaults to self.parallel_max
+        :return: list of CurlResponse, in the same order as prepared_requests
+        """
+        if not prepared_requests:
+            return []
+
+        work_dir = tempfile.mkdtemp(prefix="curl_batch_")
+        try:
+            output_files = []
+            config_lines = []
+            for idx, prepared_request in enumerate(prepared_requests):
+                output_file = os.path.join(work_dir, f"{idx}.out")
+                output_files.append(output_file)
+                if idx > 0:
+                    config_lines.append("next")
+                config_lines.extend(self._config_lines(prepared_request, output_file, idx, work_dir))
+
+            config_path = os.path.join(work_dir, "batch.config")
+            with open(config_path, 'w') as config_file:
+                config_file.write("\n".join(config_lines) + "\n")
+
+            parallel_max = min(parallel_max, self.parallel_max) if parallel_max else self.parallel_max
+            args = [self.curl_binary, "--silent", "--show-error", "--no-progress-meter", "--parallel", "--parallel-max", str(parallel_max), "--config", config_path]
+            logger.info(f"INFO: Sending batch of {len(prepared_requests)} transfers with one curl process")
+
+            # Transfers run parallel_max at a time, so the batch as a whole gets one timeout per round
+            rounds = math.ceil(len(prepared_requests) / parallel_max)
+            batch_timeout = max(prepared_request["timeout"] for prepared_request in prepared_requests) * rounds + 5
+            process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=batch_timeout)
+
+            transfer_results = parse_transfer_results(process.stdout)
+            if process.returncode and not transfer_results:
+                # Curl stopped before any transfer ran, eg it could not read the config
+                raise RuntimeError(f"curl exited with {process.returncode} before sending the batch: {process.stderr.decode(errors='replace').strip()}")
+            if process.returncode:
+                logger.info(f"WARNING: curl exited with {process.returncode} for the batch. DETAILS: {process.stderr.decode(errors='replace').strip()}")
+
+            outputs = []
+            for idx, (prepared_request, output_file) in enumerate(zip(prepared_requests, output_files)):
+                exit_code, error_message = transfer_results.get(idx, (None, b''))
+                output = b''
+                if exit_code == 0 and os.path.exists(output_file):
+                    with open(output_file, 'rb') as transfer_output:
+                        output = transfer_output.read()
+                # A transfer that failed (or never reported back) counts as no answer, even when it wrote part of a response
+                outputs.append(self._build_response(prepared_request, output, error_message, exit_code if exit_code is not None else 1))
+            return outputs
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _config_lines(self, prepared_request, output_file, idx, work_dir):
+        """
+        Curl config file options for one transfer of a batch.
+        The body goes through a file next to the config (data-binary @file), so it is sent byte for byte whatever it holds.
+        Each transfer prints its index, curl exit code and error message when it ends, see parse_transfer_results
+        """
+        lines = [f"url = {quote_config_value(prepared_request['url'])}", f"output = {quote_config_value(output_file)}",
+                 f"write-out = {quote_config_value(f'{idx} %{{exitcode}} %{{errormsg}}' + chr(10))}"]
+
+        if prepared_request["method_forced"]:
+            lines.append(f"request = {quote_config_value(prepared_request['method'])}")
+        if prepared_request["follow_redirects"]:
+            lines.append("location")
+        # Headers are always requested so the response knows its status and content type
+        lines.append("include")
+        if prepared_request["proxy"]:
+            lines.append(f"proxy = {quote_config_value(prepared_request['proxy'])}")
+        if prepared_request["compressed"]:
+            lines.append("compressed")
+        if prepared_request["timeout"]:
+            lines.append(f"max-time = {prepared_request['timeout']}")
+        if prepared_request["connect_timeout"]:
+            lines.append(f"connect-timeout = {prepared_request['connect_timeout']}")
+
+        for key, value in prepared_request["headers"].items():
+            if prepared_request["compressed"] and key.lower() == "accept-encoding":
+                continue
+            lines.append(f"header = {quote_config_value(f'{key}: {value}')}")
+
+        if prepared_request["body"] is not None:
+            body_file = os.path.join(work_dir, f"{idx}.body")
+            with open(body_file, 'wb') as request_body:
+                request_body.write(prepared_request["body"])
+            lines.append(f"data-binary = {quote_config_value('@' + body_file)}")
+
+        return lines
+
+
+class PooledHttpTransport:
+    """
+    In-process backend built on http.client, opt in per site.
+    Keeps idle keep-alive connections per (scheme, host, port, proxy) so consecutive requests to the same site
+    skip the process spawn and the TCP/TLS handshake. Its TLS and HTTP fingerprint is python's, not curl's, so only use
+    it for sites that answer plain python clients.
+    One instance is meant to be shared by every CurlRequests object that uses it (see CurlRequests.get_shared_pooled_transport)
+    """
+
+    def __init__(self, max_idle_per_host=10, max_redirects=10):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_redirects = max_redirects
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+
+    def _pool_key(self, url_parts, proxy):
+        port = url_parts.port or (443 if url_parts.scheme == "https" else 80)
+        return url_parts.scheme, url_parts.hostname, port, proxy
+
+    def _new_connection(self, pool_key, timeout):
+        """
+        Opens a new connection for the pool key. Goes through the proxy when one is set
+        :return: (connection, proxy headers to add to the request)
+        """
+        scheme, host, port, proxy = pool_key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        proxy_headers = {}
+
+        if not proxy:
+            return connection_class(host, port, timeout=timeout), proxy_headers
+
+        proxy_parts = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+        if proxy_parts.scheme not in ("http", "https"):
+            raise UnsupportedRequestError(f"Proxy scheme {proxy_parts.scheme} not supported in process")
+
+        if proxy_parts.username:
+            credentials = f"{unquote(proxy_parts.username)}:{unquote(proxy_parts.password or '')}"
+            proxy_headers["Proxy-Authorization"] = f"Basic {b64encode(credentials.encode()).decode()}"
+
+        if proxy_parts.scheme == "https":
+            if scheme == "https":
+                # Would need TLS to the proxy and TLS to the site inside it, which http.client cannot do. curl can
+                raise UnsupportedRequestError("https sites through an https proxy are not supported in process")
+            # Plain http site: TLS to the proxy, which gets the absolute url
+            return http.client.HTTPSConnection(proxy_parts.hostname, proxy_parts.port or 443, timeout=timeout), proxy_headers
+
+        proxy_port = proxy_parts.port or 80
+        if scheme == "https":
+            # Tunnel through the proxy with CONNECT. The tunnel to an http proxy is plain, TLS to the site is set up
+            # inside it. Proxy auth goes on the tunnel, not the request
+            connection = http.client.HTTPSConnection(proxy_parts.hostname, proxy_port, timeout=timeout)
+            connection.set_tunnel(host, port, headers=proxy_headers)
+            return connection, {}
+
+        return http.client.HTTPConnection(proxy_parts.hostname, proxy_port, timeout=timeout), proxy_headers
+
+    def _get_connection(self, pool_key, timeout, connect_timeout=None):
+        """
+        Idle connection for the pool key, or a new one. New connections are opened here with connect_timeout
+        so a dead host fails fast, then switched to timeout for the transfer
+        :return: (connection, proxy headers, reused)
+        """
+        with self._lock:
+            idle = self._idle_connections.get(pool_key)
+            if idle:
+                connection, proxy_headers = idle.pop()
+                connection.timeout = timeout
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+                return connection, proxy_headers, True
+
+        connection, proxy_headers = self._new_connection(pool_key, connect_timeout or timeout)
+        try:
+            connection.connect()
+        except OSError as e:
+            connection.close()
+            target = f"proxy {pool_key[3]}" if pool_key[3] else f"{pool_key[1]}:{pool_key[2]}"
+            raise ConnectError(f"Could not connect to {target}. DETAILS: {e}") from e
+        connection.timeout = timeout
+        connection.sock.settimeout(timeout)
+        return connection, proxy_headers, False
+
+    def _release_connection(self, pool_key, connection, proxy_headers):
+        with self._lock:
+            idle = self._idle_connections.setdefault(pool_key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((connection, proxy_headers))
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Closes every idle connection held by the pool
+        :return:
+        """
+        with self._lock:
+            pools = list(self._idle_connections.values())
+            self._idle_connections = {}
+        for idle in pools:
+            for connection, _ in idle:
+                connection.close()
+
+    def _send_once(self, method, url, headers, body, proxy, timeout, connect_timeout=None):
+        """
+        Sends a single request over a pooled connection. A reused connection that the server already closed is retried once on a fresh one
+        :return: (http.client.HTTPResponse, response body bytes)
+        """
+        url_parts = urlsplit(url)
+        if url_parts.scheme not in ("http", "https"):
+            raise UnsupportedRequestError(f"Scheme {url_parts.scheme} not supported in process")
+
+        pool_key = self._pool_key(url_parts, proxy)
+        if proxy and url_parts.scheme == "http":
+            # Plain http through a proxy sends the absolute url
+            path = url
+        else:
+            path = url_parts.path or "/"
+            if url_parts.query:
+                path = f"{path}?{url_parts.query}"
+
+        for attempt in range(2):
+            connection, proxy_headers, reused = self._get_connection(pool_key, timeout, connect_timeout)
+            request_headers = dict(headers)
+            request_headers.update(proxy_headers)
+            try:
+                connection.request(method, path, body=body, headers=request_headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError, http.client.CannotSendRequest) as e:
+                connection.close()
+                if reused and attempt == 0:
+                    logger.info(f"INFO: Pooled connection to {url_parts.hostname} was closed by server. Reconnecting. DETAILS: {e}")
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release_connection(pool_key, connection, proxy_headers)
+            return response, response_body
+
+    def _header_block(self, response):
+        """
+        Formats the status line and headers the same way curl -i prints them
+        """
+        version = "HTTP/1.0" if response.version == 10 else "HTTP/1.1"
+        lines = [f"{version} {response.status} {response.reason}"]
+        for key, value in response.getheaders():
+            lines.append(f"{key}: {value}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    def send(self, prepared_request):
+        """
+        Sends the prepared request in process
+        :param prepared_request: dict built by CurlRequests.prepare_request
+        :return: CurlResponse
+        """
+        method = prepared_request["method"]
+        url = prepared_request["url"]
+        body = prepared_request["body"]
+        headers = prepared_request["headers"]
+        header_blocks = []
+
+        for redirect_count in range(self.max_redirects + 1):
+            response, response_body = self._send_once(method, url, headers, body, prepared_request["proxy"], prepared_request["timeout"], prepared_request["connect_timeout"])
+
+            header_blocks.append(self._header_block(response))
+
+            location = response.getheader("Location")
+            if not (prepared_request["follow_redirects"] and response.status in REDIRECT_CODES and location):
+                break
+
+            # Same as curl --location: 303 always switches to GET, 301/302 switch a POST to GET unless the method was forced with -X
+            if response.status == 303 or (response.status in (301, 302) and method == "POST" and not prepared_request["method_forced"]):
+                method = "GET"
+                body = None
+                headers = {key: value for key, value in headers.items() if key.lower() not in ("content-type", "content-length")}
+            url = urljoin(url, location)
+
+        if prepared_request["download_file"]:
+            file_name = os.path.basename(urlsplit(url).path) or "index.html"
+            with open(file_name, 'wb') as downloaded_file:
+                downloaded_file.write(response_body)
+            return CurlResponse(header_blocks, include=prepared_request["include"])
+
+        return CurlResponse(header_blocks, response_body, include=prepared_request["include"])
+
+
+def quote_config_value(value):
+    """
+    Quotes a value for a curl config file. Inside double quotes curl understands backslash escapes
+    :param value:
+    :return:
+    """
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    value = value.replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+    return f'"{value}"'
+
+
+def parse_transfer_results(write_out):
+    """
+    Reads the lines the transfers of a batch printed with write-out ("<index> <exit code> <error message>")
+    :param write_out: stdout of the batch's curl process
+    :return: {index: (exit code, error message bytes)}
+    """
+    results = {}
+    for line in write_out.splitlines():
+        parts = line.split(b" ", 2)
+        try:
+            results[int(parts[0])] = (int(parts[1]), parts[2] if len(parts) > 2 else b'')
+        except (IndexError, ValueError):
+            continue
+    return results
+
+
+def urlencode_form_data(form_data):
+    """
+    Applies the same encoding rules as curl --data-urlencode
+    "name=content" encodes only the content, "=content" and "content" encode everything
+    :param form_data:
+    :return:
+    """
+    if "=" not in form_data:
+        return quote_plus(form_data)
+
+    name, content = form_data.split("=", 1)
+    if not name:
+        return quote_plus(content)
+    return f"{name}={quote_plus(content)}"
@@ -0,0 +1,105 @@
+import re
+from html import unescape
+from urllib.parse import urljoin, urlencode
+
+FORM_REGEX = re.compile(r'<form\b([^>]*)>', flags=re.IGNORECASE)
+INPUT_REGEX = re.compile(r'<input\b([^>]*)>', flags=re.IGNORECASE)
+SELECT_REGEX = re.compile(r'<select\b([^>]*)>(.*?)</select>', flags=re.IGNORECASE | re.DOTALL)
+OPTION_REGEX = re.compile(r'<option\b([^>]*)>', flags=re.IGNORECASE)
+ATTRIBUTE_REGEX = re.compile(r'([\w:.-]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+)))?')
+
+
+def get_attributes(tag_attributes):
+    """
+    :param tag_attributes: attribute part of a tag, eg ' type="hidden" name="__VIEWSTATE" value="..."'
+    :return: dict of lower case attribute names to unescaped values. Attributes without a value (selected, checked) map to ""
+    """
+    attributes = {}
+    for name, double_quoted, single_quoted, bare in ATTRIBUTE_REGEX.findall(tag_attributes):
+        attributes[name.lower()] = unescape(double_quoted or single_quoted or bare)
+    return attributes
+
+
+class WebForm:
+    """
+    The form of an ASP.NET WebForms page, read from its html so its postbacks can be replayed with plain POSTs
+    instead of clicking through the page in a browser.
+    Every postback has to carry the state fields of the page it was made from (__VIEWSTATE, __EVENTVALIDATION, ...),
+    so build a new WebForm from each response before the next postback
+    """
+
+    def __init__(self, page, page_url):
+        """
+        :param page: html of the page
+        :param page_url: url the page was fetched from. The form's action is relative to it
+        """
+        self.fields = {}  # Sent with every postback: hidden and text inputs, checked boxes, selected options
+        self.buttons = {}  # Submit inputs. Only the one clicked is sent
+        self.selects = {}  # Option values of each drop down
+
+        form_match = FORM_REGEX.search(page)
+        action = get_attributes(form_match.group(1)).get("action") if form_match else None
+        self.action = urljoin(page_url, action) if action else page_url
+
+        for input_match in INPUT_REGEX.finditer(page):
+            attributes = get_attributes(input_match.group(1))
+            name = attributes.get("name")
+            if not name:
+                continue
+            input_type = attributes.get("type", "text").lower()
+            if input_type in ("submit", "button", "image"):
+                self.buttons[name] = attributes.get("value", "")
+            elif input_type in ("checkbox", "radio"):
+                if "checked" in attributes:
+                    self.fields[name] = attributes.get("value", "on")
+            else:
+                self.fields[name] = attributes.get("value", "")
+
+        for select_match in SELECT_REGEX.finditer(page):
+            name = get_attributes(select_match.group(1)).get("name")
+            if not name:
+                continue
+            options = [get_attributes(option_match.group(1)) for option_match in OPTION_REGEX.finditer(select_match.group(2))]
+            self.selects[name] = [option.get("value", "") for option in options]
+            selected = [option for option in options if "selected" in option] or options[:1]
+            if selected:
+                self.fields[name] = selected[0].get("value", "")
+
+    def select(self, value):
+        """
+        Picks value in the drop down that offers it
+        :return: name of the drop down, None when no drop down has the value
+        """
+        for name, values in self.selects.items():
+            if value in values:
+                self.fields[name] = value
+                return name
+        return None
+
+    def find_button(self, name_contains, value=None):
+        """
+        :return: name of the first submit input whose name contains name_contains (and whose value is value, when given)
+        """
+        for name, button_value in self.buttons.items():
+            if name_contains in name and (value is None or button_value == value):
+                return name
+        return None
+
+    def submit(self, button_name):
+        """
+        Body of the POST sent when button_name is clicked
+        :return: url encoded form data
+        """
+        fields = dict(self.fields)
+        fields[button_name] = self.buttons.get(button_name, "")
+        return urlencode(fields)
+
+    def postback(self, event_target, event_argument=""):
+        """
+        Body of the POST that javascript:__doPostBack(event_target, event_argument) sends, eg a grid pager link
+        :return: url encoded form data
+        """
+        fields = dict(self.fields)
+        fields["__EVENTTARGET"] = event_target
+        fields["__EVENTARGUMENT"] = event_argument
+        return urlencode(fields)
@@ -1,14 +1,16 @@
-import os
-import re
 import json
-import pickle
+import threading
+from collections import deque
 from urllib.parse import quote_plus
-from CurlScraper.CoreLibrary.PyCurlRequest import CurlRequests
-from LoggingModule import set_logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from CurlScraper.CoreLibrary.ProxyPool import ProxyPool
+from CurlScraper.CoreLibrary.Pagination import IncompleteResultsError
+from CurlScraper.CoreLibrary.SiteClient import SiteClient
+from LoggingModule import set_logging, LazyJson
 
 logger = set_logging()
 
-class DCHealth:
+class DCHealth(SiteClient):
     """
     Method for transferring data via curl to the DC health site
     """
@@ -16,14 +18,25 @@ class DCHealth:
     MAIN_PAGE = "https://doh.force.com/ver/s/"
     LICENSE_SEARCH_URL = "https://doh.force.com/ver/s/sfsites/aura?r=5&other.SearchComponent.searchRecords=1&other.SearchComponent.searchRecordsCount=1"
     DIRECTORY_SEARCH_PAGE = "https://doh.force.com/ver/s/sfsites/aura?r=1&other.SearchComponent.searchRemainingRecords=1"
+    RECORD_COUNT_URL = "https://doh.force.com/ver/s/sfsites/aura?r=1&other.SearchComponent.searchRecordsCount=1"
+    PAGE_SIZE = 25  # Records returned per searchRemainingRecords offset
+    # Rest of the form data of every aura request
+    AURA_CONTEXT_DATA = "aura.context=%7B%22mode%22%3A%22PROD%22%2C%22fwuid%22%3A%22Q8onN6EmJyGRC51_NSPc2A%22%2C%22app%22%3A%22siteforce%3AcommunityApp%22%2C%22loaded%22%3A%7B%22APPLICATION%40markup%3A%2F%2Fsiteforce%3AcommunityApp%22%3A%22zaAlQavgK5QD4CF76KJj6A%22%7D%2C%22dn%22%3A%5B%5D%2C%22globals%22%3A%7B%7D%2C%22uad%22%3Afalse%7D&aura.pageURI=%2Fver%2Fs%2F&aura.token=undefined"
+    # Aura requests carry the session from the main page, so keep them on the proxy that opened it
+    STICKY_PROXY = True
+    AUTH_FAILURE_MARKERS = ("aura:invalidSession", "aura:clientOutOfSync")
 
     def __init__(self, cookies_dict=None, curl_proxy=None):
         if not cookies_dict:
             self.cookies_dict = {}
         else:
             self.cookies_dict = cookies_dict
-        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER
+        if isinstance(curl_proxy, (list, tuple)):
+            curl_proxy = ProxyPool(curl_proxy, sticky=self.STICKY_PROXY)
+        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER, a list of them or a ProxyPool shared with other instances
         self.username = self.SITE_NAME
+        self.requester = None
+        self.session = self.get_session()
 
         self.set_cookies_dict()
 
@@ -32,16 +45,9 @@ class DCHealth:
         Loads cookies from disk if available, for sending requests
         :return:
         """
-        logger.info(f"INFO: LOADING COOKIE FROM DISK")
-        cookie = None
-        if os.path.exists(f'{self.username}.cookie'):
-            logger.info(f"\nINFO: Cookie present on disk! Loading into program.")
-            with open(f'{self.username}.cookie', 'rb') as cookie_store:
-                cookie = pickle.load(cookie_store)
-                if cookie:
-                    logger.info("INFO: Cookie loaded from disk")
-                    self.cookies_dict = cookie
-
+        cookie = self.session.load()
+        if cookie:
+            self.cookies_dict = cookie
         return cookie
 
     def save_cookie_to_disk(self, cookies_dict):
@@ -50,38 +56,21 @@ class DCHealth:
         :param cookies_dict:
         :return:
         """
-        logger.info(f"\nINFO: SAVING COOKIES TO DISK")
-        with open(f'{self.username}.cookie', 'wb') as cookie_store:
-            pickle.dump(cookies_dict, cookie_store)
-            logger.info("INFO: Cookie saved")
+        self.session.update(cookies_dict)
+        self.session.flush()
 
     def set_cookies_dict(self, curl_proxy=None):
         """
-        Check if cookies are stored on local machine before trying to get a new one
+        Gets the session cookies. The site is only asked for new ones when the stored cookies are missing or about to expire
         :return:
         """
-        logger.info(f"\nINFO: SETTING COOKIES FOR SESSION")
         if curl_proxy:
             proxy = curl_proxy
         else:
             proxy = self.curl_proxy
 
-        if self.cookies_dict:
-            logger.info(f"INFO: Cookies passed in to init. Will merge with ones from disk or new ones from site")
-
-        cookie_dict_from_disk = self.load_cookie_from_disk()
-        if cookie_dict_from_disk:
-            # Merge cookies from disk to the ones passed
-            logger.info(f"INFO: Merging cookies from disk to new cookies")
-            cookie_dict_from_disk.update(self.cookies_dict)
-            self.cookies_dict = cookie_dict_from_disk
-            logger.info(f"\nINFO: Cookies found from disk + merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-
-        # This process will get cookies from site and add in the new values to the self.cookies dict from init (which may be empty or contain some key-value pairs)
-        headers_dict = self.get_site_request_headers()
-        curl = CurlRequests(cookies_dict=self.cookies_dict, headers_dict=headers_dict)
-        response = curl.send_curl_request(request_url=self.MAIN_PAGE, page_redirects=True, include=True, proxy=proxy)
-        self.add_cookies_from_site_response(response)
+        self.session.add_caller_cookies(self.cookies_dict)
+        self.cookies_dict = self.session.ensure_warm(self.get_requester(), proxy)
 
         return
 
@@ -91,33 +80,8 @@ class DCHealth:
         :param response:
         :return:
         """
-        logger.info(f"\nINFO: ADDING COOKIES FROM SITE RESPONSE")
-        cookie_regex = re.compile(r'Set-Cookie:\s(.*?=.*?);', flags=re.IGNORECASE)
-        cookies_list = cookie_regex.findall(str(response))
-
-        logger.info(f"INFO: Found cookies to add {cookies_list}")
-
-        cookie_dict_regex = re.compile(r'(.*?)=(.*)')
-        for cookie in cookies_list:
-            try:
-                name = cookie_dict_regex.search(cookie).group(1).strip()
-                logger.info(f"INFO: Found cookie: {name}")
-            except:
-                logger.info(f"ERROR Extracting cookie name")
-                name = None
-
-            try:
-                value = cookie_dict_regex.search(cookie).group(2).strip()
-                logger.info(f"INFO: Found value of cookie {name}: {value}")
-            except:
-                logger.info(f"ERROR Extracting cookie value")
-                value = None
-
-            if name not in self.cookies_dict.keys():
-                self.cookies_dict[name] = value
-
-        logger.info(f"\nINFO: Cookies found from site response+ merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-        self.save_cookie_to_disk(self.cookies_dict)
+        self.session.add_cookies_from_response(response)
+        self.cookies_dict = self.session.cookies()
 
     def get_site_request_headers(self):
         """
@@ -156,33 +120,133 @@ class DCHealth:
         else:
             proxy = self.curl_proxy
 
-        headers_dict = self.get_site_request_headers()
         data = self.get_request_data(license_number)
 
-        requester = CurlRequests(self.cookies_dict, headers_dict=headers_dict)
-        response = requester.send_curl_request(self.LICENSE_SEARCH_URL, proxy=proxy, page_redirects=True, form_data=data)
+        requester = self.get_requester()
+        response = self.session.send(requester, self.LICENSE_SEARCH_URL, proxy=proxy, page_redirects=True, form_data=data)
 
         actions = response.get("actions")
         if actions:
             if len(actions) > 0:
-                user_info = actions[1]
-                state = user_info.get("state")
-                logger.info(f"INFO: Request state: {state}")
-                if state == "ERROR":
-                    errors = user_info.get("error")
-                    if len(errors) > 0:
-                        error = errors[0]
-                        logger.info(f"ERROR: Request did not complete. DETAILS: {error}")
-                        return license_info
-
-                returnValue = user_info.get("returnValue")
-                if len(returnValue) > 0:
-                    for key, value in returnValue[0].items():
-                        key = key.replace("__c", "")
-                        license_info[key] = value
+                license_info, _ = self.parse_license_action(actions[1])
 
         return license_info
 
+    def parse_license_action(self, user_info):
+        """
+        Gets the license json from the searchRecords action of a response
+        :param user_info: the action's entry in the response actions
+        :return: (license info dict, True when the action came back in an ERROR state)
+        """
+        license_info = {}
+        state = user_info.get("state")
+        logger.info(f"INFO: Request state: {state}")
+        if state == "ERROR":
+            errors = user_info.get("error")
+            if errors:
+                logger.info(f"ERROR: Request did not complete. DETAILS: {errors[0]}")
+            return license_info, True
+
+        returnValue = user_info.get("returnValue")
+        if returnValue:
+            for key, value in returnValue[0].items():
+                key = key.replace("__c", "")
+                license_info[key] = value
+
+        return license_info, False
+
+    def get_batch_request_data(self, license_numbers):
+        """
+        Forms the request data for a batch of licenses: one searchRecords action per license, in a single aura message.
+        Action ids are the license's position in the batch
+        :param license_numbers:
+        :return:
+        """
+        actions = []
+        for idx, license_number in enumerate(license_numbers):
+            actions.append({
+                "id": f"{idx};a",
+                "descriptor": "apex://SearchComponentController/ACTION$searchRecords",
+                "callingDescriptor": "markup://c:SearchComponent",
+                "params": {"Profession": "0", "LicenseType": "0", "FirstName": "", "LastName": "", "LicenseNumber": license_number,
+                           "SSN": "", "Status": "0"}
+            })
+        message = json.dumps({"actions": actions}, separators=(",", ":"))
+        return f"message={quote_plus(message)}&{self.AURA_CONTEXT_DATA}"
+
+    def get_license_info_many(self, license_numbers, curl_proxy=None, batch_size=10, max_batch_size=50, max_payload_bytes=64 * 1024, max_error_rate=0.5):
+        """
+        Gets details of many licenses, several per aura request.
+        The batch size adapts: it grows by one after every clean batch and is halved when too many of its actions fail or
+        the request fails or comes back short of actions. A failed request also lowers max_batch_size below its size.
+        Batches are cut down to fit max_payload_bytes. The licenses of a failed batch are sent again in smaller batches
+        :param license_numbers:
+        :param curl_proxy:
+        :param batch_size: Licenses in the first batch
+        :param max_batch_size:
+        :param max_payload_bytes: Largest request body to send
+        :param max_error_rate: Fraction of failed actions above which the batch is split up and its failed licenses sent again
+        :return: dict of {license number: license info}. Licenses the site could not give are {}
+        """
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        requester = self.get_requester()
+        license_details = {}
+        pending = deque(license_numbers)
+
+        while pending:
+            batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+            data = self.get_batch_request_data(batch)
+            if len(batch) > 1 and len(data) > max_payload_bytes:
+                while len(batch) > 1 and len(data) > max_payload_bytes:
+                    pending.appendleft(batch.pop())
+                    data = self.get_batch_request_data(batch)
+                batch_size = len(batch)
+
+            logger.info(f"INFO: Getting {len(batch)} licenses in one request. {len(pending)} left")
+            response = self.session.send(requester, self.LICENSE_SEARCH_URL, proxy=proxy, page_redirects=True, form_data=data, verbose=False)
+            actions = response.get("actions") if isinstance(response, dict) else None
+
+            if not actions or len(actions) != len(batch):
+                if len(batch) == 1:
+                    logger.info(f"ERROR: Could not get license {batch[0]}")
+                    license_details[batch[0]] = {}
+                    continue
+                # Likely over a server side limit, so never grow back to this size
+                max_batch_size = min(max_batch_size, len(batch) - 1)
+                batch_size = max(1, len(batch) // 2)
+                logger.info(f"ERROR: Batch of {len(batch)} licenses failed. Sending them again {batch_size} at a time")
+                pending.extendleft(reversed(batch))
+                continue
+
+            # Split the actions back per license. Ids are the position in the batch, fall back to response order
+            actions_by_idx = {}
+            for position, user_info in enumerate(actions):
+                try:
+                    idx = int(str(user_info.get("id", "")).split(";")[0])
+                except ValueError:
+                    idx = position
+                actions_by_idx[idx] = user_info
+
+            failed = []
+            for idx, license_number in enumerate(batch):
+                license_info, error = self.parse_license_action(actions_by_idx.get(idx, {"state": "ERROR"}))
+                license_details[license_number] = license_info
+                if error:
+                    failed.append(license_number)
+
+            if len(batch) > 1 and len(failed) / len(batch) > max_error_rate:
+                batch_size = max(1, len(batch) // 2)
+                logger.info(f"INFO: {len(failed)} of {len(batch)} licenses failed. Sending them again {batch_size} at a time")
+                pending.extendleft(reversed(failed))
+            elif not failed:
+                batch_size = min(max_batch_size, batch_size + 1)
+
+        return license_details
+
     def get_request_data(self, license_number):
         """
         Forms the url encoded request data needed for the request
@@ -203,57 +267,209 @@ class DCHealth:
         data = f'message=%7B%22actions%22%3A%5B%7B%22id%22%3A%22187%3Ba%22%2C%22descriptor%22%3A%22apex%3A%2F%2FSearchComponentController%2FACTION%24searchRemainingRecords%22%2C%22callingDescriptor%22%3A%22markup%3A%2F%2Fc%3APageCount%22%2C%22params%22%3A%7B%22Profession%22%3A%220%22%2C%22LicenseType%22%3A%22{license_type}%22%2C%22FirstName%22%3A%22%22%2C%22LastName%22%3A%22%22%2C%22LicenseNumber%22%3A%22%22%2C%22SSN%22%3A%22%22%2C%22Status%22%3A%220%22%2C%22offsetCnt%22%3A%22{offsetCnt}%22%7D%2C%22version%22%3Anull%7D%5D%7D&aura.context=%7B%22mode%22%3A%22PROD%22%2C%22fwuid%22%3A%22Q8onN6EmJyGRC51_NSPc2A%22%2C%22app%22%3A%22siteforce%3AcommunityApp%22%2C%22loaded%22%3A%7B%22APPLICATION%40markup%3A%2F%2Fsiteforce%3AcommunityApp%22%3A%22zaAlQavgK5QD4CF76KJj6A%22%7D%2C%22dn%22%3A%5B%5D%2C%22globals%22%3A%7B%7D%2C%22uad%22%3Afalse%7D&aura.pageURI=%2Fver%2Fs%2F&aura.token=undefined'
         return data
 
-    def get_all_licenses(self, license_type, curl_proxy=None, page_limit=None):
+    def get_count_data(self, license_type):
         """
-        Gets all the licenses available on the site
+        Forms data portion of the request for the number of records of a license type (searchRecordsCount action)
         :param license_type:
-        :param page_limit:
         :return:
         """
-        licenses_list = []
+        license_type = quote_plus(license_type)
+        data = f'message=%7B%22actions%22%3A%5B%7B%22id%22%3A%22138%3Ba%22%2C%22descriptor%22%3A%22apex%3A%2F%2FSearchComponentController%2FACTION%24searchRecordsCount%22%2C%22callingDescriptor%22%3A%22markup%3A%2F%2Fc%3ASearchComponent%22%2C%22params%22%3A%7B%22Profession%22%3A%220%22%2C%22LicenseType%22%3A%22{license_type}%22%2C%22FirstName%22%3A%22%22%2C%22LastName%22%3A%22%22%2C%22LicenseNumber%22%3A%22%22%2C%22SSN%22%3A%22%22%2C%22Status%22%3A%220%22%7D%7D%5D%7D&aura.context=%7B%22mode%22%3A%22PROD%22%2C%22fwuid%22%3A%22Q8onN6EmJyGRC51_NSPc2A%22%2C%22app%22%3A%22siteforce%3AcommunityApp%22%2C%22loaded%22%3A%7B%22APPLICATION%40markup%3A%2F%2Fsiteforce%3AcommunityApp%22%3A%22zaAlQavgK5QD4CF76KJj6A%22%7D%2C%22dn%22%3A%5B%5D%2C%22globals%22%3A%7B%7D%2C%22uad%22%3Afalse%7D&aura.pageURI=%2Fver%2Fs%2F&aura.token=undefined'
+        return data
+
+    def get_record_count(self, license_type, curl_proxy=None):
+        """
+        Asks the site how many records there are for a license type
+        :param license_type:
+        :param curl_proxy:
+        :return: number of records, or None when the site did not give one
+        """
         if curl_proxy:
             proxy = curl_proxy
         else:
             proxy = self.curl_proxy
 
-        headers_dict = self.get_site_request_headers()
+        requester = self.get_requester()
+        data = self.get_count_data(license_type)
+        response = self.session.send(requester, self.RECORD_COUNT_URL, proxy=proxy, page_redirects=True, form_data=data)
+
+        actions = response.get("actions")
+        if not actions:
+            logger.info(f"ERROR: No actions in record count response")
+            return None
+
+        user_info = actions[0]
+        state = user_info.get("state")
+        if state == "ERROR":
+            logger.info(f"ERROR: Record count request did not complete. DETAILS: {user_info.get('error')}")
+            return None
+
+        try:
+            record_count = int(user_info.get("returnValue"))
+        except (TypeError, ValueError):
+            logger.info(f"ERROR: Could not read record count from {user_info.get('returnValue')}")
+            return None
+
+        logger.info(f"INFO: {record_count} records of type {license_type}")
+        return record_count
+
+    def parse_search_response(self, response):
+        """
+        Gets the records from a searchRemainingRecords response
+        :param response:
+        :return: (list of license dicts, True when the site answered with an ERROR state)
+        """
+        records = []
+        actions = response.get("actions")
+        if actions:
+            if len(actions) > 0:
+                user_info = actions[0]
+                state = user_info.get("state")
+                logger.info(f"INFO: Request state: {state}")
+                if state == "ERROR":
+                    errors = user_info.get("error")
+                    if len(errors) > 0:
+                        error = errors[0]
+                        logger.info(f"ERROR: Request did not complete. DETAILS: {error}")
+                    return records, True
+
+                logger.info(f"INFO: STATE: {state}")  # Success state
+                returnValue = user_info.get("returnValue")  # List of the results of the query
+                if returnValue:
+                    # Iterate through all the return values on this case
+                    for record in returnValue:
+                        # Cleaning up the records before adding to the main list
+                        license_info = {}
+                        for key, value in record.items():
+                            key = key.replace("__c", "")
+                            license_info[key] = value
+                        records.append(license_info)
+                        logger.debug("%s", LazyJson(license_info))
+
+        return records, False
+
+    def get_all_licenses(self, license_type, curl_proxy=None, page_limit=None, parallel=False, max_in_flight=8):
+        """
+        Gets all the licenses available on the site
+        :param license_type:
+        :param page_limit: Only get this many offsets (pages of 25). Used by the parallel mode
+        :param parallel: Get the record count first and fetch every offset concurrently, see iter_all_licenses.
+        Falls back to walking the offsets one by one when the site does not give a count
+        :param max_in_flight: Offsets fetched at the same time in parallel mode
+        :return: list of license dicts. In parallel mode IncompleteResultsError is raised when offsets are still missing
+        after their retries, with what was got in its results
+        """
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        if parallel:
+            pages = {}
+            try:
+                for offsetCnt, records in self.iter_all_licenses(license_type, proxy, page_limit, max_in_flight):
+                    if records is None:
+                        break
+                    pages[offsetCnt] = records
+                else:
+                    # Reassemble in site order
+                    licenses_list = [record for offsetCnt in sorted(pages) for record in pages[offsetCnt]]
+                    logger.info(f"\nINFO: Total number of results {len(licenses_list)}")
+                    return licenses_list
+            except IncompleteResultsError as e:
+                e.results = [record for offsetCnt in sorted(pages) for record in pages[offsetCnt]]
+                logger.info(f"ERROR: {license_type} is incomplete, offsets {e.missing} failed. Got {len(e.results)} results")
+                raise
+
+        licenses_list = []
+        requester = self.get_requester()
 
         error_state = False
 
         offsetCnt = 0
         while error_state is False:
-            requester = CurlRequests(self.cookies_dict, headers_dict=headers_dict)
             data = self.get_search_data(license_type, offsetCnt)
 
-            response = requester.send_curl_request(self.DIRECTORY_SEARCH_PAGE, proxy=proxy, page_redirects=True, form_data=data)
-            actions = response.get("actions")
-            if actions:
-                if len(actions) > 0:
-                    user_info = actions[0]
-                    state = user_info.get("state")
-                    logger.info(f"INFO: Request state: {state}")
-                    if state == "ERROR":
-                        errors = user_info.get("error")
-                        if len(errors) > 0:
-                            error = errors[0]
-                            logger.info(f"ERROR: Request did not complete. DETAILS: {error}")
-                            error_state = True
-                    else:
-                        logger.info(f"INFO: STATE: {state}")  # Success state
-                        returnValue = user_info.get("returnValue")  # List of the results of the query
-                        if len(returnValue) > 0:
-                            # Iterate through all the return values on this case
-                            for record in returnValue:
-                                # Cleaning up the records before adding to the main list
-                                license_info = {}
-                                for key, value in record.items():
-                                    key = key.replace("__c", "")
-                                    license_info[key] = value
-                                licenses_list.append(license_info)
-                                logger.info(json.dumps(license_info, indent=2))
+            response = self.session.send(requester, self.DIRECTORY_SEARCH_PAGE, proxy=proxy, page_redirects=True, form_data=data)
+            records, error_state = self.parse_search_response(response)
+            licenses_list.extend(records)
 
             logger.info(f"INFO: Number of results found after scraping current offset ({offsetCnt}) {len(licenses_list)}")
-            offsetCnt = offsetCnt + 25
-
-        logger.info(f"\nINFO: Total number of results {offsetCnt}")
+            if not response.get("actions"):
+                # Empty or blocked answer. Asking for the next offset would get the same, so stop here
+                logger.info(f"WARNING: No actions in the response for offset {offsetCnt}. Stopping with {len(licenses_list)} results")
+                break
+            if len(records) < self.PAGE_SIZE:
+                # An empty or short page is the last one
+                break
+            offsetCnt = offsetCnt + self.PAGE_SIZE
+
+        logger.info(f"\nINFO: Total number of results {len(licenses_list)}")
         return licenses_list
+
+    def iter_all_licenses(self, license_type, curl_proxy=None, page_limit=None, max_in_flight=8):
+        """
+        Gets the record count, plans every offset up front and fetches them concurrently, so no request is sent past
+        the last page. Requests go through the session and rate limiter like any other.
+        An offset the site fails to give (no answer, or an ERROR state) is fetched again with the requester's RetryPolicy.
+        Pages are yielded as they arrive, sort by offset for site order. Offsets still missing after their retries are
+        not yielded, IncompleteResultsError is raised with them once every other page is out.
+        Closing the generator early cancels the offsets not started yet
+        :param license_type:
+        :param curl_proxy:
+        :param page_limit: Only get this many offsets
+        :param max_in_flight: Offsets fetched at the same time
+        :return: Generator of (offsetCnt, list of license dicts) tuples, in completion order.
+        Yields a single (None, None) when the site did not give a record count
+        """
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        record_count = self.get_record_count(license_type, proxy)
+        if record_count is None:
+            yield None, None
+            return
+
+        offsets = list(range(0, record_count, self.PAGE_SIZE))
+        if page_limit:
+            offsets = offsets[:page_limit]
+        logger.info(f"INFO: Fetching {len(offsets)} offsets of {license_type}, {max_in_flight} at a time")
+
+        requester = self.get_requester()
+        closed = threading.Event()
+
+        def fetch_offset_once(offsetCnt):
+            data = self.get_search_data(license_type, offsetCnt)
+            response = self.session.send(requester, self.DIRECTORY_SEARCH_PAGE, proxy=proxy, page_redirects=True, form_data=data, verbose=False)
+            if not response.get("actions"):
+                raise ValueError("no actions in response")
+            records, error_state = self.parse_search_response(response)
+            if error_state:
+                raise ValueError("site answered with an ERROR state")
+            return records
+
+        def fetch_offset(offsetCnt):
+            return requester.retry_policy.call(lambda: fetch_offset_once(offsetCnt), f"offset {offsetCnt}", should_stop=closed.is_set)
+
+        failed_offsets = []
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        try:
+            futures = {executor.submit(fetch_offset, offsetCnt): offsetCnt for offsetCnt in offsets}
+            for future in as_completed(futures):
+                offsetCnt = futures[future]
+                try:
+                    records = future.result()
+                except Exception as e:
+                    logger.info(f"ERROR: Could not get offset {offsetCnt}. DETAILS: {e}")
+                    failed_offsets.append(offsetCnt)
+                    continue
+                logger.info(f"INFO: Got {len(records)} results at offset {offsetCnt}")
+                yield offsetCnt, records
+        finally:
+            closed.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if failed_offsets:
+            raise IncompleteResultsError(failed_offsets)
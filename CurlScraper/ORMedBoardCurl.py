@@ -1,27 +1,97 @@
-import os
 import re
 import json
-import pickle
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
 from CurlScraper.CoreLibrary.PyCurlRequest import CurlRequests
+from CurlScraper.CoreLibrary.RequestTemplate import RequestTemplate
+from CurlScraper.CoreLibrary.ProxyPool import ProxyPool
+from CurlScraper.CoreLibrary.SiteClient import SiteClient
+from CurlScraper.CoreLibrary.PageExtractor import PageScanner, LabelRule, RegionRule, ScanResult
+from CurlScraper.CoreLibrary.ParsePipeline import ParsePipeline
 from LoggingModule import set_logging
 
 logger = set_logging()
 
-class ORMedBoard:
+# Extraction spec of the license details page. Compiled once, all the fields come out of one pass over the page
+LICENSE_PAGE_SCANNER = PageScanner([
+    LabelRule(anchor=r'<span\s+id="ctl00_ContentPlaceHolder1_(.+?)\W>',
+              value=r'\W>(.+?)<',
+              reject="/span"),
+    RegionRule("Address",
+               region=r'id="ctl00_ContentPlaceHolder1_VerificationAddress"[\s\S]*?</tr><tr>\s+<td>([\s\S]*?)</table>',
+               item=r'tr>\s+<td>([\s\S]*?)</td>\s+</tr>',
+               value_replacements=(("</td>", ""), ("<td>", ""), ("  ", ""), ("\n", " "))),
+])
+# Cleanups turning element ids into field names, applied in order
+FIELD_NAME_REPLACEMENTS = (("dtgLicense_ctl02_lbl", ""), ("dtgEducation_ctl02_", ""), ("lbl", ""))
+DROPPED_FIELDS = ("dtgLicense_ctl02_ObjectPK\" class=\"hidden",)
+
+ENTITY_ID_REGEX = re.compile(r'EntityID=(\d+)')
+SCRIPT_SRC_REGEX = re.compile(r'<script[^>]+src="([^"]+)"', flags=re.IGNORECASE)
+# Url strings in the search page's scripts that look like the endpoint c.search(page.number) posts to
+SEARCH_ENDPOINT_REGEX = re.compile(r'["\'](/[\w/.-]*api[\w/.-]*search[\w/.-]*)["\']', flags=re.IGNORECASE)
+
+
+def parse_license_page(page_html_response, license_number=None):
+    """
+    Gets the license json from a license details page
+    :param page_html_response: html of the page
+    :param license_number: Not needed for this site, accepted so the function fits ParsePipeline
+    :return: dict
+    """
+    scan = LICENSE_PAGE_SCANNER.scan(page_html_response)
+
+    # First value found for each element id
+    first_values = {}
+    for field, value in scan.labels:
+        if value is not ScanResult.MISSING and field not in first_values:
+            first_values[field] = value
+
+    license_info = {}
+    for field, _ in scan.labels:
+        field_value = first_values.get(field)
+        if field not in first_values:
+            logger.info(f"ERROR: Could not extract field value of {field} from page source")
+        for old, new in FIELD_NAME_REPLACEMENTS:
+            field = field.replace(old, new)
+        license_info[field] = field_value
+
+    if "Address" in scan.regions:
+        for idx, address in enumerate(scan.regions["Address"], 1):
+            license_info[f"Address{idx}"] = address
+    else:
+        logger.info(f"ERROR: Could not extract address_group using this regex")
+
+    for field in DROPPED_FIELDS:
+        license_info.pop(field, None)
+
+    return license_info
+
+
+class ORMedBoard(SiteClient):
     """
     Method for transferring data via curl to the AR Med Board site
     """
     SITE_NAME = "ORMedBoard"
     MAIN_PAGE = "https://techmedweb.omb.state.or.us"
     LICENSE_SEARCH_URL = "https://techmedweb.omb.state.or.us/Clients/ORMB/Public/VerificationDetails.aspx?EntityID="
+    DIRECTORY_SEARCH_PAGE = "https://techmedweb.omb.state.or.us/search"
+    SEARCH_PAGE_SIZE = 10  # Results per page of the search grid
+    _search_request_template = None
+    _search_api_url = None  # Endpoint found by find_search_api_url, shared by all instances
 
     def __init__(self, cookies_dict=None, curl_proxy=None):
         if not cookies_dict:
             self.cookies_dict = {}
         else:
             self.cookies_dict = cookies_dict
-        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER
+        if isinstance(curl_proxy, (list, tuple)):
+            curl_proxy = ProxyPool(curl_proxy, sticky=self.STICKY_PROXY)
+        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER, a list of them or a ProxyPool shared with other instances
         self.username = self.SITE_NAME
+        self.requester = None
+        self.search_requester = None
+        self.session = self.get_session()
 
         self.set_cookies_dict()
 
@@ -30,16 +100,9 @@ class ORMedBoard:
         Loads cookies from disk if available, for sending requests
         :return:
         """
-        logger.info(f"INFO: LOADING COOKIE FROM DISK")
-        cookie = None
-        if os.path.exists(f'{self.username}.cookie'):
-            logger.info(f"\nINFO: Cookie present on disk! Loading into program.")
-            with open(f'{self.username}.cookie', 'rb') as cookie_store:
-                cookie = pickle.load(cookie_store)
-                if cookie:
-                    logger.info("INFO: Cookie loaded from disk")
-                    self.cookies_dict = cookie
-
+        cookie = self.session.load()
+        if cookie:
+            self.cookies_dict = cookie
         return cookie
 
     def save_cookie_to_disk(self, cookies_dict):
@@ -48,38 +111,21 @@ class ORMedBoard:
         :param cookies_dict:
         :return:
         """
-        logger.info(f"\nINFO: SAVING COOKIES TO DISK")
-        with open(f'{self.username}.cookie', 'wb') as cookie_store:
-            pickle.dump(cookies_dict, cookie_store)
-            logger.info("INFO: Cookie saved")
+        self.session.update(cookies_dict)
+        self.session.flush()
 
     def set_cookies_dict(self, curl_proxy=None):
         """
-        Check if cookies are stored on local machine before trying to get a new one
+        Gets the session cookies. The site is only asked for new ones when the stored cookies are missing or about to expire
         :return:
         """
-        logger.info(f"\nINFO: SETTING COOKIES FOR SESSION")
         if curl_proxy:
             proxy = curl_proxy
         else:
             proxy = self.curl_proxy
 
-        if self.cookies_dict:
-            logger.info(f"INFO: Cookies passed in to init. Will merge with ones from disk or new ones from site")
-
-        cookie_dict_from_disk = self.load_cookie_from_disk()
-        if cookie_dict_from_disk:
-            # Merge cookies from disk to the ones passed
-            logger.info(f"INFO: Merging cookies from disk to new cookies")
-            cookie_dict_from_disk.update(self.cookies_dict)
-            self.cookies_dict = cookie_dict_from_disk
-            logger.info(f"\nINFO: Cookies found from disk + merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-
-        # This process will get cookies from site and add in the new values to the self.cookies dict from init (which may be empty or contain some key-value pairs)
-        headers_dict = self.get_site_request_headers()
-        curl = CurlRequests(cookies_dict=self.cookies_dict, headers_dict=headers_dict)
-        response = curl.send_curl_request(request_url=self.MAIN_PAGE, page_redirects=True, include=True, proxy=proxy)
-        self.add_cookies_from_site_response(response)
+        self.session.add_caller_cookies(self.cookies_dict)
+        self.cookies_dict = self.session.ensure_warm(self.get_requester(), proxy)
 
         return
 
@@ -89,33 +135,8 @@ class ORMedBoard:
         :param response:
         :return:
         """
-        logger.info(f"\nINFO: ADDING COOKIES FROM SITE RESPONSE")
-        cookie_regex = re.compile(r'Set-Cookie:\s(.*?=.*?);', flags=re.IGNORECASE)
-        cookies_list = cookie_regex.findall(str(response))
-
-        logger.info(f"INFO: Found cookies to add {cookies_list}")
-
-        cookie_dict_regex = re.compile(r'(.*?)=(.*)')
-        for cookie in cookies_list:
-            try:
-                name = cookie_dict_regex.search(cookie).group(1).strip()
-                logger.info(f"INFO: Found cookie: {name}")
-            except:
-                logger.info(f"ERROR Extracting cookie name")
-                name = None
-
-            try:
-                value = cookie_dict_regex.search(cookie).group(2).strip()
-                logger.info(f"INFO: Found value of cookie {name}: {value}")
-            except:
-                logger.info(f"ERROR Extracting cookie value")
-                value = None
-
-            if name not in self.cookies_dict.keys():
-                self.cookies_dict[name] = value
-
-        logger.info(f"\nINFO: Cookies found from site response+ merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-        self.save_cookie_to_disk(self.cookies_dict)
+        self.session.add_cookies_from_response(response)
+        self.cookies_dict = self.session.cookies()
 
     def get_site_request_headers(self):
         """
@@ -138,6 +159,205 @@ class ORMedBoard:
         }
         return headers_dict
 
+    def get_search_request_headers(self):
+        """
+        Headers of the search API requests the search page makes from javascript
+        :return: dictionary of curl_headers
+        """
+        headers_dict = self.get_site_request_headers()
+        for header in ("upgrade-insecure-requests", "sec-fetch-user"):
+            headers_dict.pop(header, None)
+        headers_dict.update({
+            "accept": "application/json, text/plain, */*",
+            "Content-Type": "application/json;charset=UTF-8",
+            "Origin": self.MAIN_PAGE,
+            "referer": self.DIRECTORY_SEARCH_PAGE,
+            "Sec-Fetch-Site": "same-origin",
+            "Sec-Fetch-Mode": "cors",
+            "Sec-Fetch-Dest": "empty"
+        })
+        return headers_dict
+
+    def get_search_requester(self):
+        """
+        CurlRequests instance for the search API, with its own headers. Reused by every search request of this client
+        :return:
+        """
+        cls = type(self)
+        if cls._search_request_template is None:
+            cls._search_request_template = RequestTemplate(self.get_search_request_headers())
+        if self.search_requester is None:
+            self.search_requester = CurlRequests(self.cookies_dict, template=cls._search_request_template)
+        return self.search_requester
+
+    def find_search_api_url(self, curl_proxy=None):
+        """
+        Finds the endpoint the search page's c.search(page.number) posts to, by reading the page's scripts.
+        Looked up once and shared by all instances
+        :return: url, None when the scripts do not name one
+        """
+        cls = type(self)
+        if cls._search_api_url is not None:
+            return cls._search_api_url
+
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        requester = self.get_requester()
+        response = self.session.send(requester, self.DIRECTORY_SEARCH_PAGE, proxy=proxy, page_redirects=True)
+        page = response.get('response', str(response))
+
+        search_api_url = None
+        # Inline scripts first, then the script files
+        sources = [page]
+        script_urls = [urljoin(self.DIRECTORY_SEARCH_PAGE, src) for src in SCRIPT_SRC_REGEX.findall(page)]
+        for source in sources + script_urls:
+            if source is not page:
+                script = self.session.send(requester, source, proxy=proxy, page_redirects=True, verbose=False)
+                source = script.get('response', str(script))
+            endpoint_match = SEARCH_ENDPOINT_REGEX.search(source)
+            if endpoint_match:
+                search_api_url = urljoin(self.DIRECTORY_SEARCH_PAGE, endpoint_match.group(1))
+                break
+
+        if search_api_url is None:
+            logger.info(f"ERROR: Search endpoint not found in the search page's scripts")
+            return None
+        logger.info(f"INFO: Found search endpoint {search_api_url}")
+
+        cls._search_api_url = search_api_url
+        return search_api_url
+
+    def get_search_data(self, license_type, page_number):
+        """
+        Body of the search request: the License Type filter and the page of the results grid (c.search(page.number))
+        :param license_type:
+        :param page_number: Starting at 1
+        :return:
+        """
+        return json.dumps({"filters": {"License Type": [license_type]}, "page": page_number, "pageSize": self.SEARCH_PAGE_SIZE})
+
+    def parse_search_response(self, response):
+        """
+        Gets the results of a search response
+        :param response: json response of the search API
+        :return: (list of {"EntityID": ..., "Name": ...}, total number of results or None)
+        """
+        if isinstance(response, list):
+            records = response
+            total = None
+        elif isinstance(response, dict):
+            records = []
+            total = None
+            for key, value in response.items():
+                if isinstance(value, list) and not records:
+                    records = value
+                elif "total" in key.lower() or "count" in key.lower():
+                    try:
+                        total = int(value)
+                    except (TypeError, ValueError):
+                        pass
+        else:
+            return [], None
+
+        results = []
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            entity_id = None
+            name = None
+            for key, value in record.items():
+                key = key.lower()
+                if entity_id is None and key == "entityid":
+                    entity_id = str(value)
+                elif entity_id is None and isinstance(value, str) and ENTITY_ID_REGEX.search(value):
+                    # The grid links to VerificationDetails.aspx?EntityID=...
+                    entity_id = ENTITY_ID_REGEX.search(value).group(1)
+                if name is None and "name" in key and isinstance(value, str):
+                    name = value
+            if entity_id is None:
+                logger.info("ERROR: Could not get Entity Id from search result")
+                continue
+            results.append({"EntityID": entity_id, "Name": name})
+
+        return results, total
+
+    def search_licenses(self, license_type, curl_proxy=None, max_in_flight=8, page_limit=None):
+        """
+        Gets every license of a type from the search API, without a browser.
+        Page 1 gives the number of results, the other pages are then fetched concurrently.
+        When the response has no total, pages are fetched one after another until one comes back empty.
+        The request body (get_search_data) and the response layout (parse_search_response) have not been checked against
+        a capture of the live site, so callers opt into this and keep the browser enumeration as the fallback: anything
+        that does not look like a complete answer gives None rather than a partial list
+        :param license_type: License Type filter, eg "Podiatrist"
+        :param curl_proxy:
+        :param max_in_flight: Pages fetched at the same time
+        :param page_limit: Stop after this many pages
+        :return: list of {"EntityID": ..., "Name": ...} in grid order. None when the endpoint was not found, page 1 gave
+        no results, or the results do not add up to the total
+        """
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        search_api_url = self.find_search_api_url(proxy)
+        if search_api_url is None:
+            return None
+        requester = self.get_search_requester()
+
+        def fetch_page(page_number):
+            data = self.get_search_data(license_type, page_number)
+            response = self.session.send(requester, search_api_url, proxy=proxy, data=data, specified_method="POST", verbose=False)
+            return self.parse_search_response(response)
+
+        results, total = fetch_page(1)
+        logger.info(f"INFO: Total count is {total}")
+        if not results:
+            logger.info(f"ERROR: No results in the first page of the search API for {license_type}")
+            return None
+        last_page = page_limit
+        if total is not None and results:
+            total_pages = -(-total // len(results))
+            last_page = min(total_pages, page_limit) if page_limit else total_pages
+
+        if total is not None:
+            with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+                for page_results, _ in executor.map(fetch_page, range(2, (last_page or 1) + 1)):
+                    results.extend(page_results)
+        else:
+            seen = {result["EntityID"] for result in results}
+            page_number = 1
+            page_results = results
+            while page_results and (last_page is None or page_number < last_page):
+                page_number += 1
+                page_results, _ = fetch_page(page_number)
+                # A page with nothing new means the API ignores the page number
+                page_results = [result for result in page_results if result["EntityID"] not in seen]
+                seen.update(result["EntityID"] for result in page_results)
+                results.extend(page_results)
+
+        if total is not None and not page_limit and len(results) != total:
+            logger.info(f"ERROR: Search API gave {len(results)} licenses of type {license_type}, expected {total}")
+            return None
+
+        logger.info(f"INFO: Found {len(results)} licenses of type {license_type}")
+        return results
+
+    def get_all_license_ids(self, license_type, curl_proxy=None, max_in_flight=8, page_limit=None):
+        """
+        Gets all Entity Ids of a specified type, see search_licenses
+        :param license_type:
+        :return: list of Entity Ids, None when the search API could not be used
+        """
+        results = self.search_licenses(license_type, curl_proxy, max_in_flight, page_limit)
+        if results is None:
+            return None
+        return [result["EntityID"] for result in results]
+
     def get_license_page(self, license_page_url, curl_proxy=None):
         """
         Gets details license page as html response
@@ -149,10 +369,8 @@ class ORMedBoard:
         else:
             proxy = self.curl_proxy
 
-        headers_dict = self.get_site_request_headers()
-
-        requester = CurlRequests(self.cookies_dict, headers_dict=headers_dict)
-        response = requester.send_curl_request(license_page_url, proxy=proxy, page_redirects=True)
+        requester = self.get_requester()
+        response = self.session.send(requester, license_page_url, proxy=proxy, page_redirects=True)
 
         return response
 
@@ -174,11 +392,54 @@ class ORMedBoard:
         else:
             proxy = self.curl_proxy
 
-        license_info = {}
-
         page_html_response = self.get_license_page(license_page_url, proxy)
         page_html_response = page_html_response.get('response', str(page_html_response))
 
+        return parse_license_page(page_html_response)
+
+    def get_license_info_many(self, license_numbers, curl_proxy=None, max_in_flight=10, parse_pipeline=None):
+        """
+        Gets the license json of many licenses. Pages are fetched concurrently and parsed in worker processes while
+        the next ones are being fetched
+        :param license_numbers: iterable of EntityIDs
+        :param curl_proxy:
+        :param max_in_flight: Pages being fetched at the same time
+        :param parse_pipeline: ParsePipeline for parse_license_page to reuse across calls. One is started (and shut down) for this call otherwise
+        :return: Generator of (EntityID, license info) tuples, in completion order
+        """
+        if curl_proxy:
+            proxy = curl_proxy
+        else:
+            proxy = self.curl_proxy
+
+        requester = self.get_requester()
+        requester.cookies_dict = self.session.ensure_warm(requester, proxy)
+        request_specs = ((license_number, {"request_url": f"{self.LICENSE_SEARCH_URL}{license_number}", "page_redirects": True,
+                                           "proxy": proxy, "verbose": False})
+                         for license_number in license_numbers)
+
+        def fetched_pages():
+            for license_number, response in requester.send_many(request_specs, max_in_flight=max_in_flight):
+                self.session.add_cookies_from_response(response)
+                yield license_number, response.get('response', str(response))
+
+        pipeline = parse_pipeline or ParsePipeline(parse_license_page)
+        try:
+            yield from pipeline.parse_pages(fetched_pages())
+        finally:
+            if parse_pipeline is None:
+                pipeline.shutdown()
+
+    def parse_license_page_regex(self, page_html_response, license_number=None):
+        """
+        Gets the license json from the page with one regex per field, each run over the whole page.
+        Superseded by parse_license_page, kept as the reference it is checked and benchmarked against (see BenchmarkExtractors.py)
+        :param page_html_response:
+        :param license_number:
+        :return:
+        """
+        license_info = {}
+
         field_names_regex = re.compile(r'<span\s+id="ctl00_ContentPlaceHolder1_(.+?)\W>')
         field_list = field_names_regex.findall(page_html_response)
         group_index = 0
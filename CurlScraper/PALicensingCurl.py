@@ -1,13 +1,13 @@
-import os
-import re
-import json
-import pickle
-from CurlScraper.CoreLibrary.PyCurlRequest import CurlRequests
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from CurlScraper.CoreLibrary.ProxyPool import ProxyPool
+from CurlScraper.CoreLibrary.Pagination import IncompleteResultsError
+from CurlScraper.CoreLibrary.SiteClient import SiteClient
 from LoggingModule import set_logging
 
 logger = set_logging()
 
-class PALS:
+class PALS(SiteClient):
     """
     Method for transferring data via curl to the AR Med Board site
     """
@@ -21,8 +21,12 @@ class PALS:
             self.cookies_dict = {}
         else:
             self.cookies_dict = cookies_dict
-        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER
+        if isinstance(curl_proxy, (list, tuple)):
+            curl_proxy = ProxyPool(curl_proxy, sticky=self.STICKY_PROXY)
+        self.curl_proxy = curl_proxy  # http://IPADDRESS:PORTNUMBER, a list of them or a ProxyPool shared with other instances
         self.username = self.SITE_NAME
+        self.requester = None
+        self.session = self.get_session()
 
         self.set_cookies_dict()
 
@@ -31,16 +35,9 @@ class PALS:
         Loads cookies from disk if available, for sending requests
         :return:
         """
-        logger.info(f"INFO: LOADING COOKIE FROM DISK")
-        cookie = None
-        if os.path.exists(f'{self.username}.cookie'):
-            logger.info(f"\nINFO: Cookie present on disk! Loading into program.")
-            with open(f'{self.username}.cookie', 'rb') as cookie_store:
-                cookie = pickle.load(cookie_store)
-                if cookie:
-                    logger.info("INFO: Cookie loaded from disk")
-                    self.cookies_dict = cookie
-
+        cookie = self.session.load()
+        if cookie:
+            self.cookies_dict = cookie
         return cookie
 
     def save_cookie_to_disk(self, cookies_dict):
@@ -49,38 +46,21 @@ class PALS:
         :param cookies_dict:
         :return:
         """
-        logger.info(f"\nINFO: SAVING COOKIES TO DISK")
-        with open(f'{self.username}.cookie', 'wb') as cookie_store:
-            pickle.dump(cookies_dict, cookie_store)
-            logger.info("INFO: Cookie saved")
+        self.session.update(cookies_dict)
+        self.session.flush()
 
     def set_cookies_dict(self, curl_proxy=None):
         """
-        Check if cookies are stored on local machine before trying to get a new one
+        Gets the session cookies. The site is only asked for new ones when the stored cookies are missing or about to expire
         :return:
         """
-        logger.info(f"\nINFO: SETTING COOKIES FOR SESSION")
         if curl_proxy:
             proxy = curl_proxy
         else:
             proxy = self.curl_proxy
 
-        if self.cookies_dict:
-            logger.info(f"INFO: Cookies passed in to init. Will merge with ones from disk or new ones from site")
-
-        cookie_dict_from_disk = self.load_cookie_from_disk()
-        if cookie_dict_from_disk:
-            # Merge cookies from disk to the ones passed
-            logger.info(f"INFO: Merging cookies from disk to new cookies")
-            cookie_dict_from_disk.update(self.cookies_dict)
-            self.cookies_dict = cookie_dict_from_disk
-            logger.info(f"\nINFO: Cookies found from disk + merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-
-        # This process will get cookies from site and add in the new values to the self.cookies dict from init (which may be empty or contain some key-value pairs)
-        headers_dict = self._get_site_request_headers()
-        curl = CurlRequests(cookies_dict=self.cookies_dict, headers_dict=headers_dict)
-        response = curl.send_curl_request(request_url=self.MAIN_PAGE, page_redirects=True, include=True, proxy=proxy)
-        self.add_cookies_from_site_response(response)
+        self.session.add_caller_cookies(self.cookies_dict)
+        self.cookies_dict = self.session.ensure_warm(self.get_requester(), proxy)
 
         return
 
@@ -90,35 +70,10 @@ class PALS:
         :param response:
         :return:
         """
-        logger.info(f"\nINFO: ADDING COOKIES FROM SITE RESPONSE")
-        cookie_regex = re.compile(r'Set-Cookie:\s(.*?=.*?);', flags=re.IGNORECASE)
-        cookies_list = cookie_regex.findall(str(response))
-
-        logger.info(f"INFO: Found cookies to add {cookies_list}")
-
-        cookie_dict_regex = re.compile(r'(.*?)=(.*)')
-        for cookie in cookies_list:
-            try:
-                name = cookie_dict_regex.search(cookie).group(1).strip()
-                logger.info(f"INFO: Found cookie: {name}")
-            except:
-                logger.info(f"ERROR Extracting cookie name")
-                name = None
+        self.session.add_cookies_from_response(response)
+        self.cookies_dict = self.session.cookies()
 
-            try:
-                value = cookie_dict_regex.search(cookie).group(2).strip()
-                logger.info(f"INFO: Found value of cookie {name}: {value}")
-            except:
-                logger.info(f"ERROR Extracting cookie value")
-                value = None
-
-            if name not in self.cookies_dict.keys():
-                self.cookies_dict[name] = value
-
-        logger.info(f"\nINFO: Cookies found from site response+ merge with passed in ones\n\t{json.dumps(self.cookies_dict, indent=2)}")
-        self.save_cookie_to_disk(self.cookies_dict)
-
-    def _get_site_request_headers(self):
+    def get_site_request_headers(self):
         """
         Defines and returns curl_headers for requests.
         :return: dictionary of curl_headers
@@ -141,14 +96,15 @@ class PALS:
         }
         return headers_dict
 
-    def _request_body_data_for_group_requests(self, professionID, licenseTypeId):
+    def _request_body_data_for_group_requests(self, professionID, licenseTypeId, pageNo=1):
         """
         Forms the data portion of the request for getting license info
         :param professionID: Obtained from the "Board/Commission" drp down of the search page
         :param licenseTypeId: Ontained from the "License Type drop down of the search page. This field are only populated after the first drop down is selected"
+        :param pageNo: Page of the search results, starting at 1
         :return:
         """
-        data = f'\'{{"OptPersonFacility":"Person","ProfessionID":{professionID},"LicenseTypeId":{licenseTypeId},"State":"","Country":"ALL","County":null,"IsFacility":0,"PersonId":null,"PageNo":1}}\''
+        data = f'{{"OptPersonFacility":"Person","ProfessionID":{professionID},"LicenseTypeId":{licenseTypeId},"State":"","Country":"ALL","County":null,"IsFacility":0,"PersonId":null,"PageNo":{pageNo}}}'
         return data
 
     def _data_for_single_license_details(self, personId, licenseNumber, licenseId):
@@ -159,53 +115,198 @@ class PALS:
         :param licenseId:
         :return:
         """
-        data = f'\'{{"PersonId":"{personId}","LicenseNumber":"{licenseNumber}","IsFacility":"0","LicenseId":"{licenseId}"}}\''
+        data = f'{{"PersonId":"{personId}","LicenseNumber":"{licenseNumber}","IsFacility":"0","LicenseId":"{licenseId}"}}'
         return data
 
-    def _get_all_licenses_summaries(self, professionID, licenseTypeId, curl_proxy=None):
+    def _get_licenses_summaries_page(self, professionID, licenseTypeId, pageNo, curl_proxy=None):
         """
-        Gets all licenses of a specified type from the page
-        :param license_type:
-        :return:
+        Gets one page of the search results
+        :return: list of license summaries, empty past the last page. Raises ValueError when the site did not answer with a list
         """
         if curl_proxy:
             proxy = curl_proxy
         else:
             proxy = self.curl_proxy
 
-        headers_dict = self._get_site_request_headers()
+        requester = self.get_requester()
+        data = self._request_body_data_for_group_requests(professionID, licenseTypeId, pageNo)
 
-        requester = CurlRequests(self.cookies_dict, headers_dict=headers_dict)
-        data = self._request_body_data_for_group_requests(professionID, licenseTypeId)
-
-        licenses_list = requester.send_curl_request(request_url=self.BULK_LICENSE_SEARCH_URL, proxy=proxy, form_data=data, specified_method='POST', shell_needed=True)
+        licenses_list = self.session.send(requester, request_url=self.BULK_LICENSE_SEARCH_URL, proxy=proxy, form_data=data, specified_method='POST', verbose=False)
         # Returns a list of JSON entries representing each licensed person
         # The responses here don't have all the details, so have to us another method to get the details
         # Each entry has three attributes that are used to get the details (PersonId, LicenseNumber, LicenseId)
+        if not isinstance(licenses_list, list):
+            raise ValueError(f"no list of results in response to page {pageNo}")
 
         return licenses_list
 
-    def get_all_license_details_for_type(self, professionID, licenseTypeId, curl_proxy=None):
+    def iter_licenses_summaries(self, professionID, licenseTypeId, curl_proxy=None, max_pages_in_flight=4, page_limit=None):
         """
-        Returns a list of the license details
-        Glue that ties get_all_licenses_summaries and get_license_details together
-        First, use methond to get all the license details summary based on the supplied paramaters
-        2nd get the details of each one and append to the license_details_list
+        Gets the search results page after page (PageNo), several pages at a time, and yields the summaries page by page
+        in page order. The number of pages is not known up front: the end is the first page that is empty, shorter than
+        the first page, or only repeats summaries already seen (the API ignoring PageNo). At most max_pages_in_flight
+        requests go past it.
+        A page the site fails to give is fetched again with the requester's RetryPolicy (the search is a POST, which is
+        not retried on its own). A failed page never counts as the end. Pages still missing after their retries are
+        skipped, and IncompleteResultsError is raised with them after the last page.
+        Closing the generator early cancels the pages not started yet
         :param professionID:
         :param licenseTypeId:
         :param curl_proxy:
-        :return:license_details_list: List of detials
+        :param max_pages_in_flight: Pages requested at the same time
+        :param page_limit: Stop after this many pages
+        :return: Generator of license summaries, in page order
         """
-        license_details_list = []
-        licenses_summaries_list = self._get_all_licenses_summaries(professionID, licenseTypeId, curl_proxy)
-        for license_summary in licenses_summaries_list:
-            licenseNumber = license_summary.get("LicenseNumber")
-            licenseId = license_summary.get("LicenseId")
-            personId = license_summary.get("PersonId")
+        retry_policy = self.get_requester().retry_policy
+        closed = threading.Event()
+
+        def fetch_page(pageNo):
+            return retry_policy.call(lambda: self._get_licenses_summaries_page(professionID, licenseTypeId, pageNo, curl_proxy),
+                                     f"page {pageNo} of search results", should_stop=closed.is_set)
+
+        seen = set()
+        page_size = None
+        last_page = page_limit
+        next_page = 1
+        next_to_yield = 1
+        finished = {}  # pageNo: list of summaries, or None when the page failed. Pages that came in before the ones ahead of them
+        failed_pages = []
+
+        executor = ThreadPoolExecutor(max_workers=max_pages_in_flight)
+        try:
+            in_flight = {}
+            while last_page is None or next_to_yield <= last_page:
+                # Page 1 goes alone, its length is the page size used to spot the last page. Pages that came in ahead of a
+                # slower one still count, so a slow page does not let the requests run on past the end
+                while len(in_flight) + len(finished) < max_pages_in_flight and (last_page is None or next_page <= last_page) and (next_page == 1 or page_size is not None):
+                    in_flight[executor.submit(fetch_page, next_page)] = next_page
+                    next_page += 1
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pageNo = in_flight.pop(future)
+                    try:
+                        finished[pageNo] = future.result()
+                    except Exception as e:
+                        logger.info(f"ERROR: Could not get page {pageNo} of search results. DETAILS: {e}")
+                        finished[pageNo] = None
+
+                # Pages are looked at in page order, so where the end is found does not depend on which page came back first
+                while next_to_yield in finished and (last_page is None or next_to_yield <= last_page):
+                    pageNo = next_to_yield
+                    licenses_list = finished.pop(pageNo)
+                    next_to_yield += 1
+                    if licenses_list is None:
+                        failed_pages.append(pageNo)
+                        if pageNo == 1:
+                            # Without the first page there is no page size to find the end with
+                            last_page = 0
+                        continue
+
+                    new_summaries = []
+                    for license_summary in licenses_list:
+                        key = (license_summary.get("PersonId"), license_summary.get("LicenseId"))
+                        if key not in seen:
+                            seen.add(key)
+                            new_summaries.append(license_summary)
+
+                    if pageNo == 1:
+                        page_size = len(licenses_list)
+                    if not new_summaries:
+                        last_page = pageNo - 1
+                    elif page_size and len(licenses_list) < page_size:
+                        last_page = pageNo
+
+                    logger.info(f"INFO: Got {len(new_summaries)} license summaries from page {pageNo}")
+                    yield from new_summaries
+        finally:
+            closed.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if failed_pages:
+            raise IncompleteResultsError(failed_pages)
 
-            license_detail = self._get_license_details(personId, licenseNumber, licenseId, curl_proxy)
-            license_details_list.append(license_detail)
+    def _get_all_licenses_summaries(self, professionID, licenseTypeId, curl_proxy=None):
+        """
+        Gets all licenses of a specified type from the page
+        :param license_type:
+        :return:
+        """
+        return list(self.iter_licenses_summaries(professionID, licenseTypeId, curl_proxy))
+
+    def iter_license_details_for_type(self, professionID, licenseTypeId, curl_proxy=None, max_in_flight=8, max_pages_in_flight=4):
+        """
+        Gets the details of every license of a type. Detail requests start as soon as the first summaries arrive, while
+        the rest of the search pages are still being fetched. At most max_in_flight detail requests run at the same time
+        :param professionID:
+        :param licenseTypeId:
+        :param curl_proxy:
+        :param max_in_flight: Detail requests sent at the same time
+        :param max_pages_in_flight: Search result pages requested at the same time
+        :return: Generator of (license summary, license details) tuples, in completion order. The details are empty
+        when their request failed
+        """
+        summaries = self.iter_licenses_summaries(professionID, licenseTypeId, curl_proxy, max_pages_in_flight)
+        incomplete = None
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = {}
+            try:
+                for license_summary in summaries:
+                    future = executor.submit(self._get_license_details, license_summary.get("PersonId"), license_summary.get("LicenseNumber"),
+                                             license_summary.get("LicenseId"), curl_proxy)
+                    in_flight[future] = license_summary
+                    if len(in_flight) >= max_in_flight:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for done_future in done:
+                            license_summary = in_flight.pop(done_future)
+                            yield license_summary, self._license_details_result(done_future, license_summary)
+            except IncompleteResultsError as e:
+                # The details of the summaries that did come in are still fetched before the error is passed on
+                incomplete = e
+
+            for done_future in list(in_flight):
+                license_summary = in_flight.pop(done_future)
+                yield license_summary, self._license_details_result(done_future, license_summary)
+
+        if incomplete is not None:
+            raise incomplete
+
+    @staticmethod
+    def _license_details_result(future, license_summary):
+        """
+        Details a detail request future came back with. A request that raised gives empty details, so one failed license
+        does not end the others
+        """
+        try:
+            return future.result()
+        except Exception as e:
+            logger.info(f"ERROR: Could not get the details of license {license_summary.get('LicenseNumber')}. DETAILS: {e}")
+            return {}
 
+    def get_all_license_details_for_type(self, professionID, licenseTypeId, curl_proxy=None, max_in_flight=8):
+        """
+        Returns a list of the license details
+        Glue that ties the search result pages and get_license_details together, see iter_license_details_for_type
+        :param professionID:
+        :param licenseTypeId:
+        :param curl_proxy:
+        :param max_in_flight: Detail requests sent at the same time
+        :return:license_details_list: List of detials. IncompleteResultsError is raised when search result pages are still
+        missing after their retries, with the details that were got in its results
+        """
+        license_details_list = []
+        try:
+            for license_summary, license_detail in self.iter_license_details_for_type(professionID, licenseTypeId, curl_proxy, max_in_flight):
+                license_details_list.append(license_detail)
+        except IncompleteResultsError as e:
+            e.results = license_details_list
+            logger.info(f"ERROR: Search results pages {e.missing} failed. Got details of {len(license_details_list)} licenses")
+            raise
+
+        logger.info(f"INFO: Got details of {len(license_details_list)} licenses")
         return license_details_list
 
     def _get_license_details(self, personId, licenseNumber, licenseId, curl_proxy=None):
@@ -221,10 +322,8 @@ class PALS:
         else:
             proxy = self.curl_proxy
 
-        headers_dict = self._get_site_request_headers()
-
-        requester = CurlRequests(self.cookies_dict, headers_dict=headers_dict)
+        requester = self.get_requester()
         data = self._data_for_single_license_details(personId, licenseNumber, licenseId)
-        license_details = requester.send_curl_request(request_url=self.LICENSE_DETAILS_URL, proxy=proxy, form_data=data, specified_method="POST")
+        license_details = self.session.send(requester, request_url=self.LICENSE_DETAILS_URL, proxy=proxy, form_data=data, specified_method="POST")
 
         return license_details
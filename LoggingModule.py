@@ -1,13 +1,90 @@
+import os
+import json
+import queue
+import atexit
+import random
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
 
+LOGGER_NAME = "LoggingModule"
+REQUEST_LOGGER_NAME = "requests"
+# Level can be changed without code changes, eg LOG_LEVEL=DEBUG to see full commands and server responses
+DEFAULT_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 
-def set_logging():
-    logger = logging.getLogger(__name__)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('[%(asctime)s] p%(process)s {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s',
-                                  '%m-%d %H:%M:%S')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.DEBUG)
+_setup_lock = threading.Lock()
+_listener = None
 
+
+def set_logging(name=None):
+    """
+    Returns the shared scraper logger. Safe to call from every module at import time: the handlers are only set up once.
+    Records are put on a queue and written to the terminal by a background thread, so the scraping threads never block on terminal I/O
+    :param name: Optional child logger name, eg set_logging("requests") for the per request logger
+    :return:
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+
+    with _setup_lock:
+        if _listener is None:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('[%(asctime)s] p%(process)s {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s',
+                                          '%m-%d %H:%M:%S')
+            handler.setFormatter(formatter)
+
+            log_queue = queue.SimpleQueue()
+            logger.addHandler(QueueHandler(log_queue))
+            logger.setLevel(DEFAULT_LEVEL)
+
+            _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+            _listener.start()
+            # Write out whatever is still queued when the program exits
+            atexit.register(_listener.stop)
+
+    if name:
+        return logger.getChild(name)
     return logger
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through only a fraction of records. Warnings and errors always pass
+    """
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1:
+            return True
+        return random.random() < self.sample_rate
+
+
+def set_request_log_sampling(sample_rate):
+    """
+    Logs only a fraction of the per request log lines (sent command, status, server response).
+    eg set_request_log_sampling(0.01) on a big crawl to keep one request in a hundred
+    :param sample_rate: 0 to 1
+    :return:
+    """
+    request_logger = set_logging(REQUEST_LOGGER_NAME)
+    for log_filter in list(request_logger.filters):
+        if isinstance(log_filter, SamplingFilter):
+            request_logger.removeFilter(log_filter)
+    request_logger.addFilter(SamplingFilter(sample_rate))
+
+
+class LazyJson:
+    """
+    Defers json.dumps until the record is actually written.
+    Use with %s formatting: logger.debug("Record %s", LazyJson(record)). Nothing is serialised when DEBUG is off
+    """
+
+    def __init__(self, payload, indent=2):
+        self.payload = payload
+        self.indent = indent
+
+    def __str__(self):
+        return json.dumps(self.payload, indent=self.indent)
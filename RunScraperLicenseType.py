@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from CurlScraper.ARMedBoardCurl import ARMedBoard
 from CurlScraper.DCHealthCurl import DCHealth
 from CurlScraper.PALicensingCurl import PALS
@@ -5,41 +6,56 @@ from CurlScraper.ORMedBoardCurl import ORMedBoard
 from SeleniumScraper.PALicensingSel import PALSSeleniumScraper
 from SeleniumScraper.ARMedBoardSel import ARMedboardSeleniumScraper
 from SeleniumScraper.ORMedBoardSel import ORMedSeleniumScraper
-import json
-from LoggingModule import set_logging
+from SeleniumScraper.DriverPool import DriverPool
+from CurlScraper.CoreLibrary.IdIndex import IdIndex
+from CurlScraper.CoreLibrary.Pagination import IncompleteResultsError
+from LoggingModule import set_logging, LazyJson
 
 logger = set_logging()
 
-def get_ar_med_dataset(method="c", license_type="PA"):
+def get_ar_med_dataset(method="c", license_type="PA", background_refresh=False, drivers_in_pool=2, driver_timeout=300):
     """
     Ties a bunch of methods together to get the license details from ARMedBoard
     :param method:
+    :param background_refresh: When the stored ids are stale, use them and enumerate again on a thread instead of first.
+    Off by default: the process does not exit before that enumeration is done, even after the details are all in
+    :param drivers_in_pool: Browsers fetching license details at the same time (method "s")
+    :param driver_timeout: Seconds a license waits for a free browser before it fails (method "s")
     :return:
     """
-    # Need to use selenium and browser to do a search to get all the ASMB Ids
+    # The ASMB Ids come from the directory search, either replayed with curl or clicked through in the browser
+    # They are kept in an id index between runs, so the search only runs again once the index is stale
     # After getting Ids, can use either curl or selenium again to get the license details
-    ar_med_sel = ARMedboardSeleniumScraper()
-    asmb_id_list = ar_med_sel.get_all_license_ids(license_type)
+    if method == "c":
+        ar_med_curl = ARMedBoard(cookies_dict=None)
+        # The enumeration gets its own client, it may run on a thread next to the detail fetching
+        enumerate_ids = lambda: ARMedBoard(cookies_dict=None).get_all_license_ids(license_type)
+    else:
+        enumerate_ids = lambda: ARMedboardSeleniumScraper().get_all_license_ids(license_type)
+    id_index = IdIndex.for_site(ARMedBoard.SITE_NAME, license_type)
+    asmb_id_list = id_index.get_ids(enumerate_ids, background_refresh=background_refresh)
     logger.info(f"INFO: Found {len(asmb_id_list)} licenses of the specified type. Proceeding to get details")
     license_details_list = []
 
-    for license_num in asmb_id_list:
-        if method == "c":
-            ar_med_curl = ARMedBoard(cookies_dict=None)
-            license_info = ar_med_curl.get_license_info(license_num)
-            logger.info("\n")
-            logger.info(json.dumps(license_info, indent=2))
-
-        else:
-            ar_med_sel = ARMedboardSeleniumScraper()
+    if method == "c":
+        # Pages are fetched concurrently by one client and parsed in worker processes
+        license_details = dict(ar_med_curl.get_license_info_many(asmb_id_list))
+        license_details_list = [license_details.get(license_num, {}) for license_num in asmb_id_list]
+
+    else:
+        # The browsers are launched once and reused for every license, drivers_in_pool pages at a time
+        def get_license_details(license_num):
+            # The scraper gives its browser back to the pool when it is done, also when it fails
+            ar_med_sel = ARMedboardSeleniumScraper(driver_pool=driver_pool, driver_timeout=driver_timeout)
             license_info = ar_med_sel.get_license_details(license_number=license_num)
-            logger.info("\n")
-            logger.info(json.dumps(license_info, indent=2))
+            logger.debug("\n%s", LazyJson(license_info))
+            return license_info
 
-        license_details_list.append(license_info)
+        with DriverPool(ARMedboardSeleniumScraper.SITE_NAME, size=drivers_in_pool, warm=True) as driver_pool:
+            with ThreadPoolExecutor(max_workers=drivers_in_pool) as executor:
+                license_details_list = list(executor.map(get_license_details, asmb_id_list))
 
-    logger.info("\n")
-    logger.info(json.dumps(license_details_list, indent=2))
+    logger.info("\n%s", LazyJson(license_details_list))
 
 
 def get_dchealth_dataset(method="c", license_type="PHYSICAL THERAPIST"):
@@ -51,8 +67,13 @@ def get_dchealth_dataset(method="c", license_type="PHYSICAL THERAPIST"):
     """
     if method == "c":
         dc_med_curl = DCHealth(cookies_dict=None)
-        license_details_list = dc_med_curl.get_all_licenses(license_type)
-        logger.info(json.dumps(license_details_list, indent=2))
+        try:
+            license_details_list = dc_med_curl.get_all_licenses(license_type, parallel=True)
+        except IncompleteResultsError as e:
+            # Keep what was got. The missing offsets are logged so they can be fetched again later
+            logger.info(f"WARNING: Offsets {e.missing} of {license_type} are missing. Keeping the {len(e.results)} results got")
+            license_details_list = e.results
+        logger.info("%s", LazyJson(license_details_list))
 
 
 def get_pals_dataset(method="c", board_or_commission="State Board of Pharmacy", license_type="Pharmacist", ):
@@ -65,37 +86,52 @@ def get_pals_dataset(method="c", board_or_commission="State Board of Pharmacy",
     """
     # The license type and board.commission values are supplied
     # These need to be converted to the corresponding codes/Ids
-    # This will be done from the browser
-    pals_sel = PALSSeleniumScraper()
-    info_id = pals_sel.get_board_and_licence_type_codes(board_or_commission=board_or_commission, license_type=license_type)
+    # They come from the code table saved on disk. The browser is only started when the table is stale or does not know them
+    info_id = PALSSeleniumScraper.lookup_board_and_licence_type_codes(board_or_commission=board_or_commission, license_type=license_type)
     professionID = info_id.get("professionID")
     licenseTypeId = info_id.get("licenseTypeId")
 
     if method == "c":
         pals_curl = PALS(cookies_dict=None)
-        license_details_list = pals_curl.get_all_license_details_for_type(professionID=professionID, licenseTypeId=licenseTypeId)
-        logger.info(json.dumps(license_details_list, indent=2))
+        try:
+            license_details_list = pals_curl.get_all_license_details_for_type(professionID=professionID, licenseTypeId=licenseTypeId)
+        except IncompleteResultsError as e:
+            # Keep what was got. The missing pages are logged so they can be fetched again later
+            logger.info(f"WARNING: Search results pages {e.missing} of {license_type} are missing. Keeping the details of {len(e.results)} licenses")
+            license_details_list = e.results
+        logger.info("%s", LazyJson(license_details_list))
 
 
-def get_or_med_data_set(method="c", license_type="Podiatrist"):
+def get_or_med_data_set(method="c", license_type="Podiatrist", background_refresh=False, search_api=False):
     """
     Gets dataset of all licenses of type supplied from the site
     :param method:
     :param license_type:
+    :param background_refresh: When the stored ids are stale, use them and enumerate again on a thread instead of first.
+    Off by default: the process does not exit before that enumeration is done, even after the details are all in
+    :param search_api: Enumerate the Entity Ids with the curl search API client instead of the browser. Falls back to
+    the browser when the API gives no complete answer
     :return:
     """
-    or_med_sel = ORMedSeleniumScraper()
-    asmb_id_list = or_med_sel.get_all_license_ids(license_type)
+    or_med_curl = ORMedBoard(cookies_dict=None)
+
+    def enumerate_ids():
+        if search_api:
+            license_ids = ORMedBoard(cookies_dict=None).get_all_license_ids(license_type)
+            if license_ids:
+                return license_ids
+            logger.info(f"WARNING: Search API gave no Entity Ids for {license_type}. Getting them with the browser")
+        return ORMedSeleniumScraper().get_all_license_ids(license_type)
+
+    # The Entity Ids are kept in an id index between runs, so the search only runs again once the index is stale
+    id_index = IdIndex.for_site(ORMedBoard.SITE_NAME, license_type)
+    asmb_id_list = id_index.get_ids(enumerate_ids, background_refresh=background_refresh)
     logger.info(f"INFO: Found {len(asmb_id_list)} licenses of the specified type. Proceeding to get details")
-    license_details_list = []
-
-    for license_id in asmb_id_list:
-        or_med_curl = ORMedBoard(cookies_dict=None)
-        license_info = or_med_curl.get_license_info(license_id)
-        logger.info("\n")
-        logger.info(json.dumps(license_info, indent=2))
 
-        license_details_list.append(license_info)
+    # Pages are fetched concurrently and parsed in worker processes
+    license_details = dict(or_med_curl.get_license_info_many(asmb_id_list))
+    license_details_list = [license_details.get(license_id, {}) for license_id in asmb_id_list]
+    logger.info("\n%s", LazyJson(license_details_list))
 
 
 def scrape_armedboard_specific_license_number(method="c", license_num="PA-130"):
@@ -108,13 +144,12 @@ def scrape_armedboard_specific_license_number(method="c", license_num="PA-130"):
     if method == "c":
         ar_med_curl = ARMedBoard(cookies_dict=None)
         license_info = ar_med_curl.get_license_info(license_num)
-        logger.info("\n")
-        logger.info(json.dumps(license_info, indent=2))
+        logger.info("\n%s", LazyJson(license_info))
 
     elif method == "s":
         ar_med_sel = ARMedboardSeleniumScraper()
         license_info2 = ar_med_sel.get_license_details(license_number=license_num)
-        logger.info(json.dumps(license_info2, indent=2))
+        logger.info("%s", LazyJson(license_info2))
 
 
 def scrape_dc_health_specific_license_number (method="c", license_num="PT870062"):
@@ -127,8 +162,7 @@ def scrape_dc_health_specific_license_number (method="c", license_num="PT870062"
     if method == "c":
         dc_med_curl = DCHealth(cookies_dict=None)
         license_info = dc_med_curl.get_license_info(license_num)
-        logger.info("\n")
-        logger.info(json.dumps(license_info, indent=2))
+        logger.info("\n%s", LazyJson(license_info))
 
 
 if __name__ == "__main__":
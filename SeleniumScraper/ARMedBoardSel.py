@@ -1,5 +1,6 @@
 import re
 from SeleniumScraper.SeleniumPageNavigator import get_chrome_driver, SelemiumPageNavigetor
+from CurlScraper.ARMedBoardCurl import parse_license_page
 from LoggingModule import set_logging
 
 logger = set_logging()
@@ -11,13 +12,34 @@ class ARMedboardSeleniumScraper:
     ASMB_ID_SEARCH_URL = "http://www.armedicalboard.org/Public/verify/results.aspx?strPHIDNO="
     DIRECTORY_SEARCH_PAGE = "http://www.armedicalboard.org/public/directory/AdvancedDirectorySearch.aspx"
 
-    def __init__(self):
-        self.driver = get_chrome_driver(dataDirName=self.SITE_NAME)
+    def __init__(self, driver_pool=None, driver_timeout=300):
+        """
+        :param driver_pool: DriverPool to take the browser from (and give it back to in quit_driver). A new browser is launched otherwise
+        :param driver_timeout: Seconds to wait for a free browser of driver_pool. TimeoutError after that
+        """
+        self.driver_pool = driver_pool
+        if driver_pool is not None:
+            self.driver = driver_pool.acquire(timeout=driver_timeout)
+        else:
+            self.driver = get_chrome_driver(dataDirName=self.SITE_NAME)
         self.navigator = SelemiumPageNavigetor(self.driver)
 
+    def quit_driver(self):
+        """
+        Gives the browser back to the driver pool, or quits it when it was launched for this scraper
+        :return:
+        """
+        if self.driver_pool is not None:
+            self.driver_pool.release(self.driver)
+        else:
+            self.driver.close()
+            self.driver.quit()
+
     def get_license_details(self, license_number):
         """
-        Scrapes the page using xpath
+        Gets the license json from the page source, with the same parser as the curl scraper (ARMedBoard.get_license_info).
+        One page source call per license instead of a WebDriver round trip per field. The values are the text the
+        browser shows (entities unescaped, "" for empty fields), as read from the elements before
         """
 
         if "ASMB" in license_number:
@@ -25,52 +47,13 @@ class ARMedboardSeleniumScraper:
         else:
             license_page_url = f"{self.LICENSE_SEARCH_URL}{license_number}"
 
-        self.navigator.get_page(url=license_page_url)
+        try:
+            self.navigator.get_page(url=license_page_url)
+            page_source = self.navigator.get_page_source()
+        finally:
+            self.quit_driver()
 
-        license_info = {}
-
-        page_source = self.navigator.get_page_source()
-        field_names_regex = re.compile(r'<li>(.+?):\s*<span\s+id="ctl00_MainContentPlaceHolder_lvResults')
-        field_list = field_names_regex.findall(page_source)
-
-        group_index = None
-
-        for field in field_list:
-            results = self.xpath_builder(field, license_number, group_index)
-            field_value = results[0]
-            group_index = results[1]
-            license_info[field] = field_value
-
-        license_info["Board Minutes"] = self.navigator.get_element_text(xpath="//span[contains(@id, 'ctl00_MainContentPlaceHolder_lblBoardMin')]")
-        license_info["Board Orders"] = self.navigator.get_element_text(xpath="//span[contains(@id, 'ctl00_MainContentPlaceHolder_lblBoardAction')]")
-
-        self.driver.close()
-        self.driver.quit()
-        return license_info
-
-    def xpath_builder(self, field_name, license_number, group_index):
-        """
-        Builds the xpath for the field names.
-        """
-        value = None
-        xpath_string_original = f"(//li[contains(text(),'{field_name}')]/span)"
-        num_elements = self.navigator.get_number_of_elements(xpath=xpath_string_original, time_delay=0.0005)
-        if num_elements == 1:
-            value = self.navigator.get_element_text(xpath=xpath_string_original, time_delay=1)
-        elif num_elements == 0:
-            value = None
-        else:
-            if group_index:
-                xpath_string_group = f"{xpath_string_original}[{group_index}]"
-                value = self.navigator.get_element_text(xpath=xpath_string_group)
-            else:
-                for idx in range(1, num_elements + 1):
-                    xpath_string_group = f"{xpath_string_original}[{idx}]"
-                    value = self.navigator.get_element_text(xpath=xpath_string_group)
-                    if field_name == "License Number" and value == license_number:
-                        group_index = idx
-
-        return value, group_index
+        return parse_license_page(page_source, license_number, as_text=True)
 
     def get_all_license_ids(self, license_type, page_limit=None):
         """
@@ -81,70 +64,67 @@ class ARMedboardSeleniumScraper:
         license_type_xpath = f"//option[@value='{license_type}']"
         search_button_xpath = "(//input[contains(@name,'DirSearch') and @value='Search'])"
 
-        self.navigator.get_page(url=self.DIRECTORY_SEARCH_PAGE)
-        self.navigator.check_page_loaded(page_load_xpath="(//h2[contains(text(),'Advanced Directory Search')])")
-        self.navigator.click_element(xpath=license_type_xpath)  # Click on the license type
-
-        # Check if search button is loaded
-        self.navigator.check_page_loaded(page_load_xpath=search_button_xpath)
-        self.navigator.click_element(xpath=search_button_xpath)  # Click on the search button, after verifying that its loaded.
-
-        results_loaded_xpath = "(//table[contains(@id, 'ctl00_MainContentPlaceHolder_gvLookup')])"
-        self.navigator.check_page_loaded(page_load_xpath=results_loaded_xpath)
-
-        # Start navigating through the pages
-
-        next_view = True
-        current_view = 1
-        asmb_id_regex = re.compile(r'PHIDNO=(ASMB\d+)')
-        asmb_id_list = []
-
-        base_xpath_for_result = "(//a[contains(@href, '.aspx?PHIDNO')])"
-        xpath_for_page_nums = "( //a[contains(@href, 'ctl00$MainContentPlaceHolder$gvLookup') and not(contains(text(), '..'))])"  # Xpath for each page within the current view(when combined with [])
-
-        while next_view:
-            # Get all pages in current view
-            numpages = self.navigator.get_number_of_elements(xpath=xpath_for_page_nums, time_delay=0.5)
-            for page in range(numpages + 1):
-                xpath_current_page = f"{xpath_for_page_nums}[{page}]"
-                self.navigator.click_element(xpath=xpath_current_page)
-                self.navigator.check_page_loaded(page_load_xpath=results_loaded_xpath)
-                # Find number of results in current page
-                num_results = self.navigator.get_number_of_elements(xpath=base_xpath_for_result, time_delay=0.5)
-                for idx in range(1, num_results + 1):
-                    current_result_xpath = f"{base_xpath_for_result}[{idx}]"
-                    ele = self.navigator.getElementAttributeAsText(xpath=current_result_xpath, attribute_name="href")
-                    try:
-                        asmb_id = asmb_id_regex.search(ele).group(1) # type: ignore
-                        logger.info(f"INFO: Found ASMB Id: {asmb_id}")
-                        asmb_id_list.append(asmb_id)
-                    except:
-                        logger.info("ERROR: Could not get ASMB Id from element")
-
-                logger.info(f"INFO: Number of results found after scraping current page (page {page + 1}) {len(asmb_id_list)}")
-
-            # Click on next view
-            logger.info(f"INFO: {len(asmb_id_list)} ASMB ids found so far after scraping all {numpages} pages in current view."
-                  f"\n\t{asmb_id_list}. Going to next view (set of pages)")
-
-            next_view_xpath_base = "(//a[contains(@href, 'ctl00$MainContentPlaceHolder$gvLookup') and contains(text(), '...')])"
-
-            if current_view == 1:
-                next_view_xpath = f"{next_view_xpath_base}[{1}]"
-                # THis condition is met only on the first set of pages. There is only one next view button to click here
-
-            else:
-                next_view_xpath = f"{next_view_xpath_base}[{2}]"
-                # This condition is met on all views other than the first one
-
-            next_view = self.navigator.find_presence_of_element(xpath=next_view_xpath)  # True or False
-            if next_view:
-                self.navigator.click_element(xpath=next_view_xpath)
-                self.navigator.check_page_loaded(page_load_xpath=results_loaded_xpath)
-
-            current_view = current_view + 1
-
-
-        self.driver.close()
-        self.driver.quit()
+        try:
+            self.navigator.get_page(url=self.DIRECTORY_SEARCH_PAGE)
+            self.navigator.check_page_loaded(page_load_xpath="(//h2[contains(text(),'Advanced Directory Search')])")
+            self.navigator.click_element(xpath=license_type_xpath)  # Click on the license type
+
+            # Check if search button is loaded
+            self.navigator.check_page_loaded(page_load_xpath=search_button_xpath)
+            self.navigator.click_element(xpath=search_button_xpath)  # Click on the search button, after verifying that its loaded.
+
+            results_loaded_xpath = "(//table[contains(@id, 'ctl00_MainContentPlaceHolder_gvLookup')])"
+            self.navigator.check_page_loaded(page_load_xpath=results_loaded_xpath)
+
+            # Start navigating through the pages
+
+            next_view = True
+            current_view = 1
+            asmb_id_regex = re.compile(r'PHIDNO=(ASMB\d+)')
+            asmb_id_list = []
+
+            base_xpath_for_result = "(//a[contains(@href, '.aspx?PHIDNO')])"
+            xpath_for_page_nums = "( //a[contains(@href, 'ctl00$MainContentPlaceHolder$gvLookup') and not(contains(text(), '..'))])"  # Xpath for each page within the current view(when combined with [])
+
+            while next_view:
+                # Get all pages in current view
+                numpages = self.navigator.get_number_of_elements(xpath=xpath_for_page_nums, time_delay=0.5)
+                for page in range(numpages + 1):
+                    xpath_current_page = f"{xpath_for_page_nums}[{page}]"
+                    self.navigator.click_element(xpath=xpath_current_page)
+                    self.navigator.check_page_loaded(page_load_xpath=results_loaded_xpath)
+                    # Links of every result in the current page, read in one round trip
+                    result_links = self.navigator.get_elements_attribute("href", xpath=base_xpath_for_result, time_delay=0.5)
+                    for ele in result_links:
+                        try:
+                            asmb_id = asmb_id_regex.search(ele).group(1) # type: ignore
+                            logger.info(f"INFO: Found ASMB Id: {asmb_id}")
+                            asmb_id_list.append(asmb_id)
+                        except:
+                            logger.info("ERROR: Could not get ASMB Id from element")
+
+                    logger.info(f"INFO: Number of results found after scraping current page (page {page + 1}) {len(asmb_id_list)}")
+
+                # Click on next view
+                logger.info(f"INFO: {len(asmb_id_list)} ASMB ids found so far after scraping all {numpages} pages in current view."
+                      f"\n\t{asmb_id_list}. Going to next view (set of pages)")
+
+                next_view_xpath_base = "(//a[contains(@href, 'ctl00$MainContentPlaceHolder$gvLookup') and contains(text(), '...')])"
+
+                if current_view == 1:
+                    next_view_xpath = f"{next_view_xpath_base}[{1}]"
+                    # THis condition is met only on the first set of pages. There is only one next view button to click here
+
+                else:
+                    next_view_xpath = f"{next_view_xpath_base}[{2}]"
+                    # This condition is met on all views other than the first one
+
+                next_view = self.navigator.find_presence_of_element(xpath=next_view_xpath)  # True or False
+                if next_view:
+                    self.navigator.click_element(xpath=next_view_xpath)
+                    self.navigator.check_page_loaded(page_load_xpath=results_loaded_xpath)
+
+                current_view = current_view + 1
+        finally:
+            self.quit_driver()
         return asmb_id_list
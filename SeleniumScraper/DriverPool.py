@@ -0,0 +1,256 @@
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from SeleniumScraper.SeleniumPageNavigator import get_chrome_driver
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+# Clears what a page leaves behind in the browser besides cookies
+CLEAR_STORAGE_SCRIPT = "try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}"
+# Chrome only. None elsewhere
+JS_HEAP_SCRIPT = "return window.performance && performance.memory ? performance.memory.usedJSHeapSize : null;"
+
+
+class DriverPool:
+    """
+    Chrome drivers that are launched once and handed out again and again, instead of a new browser per scraper instance.
+    Each driver has its own user data dir (<data_dir_name>_<slot>), Chrome locks the dir of a running browser.
+    Between uses a driver is reset (extra tabs closed, cookies and storage cleared, about:blank loaded) rather than
+    relaunched. It is relaunched when it fails its health check, after max_pages_per_driver uses or when the page's
+    JS heap goes over max_memory_mb.
+    Use it as a context manager, or call close, so every browser is quit:
+
+        with DriverPool(ARMedboardSeleniumScraper.SITE_NAME, size=2) as driver_pool:
+            with driver_pool.driver() as driver:
+                ...
+    """
+
+    def __init__(self, data_dir_name, size=2, headless=True, max_pages_per_driver=50, max_memory_mb=None, clear_storage=True, warm=False):
+        """
+        :param data_dir_name: Base of the drivers' user data dir names, usually the site name
+        :param size: Most drivers running at the same time
+        :param headless:
+        :param max_pages_per_driver: Uses after which a driver is quit and launched again
+        :param max_memory_mb: JS heap of the current page above which a driver is quit and launched again. None to not check
+        :param clear_storage: Delete cookies and local/session storage between uses
+        :param warm: Launch all drivers now instead of on first use
+        """
+        self.data_dir_name = data_dir_name
+        self.size = size
+        self.headless = headless
+        self.max_pages_per_driver = max_pages_per_driver
+        self.max_memory_mb = max_memory_mb
+        self.clear_storage = clear_storage
+
+        self._condition = threading.Condition()
+        self._idle = []  # drivers ready to hand out
+        self._drivers = {}  # id(driver): driver, for every running driver, idle or handed out
+        self._slots = {}  # id(driver): slot
+        self._pages = {}  # id(driver): uses since launch
+        self._free_slots = list(range(size))
+        self._closed = False
+
+        if warm:
+            self.warm()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _launch(self, slot):
+        logger.info(f"INFO: Launching pooled driver {self.data_dir_name}_{slot}")
+        return get_chrome_driver(dataDirName=f"{self.data_dir_name}_{slot}", headless=self.headless)
+
+    def warm(self):
+        """
+        Launches every free slot's driver, in parallel, so the first acquires do not wait for Chrome to start
+        """
+        with self._condition:
+            slots = list(self._free_slots)
+            self._free_slots.clear()
+        if not slots:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(slots)) as executor:
+            launches = {slot: executor.submit(self._launch, slot) for slot in slots}
+        with self._condition:
+            for slot, launch in launches.items():
+                try:
+                    driver = launch.result()
+                except Exception as e:
+                    logger.info(f"ERROR: Could not launch pooled driver {self.data_dir_name}_{slot}. DETAILS: {e}")
+                    self._free_slots.append(slot)
+                    continue
+                self._drivers[id(driver)] = driver
+                self._slots[id(driver)] = slot
+                self._pages[id(driver)] = 0
+                self._idle.append(driver)
+            self._condition.notify_all()
+
+    def is_healthy(self, driver):
+        """
+        :return: True when the browser still answers
+        """
+        try:
+            driver.execute_script("return 1;")
+            driver.current_window_handle
+            return True
+        except Exception as e:
+            logger.info(f"WARNING: Pooled driver failed its health check. DETAILS: {e}")
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Hands out an idle driver, launching one when a slot is free, or waits for one to be released
+        :param timeout: Seconds to wait for a driver. None to wait as long as it takes
+        :return: driver
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError(f"Driver pool {self.data_dir_name} is closed")
+                if self._idle:
+                    driver = self._idle.pop()
+                    slot = None
+                elif self._free_slots:
+                    driver = None
+                    slot = self._free_slots.pop(0)
+                else:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No driver of pool {self.data_dir_name} was free within {timeout} seconds")
+                    self._condition.wait(remaining)
+                    continue
+
+            if driver is not None:
+                if self.is_healthy(driver):
+                    return driver
+                self._retire(driver)
+                continue
+
+            # Launch outside the lock, Chrome takes a while to start
+            try:
+                driver = self._launch(slot)
+            except Exception:
+                with self._condition:
+                    self._free_slots.append(slot)
+                    self._condition.notify()
+                raise
+            with self._condition:
+                self._drivers[id(driver)] = driver
+                self._slots[id(driver)] = slot
+                self._pages[id(driver)] = 0
+            return driver
+
+    def release(self, driver):
+        """
+        Takes a driver back after a use. It is reset for the next use, or quit when it is due to be recycled
+        :param driver: driver from acquire
+        """
+        with self._condition:
+            if id(driver) not in self._slots:
+                if self._closed:
+                    # Already quit by close
+                    return
+                logger.info(f"WARNING: Driver released to pool {self.data_dir_name} was not handed out by it. Quitting it")
+                recycle = None
+            else:
+                self._pages[id(driver)] += 1
+                recycle = self._closed or self._pages[id(driver)] >= self.max_pages_per_driver
+
+        if recycle is None:
+            self._quit(driver)
+            return
+        if not recycle:
+            recycle = self._over_memory(driver) or not self.reset(driver)
+        if recycle:
+            self._retire(driver)
+            return
+
+        with self._condition:
+            self._idle.append(driver)
+            self._condition.notify()
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """
+        Context manager around acquire and release:
+
+            with driver_pool.driver() as driver:
+                ...
+        """
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def reset(self, driver):
+        """
+        Closes every tab but the first and clears what the last use left behind
+        :return: True when the driver could be reset
+        """
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            if self.clear_storage:
+                driver.execute_script(CLEAR_STORAGE_SCRIPT)
+                driver.delete_all_cookies()
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            logger.info(f"WARNING: Could not reset pooled driver. DETAILS: {e}")
+            return False
+
+    def _over_memory(self, driver):
+        if self.max_memory_mb is None:
+            return False
+        try:
+            used_bytes = driver.execute_script(JS_HEAP_SCRIPT)
+        except Exception:
+            return False
+        if used_bytes is not None and used_bytes > self.max_memory_mb * 1024 * 1024:
+            logger.info(f"INFO: Pooled driver uses {used_bytes / (1024 * 1024):.0f} MB of JS heap, over {self.max_memory_mb} MB. Recycling it")
+            return True
+        return False
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.info(f"WARNING: Could not quit pooled driver. DETAILS: {e}")
+
+    def _retire(self, driver):
+        """
+        Quits a driver and frees its slot, so the next acquire launches a fresh one in the same user data dir
+        """
+        self._quit(driver)
+        with self._condition:
+            self._drivers.pop(id(driver), None)
+            slot = self._slots.pop(id(driver), None)
+            pages = self._pages.pop(id(driver), 0)
+            if slot is not None:
+                self._free_slots.append(slot)
+            self._condition.notify()
+        logger.info(f"INFO: Retired pooled driver {self.data_dir_name}_{slot} after {pages} uses")
+
+    def close(self):
+        """
+        Quits every driver of the pool, also the ones still handed out (a scraper that failed before giving its driver back)
+        """
+        with self._condition:
+            self._closed = True
+            self._idle = []
+            drivers = list(self._drivers.values())
+            self._condition.notify_all()
+        for driver in drivers:
+            self._retire(driver)
+
@@ -1,7 +1,7 @@
 import re
-import pickle
 from SeleniumScraper.SeleniumPageNavigator import get_chrome_driver, SelemiumPageNavigetor
 import time
+from CurlScraper.CoreLibrary.CookieStore import CookieStore
 from LoggingModule import set_logging
 
 logger = set_logging()
@@ -11,21 +11,42 @@ class ORMedSeleniumScraper:
     MAIN_PAGE = "https://techmedweb.omb.state.or.us"
     DIRECTORY_SEARCH_PAGE = "https://techmedweb.omb.state.or.us/search"
 
-    def __init__(self):
-        self.driver = get_chrome_driver(dataDirName=self.SITE_NAME)
+    def __init__(self, driver_pool=None, driver_timeout=300):
+        """
+        :param driver_pool: DriverPool to take the browser from (and give it back to in quit_driver). A new browser is launched otherwise
+        :param driver_timeout: Seconds to wait for a free browser of driver_pool. TimeoutError after that
+        """
+        self.driver_pool = driver_pool
+        if driver_pool is not None:
+            self.driver = driver_pool.acquire(timeout=driver_timeout)
+        else:
+            self.driver = get_chrome_driver(dataDirName=self.SITE_NAME)
         self.navigator = SelemiumPageNavigetor(self.driver)
         self.username = self.SITE_NAME
+        self.cookie_store = CookieStore.for_site(self.SITE_NAME)
+
+    def quit_driver(self):
+        """
+        Gives the browser back to the driver pool, or quits it when it was launched for this scraper
+        :return:
+        """
+        if self.driver_pool is not None:
+            self.driver_pool.release(self.driver)
+        else:
+            self.driver.close()
+            self.driver.quit()
 
-    def save_cookie_to_disk(self, cookies_dict):
+    def save_cookie_to_disk(self, cookies_dict=None):
         """
-        Saves cookie  file to disk. To be used for sending tracking requests
-        :param cookies_dict:
+        Saves the site's cookie store to disk. The curl client of the site picks the cookies up from there
+        :param cookies_dict: Plain name/value cookies to add first. Cookies read with get_curl_formatted_cookies_from_browser(self.cookie_store) are already in the store
         :return:
         """
         logger.info(f"\nINFO: SAVING COOKIES TO DISK")
-        with open(f'{self.username}.cookie', 'wb') as cookie_store:
-            pickle.dump(cookies_dict, cookie_store)
-            logger.info("INFO: Cookie saved")
+        if cookies_dict:
+            self.cookie_store.update(cookies_dict)
+        self.cookie_store.save()
+        logger.info("INFO: Cookie saved")
 
     def check_loading_status(self):
         """
@@ -81,7 +102,6 @@ class ORMedSeleniumScraper:
                     ormed_id_regex = re.compile(r'EntityID=(\d+)')
 
                     base_xpath_for_result = "(//a[contains(@href, '.aspx?EntityID')])"
-                    base_xpath_for_name = "(//a[contains(@href, '.aspx?EntityID')]/../h4)"
                     xpath_for_page_nums = "(//li[contains(@ng-click, 'c.search(page.number)')]/a[@href])"
 
                     while next_view:
@@ -98,13 +118,12 @@ class ORMedSeleniumScraper:
                                 # Need to check if new page loaded after click. The results count text is updated after each page click
                                 self.check_loading_status()
 
-                            num_results = self.navigator.get_number_of_elements(xpath=base_xpath_for_result, time_delay=0.5)
+                            # Link and name (the h4 next to the link) of every result in the page, read in one round trip
+                            results = self.navigator.get_elements_data(xpath=base_xpath_for_result, fields={"href": "@href", "name": "../h4"}, time_delay=0.5)
 
-                            for idx in range(1, num_results + 1):
-                                current_result_xpath = f"{base_xpath_for_result}[{idx}]"
-                                current_name_xpath = f"{base_xpath_for_name}[{idx}]"
-                                ele = self.navigator.getElementAttributeAsText(xpath=current_result_xpath, attribute_name="href")
-                                name = self.navigator.get_element_text(xpath=current_name_xpath)
+                            for result in results:
+                                ele = result["href"]
+                                name = result["name"]
                                 try:
                                     asmb_id = ormed_id_regex.search(ele).group(1)
                                     logger.info(f"INFO: Found Entity Id: {asmb_id} | {name}")
@@ -142,7 +161,7 @@ class ORMedSeleniumScraper:
                             self.check_loading_status()
                             self.navigator.check_page_loaded(page_load_xpath=results_loaded_xpath)
 
-        cookies_dict = self.navigator.get_curl_formatted_cookies_from_browser()
-        self.save_cookie_to_disk(cookies_dict)
+        self.navigator.get_curl_formatted_cookies_from_browser(self.cookie_store)
+        self.save_cookie_to_disk()
 
         return or_med_id_list
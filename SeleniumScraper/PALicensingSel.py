@@ -1,30 +1,170 @@
 import re
-import pickle
+import time
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import Select, WebDriverWait
 from SeleniumScraper.SeleniumPageNavigator import get_chrome_driver, SelemiumPageNavigetor
+from CurlScraper.CoreLibrary.CookieStore import CookieStore
+from CurlScraper.CoreLibrary.CodeTable import CodeTable
 from LoggingModule import set_logging
 
 logger = set_logging()
 
+# Option values of the search drop downs look like "number:123"
+OPTION_VALUE_REGEX = re.compile(r'number:(\d+)')
+PROFESSION_TYPE_SELECT_XPATH = "(//select[contains(@name, 'ProfessionType')])"
+LICENSE_TYPE_SELECT_XPATH = "(//select[contains(@name, 'LicenseType')])"
+# Text and value of every option of a select, read in one script call instead of one call per option element
+SELECT_OPTIONS_SCRIPT = "return Array.from(arguments[0].options).map(function (o) { return [o.text.trim(), o.value]; });"
+# Removes the id options of a select (keeps the "Select ..." option), so options seen afterwards were loaded after it ran
+CLEAR_OPTIONS_SCRIPT = "Array.from(arguments[0].options).forEach(function (o) { if (/number:/.test(o.value)) { o.remove(); } });"
+
+
 class PALSSeleniumScraper:
     SITE_NAME = "PALicensingSystem"
     MAIN_PAGE = "https://www.pals.pa.gov/#/page/default"
     LICENSE_SEARCH_URL = "https://www.pals.pa.gov/#/page/search"
 
-    def __init__(self):
-        self.driver = get_chrome_driver(dataDirName=self.SITE_NAME)
+    def __init__(self, driver_pool=None, driver_timeout=300):
+        """
+        :param driver_pool: DriverPool to take the browser from (and give it back to in quit_driver). A new browser is launched otherwise
+        :param driver_timeout: Seconds to wait for a free browser of driver_pool. TimeoutError after that
+        """
+        self.driver_pool = driver_pool
+        if driver_pool is not None:
+            self.driver = driver_pool.acquire(timeout=driver_timeout)
+        else:
+            self.driver = get_chrome_driver(dataDirName=self.SITE_NAME)
         self.navigator = SelemiumPageNavigetor(self.driver)
         self.username = self.SITE_NAME
+        self.cookie_store = CookieStore.for_site(self.SITE_NAME)
 
-    def save_cookie_to_disk(self, cookies_dict):
+    def quit_driver(self):
         """
-        Saves cookie  file to disk. To be used for sending tracking requests
-        :param cookies_dict:
+        Gives the browser back to the driver pool, or quits it when it was launched for this scraper
+        :return:
+        """
+        if self.driver_pool is not None:
+            self.driver_pool.release(self.driver)
+        else:
+            self.driver.close()
+            self.driver.quit()
+
+    def save_cookie_to_disk(self, cookies_dict=None):
+        """
+        Saves the site's cookie store to disk. The curl client of the site picks the cookies up from there
+        :param cookies_dict: Plain name/value cookies to add first. Cookies read with get_curl_formatted_cookies_from_browser(self.cookie_store) are already in the store
         :return:
         """
         logger.info(f"\nINFO: SAVING COOKIES TO DISK")
-        with open(f'{self.username}.cookie', 'wb') as cookie_store:
-            pickle.dump(cookies_dict, cookie_store)
-            logger.info("INFO: Cookie saved")
+        if cookies_dict:
+            self.cookie_store.update(cookies_dict)
+        self.cookie_store.save()
+        logger.info("INFO: Cookie saved")
+
+    @classmethod
+    def lookup_board_and_licence_type_codes(cls, board_or_commission, license_type, ttl=None):
+        """
+        Same result as get_board_and_licence_type_codes, from the code table saved on disk. The browser is only started
+        to fill the table, when it is older than ttl or does not know the names
+        :param board_or_commission:
+        :param license_type:
+        :param ttl: Seconds the table is used for. Defaults to the table's own
+        :return: {"professionID": ..., "licenseTypeId": ...}. The values are None when the names are not on the site
+        """
+        code_table = CodeTable.for_site(cls.SITE_NAME)
+        if ttl is not None:
+            code_table.ttl = ttl
+        codes = code_table.resolve(board_or_commission, license_type, fetch=lambda: cls().get_all_board_and_licence_type_codes())
+        professionID, licenseTypeId = codes if codes else (None, None)
+        logger.info(f"INFO: Codes for {board_or_commission} / {license_type}: professionID {professionID}, licenseTypeId {licenseTypeId}")
+        return {"professionID": professionID, "licenseTypeId": licenseTypeId}
+
+    def get_select_options(self, select_xpath):
+        """
+        :return: list of (text, id) of the options of the select whose value has an id (skips the "Select ..." option)
+        """
+        select_element = self.driver.find_element(By.XPATH, select_xpath)
+        options = []
+        for text, value in self.driver.execute_script(SELECT_OPTIONS_SCRIPT, select_element):
+            value_match = OPTION_VALUE_REGEX.search(value or "")
+            if value_match:
+                options.append((text, value_match.group(1)))
+        return options
+
+    def get_all_board_and_licence_type_codes(self, timeout=15, same_options_settle=2):
+        """
+        Reads every board/commission and the license types of each from the search page in one browser session.
+        Selecting a board makes the page load its license types. The license type options are cleared before each board
+        is selected and polled until the board's own options are in, instead of sleeping a fixed time. Options that
+        differ from the previous board's are taken at once. The same options as the previous board are only taken once
+        they stayed for same_options_settle seconds, as the page may still be showing the previous board's list.
+        Boards whose license types did not load are tried once more at the end
+        :param timeout: Seconds to wait for the license types of a board
+        :param same_options_settle: Seconds the previous board's options must stay before they count for this board too
+        :return: {board name: {"id": professionID, "items": {license type name: licenseTypeId}}}, the layout CodeTable.replace takes.
+        "items" is None for a board whose license types never loaded, so the table is not saved with it
+        """
+        boards = {}
+        try:
+            self.navigator.get_page(self.LICENSE_SEARCH_URL)
+            form_xpath = "(//form[contains(@name, 'SerachFilter')])"
+            if not self.navigator.check_page_loaded(page_load_xpath=form_xpath):
+                logger.info(f"ERROR: Search form did not load. Could not read board and license type codes")
+                return boards
+
+            last_options = []
+            timed_out = []
+            for board_name, professionID in self.get_select_options(PROFESSION_TYPE_SELECT_XPATH):
+                license_type_options = self._select_board_license_types(professionID, last_options, timeout, same_options_settle)
+                if license_type_options is None:
+                    logger.info(f"ERROR: No license types loaded for {board_name}. Trying it again at the end")
+                    timed_out.append((board_name, professionID))
+                    continue
+                last_options = license_type_options
+                boards[board_name] = {"id": professionID, "items": dict(license_type_options)}
+                logger.info(f"INFO: {board_name} ({professionID}): {len(license_type_options)} license types")
+
+            for board_name, professionID in timed_out:
+                license_type_options = self._select_board_license_types(professionID, last_options, timeout, same_options_settle)
+                if license_type_options is None:
+                    logger.info(f"ERROR: No license types loaded for {board_name} on the second try either")
+                    boards[board_name] = {"id": professionID, "items": None}
+                    continue
+                last_options = license_type_options
+                boards[board_name] = {"id": professionID, "items": dict(license_type_options)}
+                logger.info(f"INFO: {board_name} ({professionID}): {len(license_type_options)} license types")
+
+            self.navigator.get_curl_formatted_cookies_from_browser(self.cookie_store)
+            self.save_cookie_to_disk()
+        except Exception as e:
+            logger.info(f"ERROR: Could not read board and license type codes. DETAILS: {e}")
+        finally:
+            self.quit_driver()
+        return boards
+
+    def _select_board_license_types(self, professionID, last_options, timeout, same_options_settle):
+        """
+        Selects the board and waits for its license types, see get_all_board_and_licence_type_codes
+        :param last_options: License type options of the last board that loaded any
+        :return: list of (text, id) of the board's license types, None when none loaded within timeout
+        """
+        license_type_select = self.driver.find_element(By.XPATH, LICENSE_TYPE_SELECT_XPATH)
+        self.driver.execute_script(CLEAR_OPTIONS_SCRIPT, license_type_select)
+        Select(self.driver.find_element(By.XPATH, PROFESSION_TYPE_SELECT_XPATH)).select_by_value(f"number:{professionID}")
+        selected_at = time.time()
+
+        def license_types_loaded(driver):
+            options = self.get_select_options(LICENSE_TYPE_SELECT_XPATH)
+            if not options:
+                return False
+            if options != last_options or time.time() - selected_at >= same_options_settle:
+                return options
+            return False
+
+        try:
+            return WebDriverWait(self.driver, timeout).until(license_types_loaded)
+        except Exception:
+            return None
 
     def get_board_and_licence_type_codes(self, board_or_commission, license_type):
         """
@@ -37,48 +177,48 @@ class PALSSeleniumScraper:
         licenseTypeID = None
         info_id = {}
 
-        self.navigator.get_page(self.LICENSE_SEARCH_URL)
+        try:
+            self.navigator.get_page(self.LICENSE_SEARCH_URL)
 
-        form_xpath = "(//form[contains(@name, 'SerachFilter')])"
-        form_page_load = self.navigator.check_page_loaded(page_load_xpath=form_xpath)
+            form_xpath = "(//form[contains(@name, 'SerachFilter')])"
+            form_page_load = self.navigator.check_page_loaded(page_load_xpath=form_xpath)
 
-        if form_page_load:
-            profession_type_dropdown_xpath = "(//select[contains(@name, 'ProfessionType')])"
-            self.navigator.click_element(xpath=profession_type_dropdown_xpath)
+            if form_page_load:
+                profession_type_dropdown_xpath = "(//select[contains(@name, 'ProfessionType')])"
+                self.navigator.click_element(xpath=profession_type_dropdown_xpath)
 
-            profession_selector_xpath = f"(//option[text()='{board_or_commission}'])"
-            self.navigator.click_element(xpath=profession_selector_xpath)
-            professionID_value = self.navigator.getElementAttributeAsText(xpath=profession_selector_xpath, attribute_name="value")
-
-            value_regex = re.compile(r'number:(\d+)')
-            try:
-                professionID = value_regex.search(professionID_value).group(1) # type: ignore
-                logger.info(f"INFO: Profession Id found for {board_or_commission}: {professionID}")
-            except Exception as e:
-                logger.info(f"ERROR: Could not get profession id for {board_or_commission}. DETAILS: {e}")
-
-            license_type_dropdown_xpath = "(//select[contains(@name, 'LicenseType')])"
-            license_type_selector_xpath = f"(//option[text()='{license_type}'])"
-
-            # Check if the license type dropdown values have been set first before clicking on the dropdown
-            license_select_page_load = self.navigator.check_page_loaded(page_load_xpath=license_type_selector_xpath)
-            if license_select_page_load:
-                self.navigator.click_element(xpath=license_type_dropdown_xpath)
-                self.navigator.click_element(xpath=license_type_selector_xpath)
-                licenseTypeId_value = self.navigator.getElementAttributeAsText(xpath=license_type_selector_xpath, attribute_name="value")
+                profession_selector_xpath = f"(//option[text()='{board_or_commission}'])"
+                self.navigator.click_element(xpath=profession_selector_xpath)
+                professionID_value = self.navigator.getElementAttributeAsText(xpath=profession_selector_xpath, attribute_name="value")
 
+                value_regex = re.compile(r'number:(\d+)')
                 try:
-                    licenseTypeID = value_regex.search(licenseTypeId_value).group(1) # type: ignore
-                    logger.info(f"INFO: License type Id found for {license_type}: {licenseTypeID}")
+                    professionID = value_regex.search(professionID_value).group(1) # type: ignore
+                    logger.info(f"INFO: Profession Id found for {board_or_commission}: {professionID}")
                 except Exception as e:
-                    logger.info(f"ERROR: License type Id for {license_type}. DETAILS: {e}")
-
-        info_id["professionID"] = professionID
-        info_id["licenseTypeId"] = licenseTypeID
-
-        cookies_dict = self.navigator.get_curl_formatted_cookies_from_browser()
-        self.save_cookie_to_disk(cookies_dict)
-
-        self.navigator.driver.close()
-        self.navigator.driver.quit()
+                    logger.info(f"ERROR: Could not get profession id for {board_or_commission}. DETAILS: {e}")
+
+                license_type_dropdown_xpath = "(//select[contains(@name, 'LicenseType')])"
+                license_type_selector_xpath = f"(//option[text()='{license_type}'])"
+
+                # Check if the license type dropdown values have been set first before clicking on the dropdown
+                license_select_page_load = self.navigator.check_page_loaded(page_load_xpath=license_type_selector_xpath)
+                if license_select_page_load:
+                    self.navigator.click_element(xpath=license_type_dropdown_xpath)
+                    self.navigator.click_element(xpath=license_type_selector_xpath)
+                    licenseTypeId_value = self.navigator.getElementAttributeAsText(xpath=license_type_selector_xpath, attribute_name="value")
+
+                    try:
+                        licenseTypeID = value_regex.search(licenseTypeId_value).group(1) # type: ignore
+                        logger.info(f"INFO: License type Id found for {license_type}: {licenseTypeID}")
+                    except Exception as e:
+                        logger.info(f"ERROR: License type Id for {license_type}. DETAILS: {e}")
+
+            info_id["professionID"] = professionID
+            info_id["licenseTypeId"] = licenseTypeID
+
+            self.navigator.get_curl_formatted_cookies_from_browser(self.cookie_store)
+            self.save_cookie_to_disk()
+        finally:
+            self.quit_driver()
         return info_id
@@ -8,10 +8,42 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import TimeoutException
+from SeleniumScraper.WaitStrategy import WaitStrategy, fixed_poll_seconds
 from LoggingModule import set_logging
 
 logger = set_logging()
 
+# Reads fields of every element matching an XPath or CSS query in one script call.
+# arguments: query, true for XPath / false for CSS, {field name: field spec}. A field spec is "text" (the element's
+# text), "@name" (its name attribute, as written in the html) or a query relative to the element (the text of the first match)
+ELEMENTS_DATA_SCRIPT = """
+var query = arguments[0], isXpath = arguments[1], fields = arguments[2];
+function findAll(q, context) {
+    if (!isXpath) { return Array.from(context.querySelectorAll(q)); }
+    var snapshot = document.evaluate(q, context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null), nodes = [];
+    for (var i = 0; i < snapshot.snapshotLength; i++) { nodes.push(snapshot.snapshotItem(i)); }
+    return nodes;
+}
+function findOne(q, context) {
+    if (!isXpath) { return context.querySelector(q); }
+    return document.evaluate(q, context, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function textOf(node) {
+    if (!node) { return null; }
+    return (node.innerText !== undefined ? node.innerText : node.textContent).trim();
+}
+return findAll(query, document).map(function (element) {
+    var row = {};
+    for (var name in fields) {
+        var spec = fields[name];
+        if (spec === 'text') { row[name] = textOf(element); }
+        else if (spec.charAt(0) === '@') { row[name] = element.getAttribute(spec.slice(1)); }
+        else { row[name] = textOf(findOne(spec, element)); }
+    }
+    return row;
+});
+"""
+
 def get_chrome_driver(dataDirName, headless=False):
     """
     Sets up webdriver Chrome instance for searching through emails
@@ -46,18 +78,37 @@ def get_chrome_driver(dataDirName, headless=False):
 
 
 class SelemiumPageNavigetor:
-    def __init__(self, driver: Chrome):
+    def __init__(self, driver: Chrome, wait_strategy=None):
+        """
+        :param driver:
+        :param wait_strategy: WaitStrategy for the waits around actions. Defaults to waiting for the page rather than
+        fixed sleeps, pass WaitStrategy(fixed_sleeps=True) for the fixed sleeps
+        """
         self.driver = driver
+        self.wait_strategy = wait_strategy or WaitStrategy()
 
     def check_page_state(self, time_out=8):
+        start = time.time()
         state = self.driver.execute_script('return document.readyState')
         logger.info(f"INFO: Document state: {state}")
-        while state != 'complete' and time_out > 0:
-            time.sleep(1)
-            logger.info(f"INFO: Waiting for page load to complete. Time left: {time_out}")
-            state = self.driver.execute_script('return document.readyState')
-            logger.info(f"INFO:Current document state: {state}")
-            time_out = time_out - 1
+        if self.wait_strategy.fixed_sleeps:
+            while state != 'complete' and time_out > 0:
+                time.sleep(1)
+                logger.info(f"INFO: Waiting for page load to complete. Time left: {time_out}")
+                state = self.driver.execute_script('return document.readyState')
+                logger.info(f"INFO:Current document state: {state}")
+                time_out = time_out - 1
+            waited = time.time() - start
+            self.wait_strategy.record("page_state", waited, waited)
+        elif state != 'complete':
+            try:
+                WebDriverWait(self.driver, time_out, poll_frequency=self.wait_strategy.poll_interval).until(
+                    lambda driver: driver.execute_script('return document.readyState') == 'complete')
+            except TimeoutException:
+                logger.info(f"WARNING: Page load did not complete in {time_out} seconds")
+            waited = time.time() - start
+            # The fixed path checks once a second
+            self.wait_strategy.record("page_state", waited, min(fixed_poll_seconds(waited, 1), time_out))
 
     def refresh_page(self, time_out=30):
         logger.info(f"\nINFO: Refreshing current page!")
@@ -183,21 +234,19 @@ class SelemiumPageNavigetor:
 
     def switchToIframe(self, xpath, time_delay=3.0, pause_after_action=1):
         try:
-            wait = WebDriverWait(self.driver, time_delay)
-            wait.until(EC.frame_to_be_available_and_switch_to_it((By.XPATH, xpath)))
+            self.wait_strategy.until(self.driver, "switch_to_iframe_ready", time_delay, EC.frame_to_be_available_and_switch_to_it((By.XPATH, xpath)))
             logger.info(f"LOG INFO: Switched to iframe at {xpath}")
         except Exception as e:
             # traceback.print_exc()
             logger.info(f"ERROR: Error switching to iframe at {xpath}. Details {e}")
             return False
-        time.sleep(pause_after_action)
+        self.wait_strategy.settle(self.driver, "switch_to_iframe", pause_after_action)
         return True
 
     def enter_field_value(self, xpath, value, time_delay=3.0, pause_after_action=1):
         try:
-            empty_field = WebDriverWait(self.driver, time_delay).until(EC.element_to_be_clickable((By.XPATH, xpath)))
-            sleepTime = time_delay / 2
-            time.sleep(sleepTime)
+            empty_field = self.wait_strategy.until(self.driver, "enter_field_value_ready", time_delay, EC.element_to_be_clickable((By.XPATH, xpath)))
+            self.wait_strategy.skip("enter_field_value_delay", time_delay / 2)
             empty_field.click()
             empty_field.clear()
             empty_field.send_keys(str(value))
@@ -205,23 +254,21 @@ class SelemiumPageNavigetor:
         except Exception as e:
             logger.info(f"ERROR: First Exception entering value {e}")
             try:
-                empty_field = WebDriverWait(self.driver, time_delay).until(EC.element_to_be_clickable((By.XPATH, xpath)))
-                sleepTime = time_delay / 2
-                time.sleep(sleepTime)
+                empty_field = self.wait_strategy.until(self.driver, "enter_field_value_ready", time_delay, EC.element_to_be_clickable((By.XPATH, xpath)))
+                self.wait_strategy.skip("enter_field_value_delay", time_delay / 2)
                 empty_field.send_keys(str(value))
                 logger.info(f"INFO: Entered value into field at {xpath}")
             except Exception as e_:
                 # traceback.print_exc()
                 logger.info(f"ERROR: Error entering value for the element given by xpath {xpath}. Details {e_} ")
                 return False
-        time.sleep(pause_after_action)
+        self.wait_strategy.settle(self.driver, "enter_field_value", pause_after_action)
         return True
 
     def sendReturnKey(self, xpath, time_delay=3.0, pause_after_action=1):
         try:
-            empty_field = WebDriverWait(self.driver, time_delay).until(EC.element_to_be_clickable((By.XPATH, xpath)))
-            sleepTime = time_delay / 2
-            time.sleep(sleepTime)
+            empty_field = self.wait_strategy.until(self.driver, "send_return_key_ready", time_delay, EC.element_to_be_clickable((By.XPATH, xpath)))
+            self.wait_strategy.skip("send_return_key_delay", time_delay / 2)
             empty_field.send_keys(Keys.ENTER)
             logger.info(f"INFO: ENTER Key sent into field at {xpath}")
         except Exception as e:
@@ -229,17 +276,16 @@ class SelemiumPageNavigetor:
             logger.info(f"ERROR: Error entering value for the element given by xpath {xpath}. Details {e}")
             return False
 
-        time.sleep(pause_after_action)
+        self.wait_strategy.settle(self.driver, "send_return_key", pause_after_action)
         return True
 
     def click_element(self, xpath, time_delay=3.0, pause_after_action=1):
         try:
-            element = WebDriverWait(self.driver, time_delay).until(EC.element_to_be_clickable((By.XPATH, xpath)))
-            sleepTime = time_delay / 2
-            time.sleep(sleepTime)
+            element = self.wait_strategy.until(self.driver, "click_element_ready", time_delay, EC.element_to_be_clickable((By.XPATH, xpath)))
+            self.wait_strategy.skip("click_element_delay", time_delay / 2)
             element.click()
             logger.info(f"INFO: Element at {xpath}  successfully clicked")
-            time.sleep(pause_after_action)
+            self.wait_strategy.settle(self.driver, "click_element", pause_after_action)
         except Exception as e:
             # traceback.print_exc()
             logger.info(f"ERROR: Error clicking element given by xpath {xpath}. Details {e}")
@@ -272,7 +318,8 @@ class SelemiumPageNavigetor:
         return element_text
 
     def get_number_of_elements(self, xpath, time_delay=3.0):
-        time.sleep(time_delay)
+        # Counting while results are still being added would come up short, so the page has to settle first
+        self.wait_strategy.settle(self.driver, "get_number_of_elements", time_delay)
         try:
             elements = self.driver.find_elements(By.XPATH, xpath)
             numElements = len(elements)
@@ -282,6 +329,37 @@ class SelemiumPageNavigetor:
 
         return numElements
 
+    def get_elements_data(self, xpath=None, css=None, fields=None, time_delay=3.0):
+        """
+        Reads fields of every element matching xpath (or css) in one WebDriver round trip, instead of one wait and one
+        call per element and field with get_element_text / getElementAttributeAsText
+        :param xpath: XPath of the elements
+        :param css: CSS selector of the elements, when xpath is not given
+        :param fields: {field name: field spec}, see ELEMENTS_DATA_SCRIPT. Eg {"href": "@href", "name": "../h4"}. Defaults to {"text": "text"}
+        :param time_delay: Most seconds to wait for the page to settle first (like get_number_of_elements)
+        :return: list of {field name: value} dicts, one per element in document order. Empty when the script fails
+        """
+        if fields is None:
+            fields = {"text": "text"}
+        self.wait_strategy.settle(self.driver, "get_elements_data", time_delay)
+        try:
+            return self.driver.execute_script(ELEMENTS_DATA_SCRIPT, xpath or css, xpath is not None, fields)
+        except Exception as e:
+            logger.info(f"ERROR: Could not read elements at {xpath or css}. Details {e}")
+            return []
+
+    def get_elements_attribute(self, attribute_name, xpath=None, css=None, time_delay=3.0):
+        """
+        :return: list of the attribute_name attribute of every element matching xpath (or css), in one round trip
+        """
+        return [row["value"] for row in self.get_elements_data(xpath=xpath, css=css, fields={"value": f"@{attribute_name}"}, time_delay=time_delay)]
+
+    def get_elements_text(self, xpath=None, css=None, time_delay=3.0):
+        """
+        :return: list of the text of every element matching xpath (or css), in one round trip
+        """
+        return [row["text"] for row in self.get_elements_data(xpath=xpath, css=css, time_delay=time_delay)]
+
     def getHtmlElementObjectAsText(self, xpath, time_delay=3.0):
         try:
             elementObject = WebDriverWait(self.driver, time_delay).until(EC.presence_of_element_located((By.XPATH, xpath)))
@@ -382,8 +460,8 @@ class SelemiumPageNavigetor:
             # Scroll down to bottom
             self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
 
-            # Wait to load page
-            time.sleep(SCROLL_PAUSE_TIME)
+            # Wait to load page. Without fixed sleeps, until what the scroll loaded is in and the page is quiet
+            self.wait_strategy.settle(self.driver, "scroll", SCROLL_PAUSE_TIME)
 
             # Calculate new scroll height and compare with last scroll height
             new_height = self.driver.execute_script("return document.body.scrollHeight")
@@ -392,10 +470,18 @@ class SelemiumPageNavigetor:
             last_height = new_height
             logger.info(f"Scroll # {scroll_count} done!")
 
-    def get_curl_formatted_cookies_from_browser(self):
+    def get_wait_report(self):
+        """
+        Seconds waited per kind of wait so far, next to what the fixed sleeps take for the same steps. See WaitStrategy.report
+        :return:
+        """
+        return self.wait_strategy.log_report()
+
+    def get_curl_formatted_cookies_from_browser(self, cookie_store=None):
         """
         Each entry in a browser cookie list is a dict with cookie name, value, domain and keys
         For curl cookies, we need just the name and the value of the cookies
+        :param cookie_store: Optional CookieStore that gets the full cookies, with their expiry, so curl clients can reuse them
         :return:
         """
         cookies_list = self.driver.get_cookies()
@@ -403,4 +489,7 @@ class SelemiumPageNavigetor:
         for cookie in cookies_list:
             cookies_dict[cookie['name']] = cookie['value']
 
+        if cookie_store is not None:
+            cookie_store.add_browser_cookies(cookies_list)
+
         return cookies_dict
@@ -0,0 +1,182 @@
+import math
+import time
+from collections import defaultdict, deque
+from selenium.webdriver.support.ui import WebDriverWait
+from LoggingModule import set_logging
+
+logger = set_logging()
+
+# Installs (once per document) a MutationObserver and XHR/fetch counters, then returns
+# [ms since the DOM last changed, requests in flight, document.readyState] in the same call.
+# A new document (navigation) drops the hooks, the next call installs them again
+PAGE_ACTIVITY_SCRIPT = """
+var state = window.__scraperWaitState;
+if (!state) {
+    state = window.__scraperWaitState = {lastChange: Date.now(), pending: 0};
+    var touch = function () { state.lastChange = Date.now(); };
+    new MutationObserver(touch).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        state.pending++;
+        this.addEventListener('loadend', function () { state.pending--; touch(); });
+        return send.apply(this, arguments);
+    };
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function () {
+            state.pending++;
+            return fetch.apply(this, arguments).finally(function () { state.pending--; touch(); });
+        };
+    }
+}
+return [Date.now() - state.lastChange, state.pending, document.readyState];
+"""
+
+
+class WaitStrategy:
+    """
+    How SelemiumPageNavigetor waits around its actions.
+    With fixed_sleeps the navigator sleeps the time_delay / pause_after_action it is given, as it always has.
+    Otherwise it waits for the page instead: an action is taken as soon as its element is ready, and afterwards the
+    navigator only waits until the DOM has not changed for quiet_period seconds with no XHR/fetch in flight (network idle).
+    Readiness timeouts adapt to the site: a wait may run up to timeout_factor times the slowest recent wait of the same
+    kind, so a slow site is not cut off at the caller's time_delay, up to max_timeout. Settling after an action never
+    takes longer than the fixed sleep it replaces.
+    Every wait is recorded next to the fixed sleep it replaced, see report
+    """
+
+    def __init__(self, fixed_sleeps=False, quiet_period=0.3, poll_interval=0.1, timeout_factor=2.0, max_timeout=30, history=20):
+        """
+        :param fixed_sleeps: Sleep the fixed times instead of waiting for the page
+        :param quiet_period: Seconds without DOM changes or requests in flight after which the page is taken as settled
+        :param poll_interval: Seconds between checks of the page
+        :param timeout_factor: Times the slowest recent wait of a kind that the next one may take
+        :param max_timeout: Seconds no adapted timeout goes over
+        :param history: Recent waits per kind the timeouts are adapted from
+        """
+        self.fixed_sleeps = fixed_sleeps
+        self.quiet_period = quiet_period
+        self.poll_interval = poll_interval
+        self.timeout_factor = timeout_factor
+        self.max_timeout = max_timeout
+        self._recent = defaultdict(lambda: deque(maxlen=history))
+        self._totals = defaultdict(lambda: {"count": 0, "waited": 0.0, "fixed": 0.0})
+
+    def timeout(self, kind, time_delay):
+        """
+        :param kind: Kind of wait, eg "click_element" or "click_element_ready"
+        :param time_delay: Timeout the caller asked for. Never goes below it
+        :return: seconds
+        """
+        recent = self._recent[kind]
+        if not recent:
+            return time_delay
+        return max(time_delay, min(self.max_timeout, self.timeout_factor * max(recent)))
+
+    def record(self, action, waited, fixed, adapt=True):
+        """
+        :param action: name the wait is reported under
+        :param waited: seconds actually waited
+        :param fixed: seconds the fixed sleep path waits for the same step
+        :param adapt: Adapt the kind's timeout to this wait. Waits that timed out do not count, or a page that never
+        settles would push the timeout up on every wait
+        """
+        if adapt:
+            self._recent[action].append(waited)
+        totals = self._totals[action]
+        totals["count"] += 1
+        totals["waited"] += waited
+        totals["fixed"] += fixed
+
+    def until(self, driver, action, time_delay, condition):
+        """
+        WebDriverWait(driver, time_delay).until(condition), with an adapted timeout and the wait recorded.
+        Readiness waits are the same in both modes, so they are recorded as saving nothing
+        :return: what condition returned
+        """
+        start = time.time()
+        try:
+            result = WebDriverWait(driver, self.timeout(action, time_delay), poll_frequency=self.poll_interval).until(condition)
+        except Exception:
+            waited = time.time() - start
+            self.record(action, waited, waited, adapt=False)
+            raise
+        waited = time.time() - start
+        self.record(action, waited, waited)
+        return result
+
+    def page_activity(self, driver):
+        """
+        :return: (seconds since the DOM last changed, requests in flight, document.readyState)
+        """
+        since_change_ms, pending, ready_state = driver.execute_script(PAGE_ACTIVITY_SCRIPT)
+        return since_change_ms / 1000, pending, ready_state
+
+    def is_quiet(self, driver):
+        try:
+            since_change, pending, ready_state = self.page_activity(driver)
+        except Exception:
+            # Page is being replaced. Not settled yet
+            return False
+        return ready_state == "complete" and pending == 0 and since_change >= self.quiet_period
+
+    def settle(self, driver, action, fixed, timeout=None):
+        """
+        Waits after an action: sleeps fixed seconds with fixed_sleeps, otherwise until the page is quiet
+        :param action: name the wait is reported under
+        :param fixed: seconds the fixed sleep path sleeps here
+        :param timeout: Most seconds to wait for the page. Defaults to fixed, so a page that never settles costs no more
+        than the fixed sleep. Settle waits are not stretched by the adapted timeouts, a slow site is waited for in the
+        readiness waits of the next action (see until)
+        :return: seconds waited
+        """
+        start = time.time()
+        settled = True
+        if self.fixed_sleeps:
+            time.sleep(fixed)
+        elif fixed > 0 or timeout:
+            try:
+                WebDriverWait(driver, timeout or fixed, poll_frequency=self.poll_interval).until(self.is_quiet)
+            except Exception as e:
+                settled = False
+                logger.info(f"WARNING: Page did not settle after {action}. Going on. DETAILS: {e}")
+        waited = time.time() - start
+        self.record(action, waited, fixed, adapt=settled)
+        return waited
+
+    def skip(self, action, fixed):
+        """
+        Sleeps fixed seconds with fixed_sleeps, otherwise nothing, for sleeps the readiness checks already cover
+        (eg the sleep between an element turning clickable and clicking it)
+        """
+        if self.fixed_sleeps:
+            time.sleep(fixed)
+            self.record(action, fixed, fixed)
+        else:
+            self.record(action, 0.0, fixed)
+
+    def report(self):
+        """
+        :return: {action: {"count", "waited", "fixed", "saved"}} with seconds, plus a "total" entry
+        """
+        report = {}
+        total = {"count": 0, "waited": 0.0, "fixed": 0.0}
+        for action, totals in self._totals.items():
+            report[action] = {**{key: round(value, 3) for key, value in totals.items()}, "saved": round(totals["fixed"] - totals["waited"], 3)}
+            for key in total:
+                total[key] += totals[key]
+        report["total"] = {**{key: round(value, 3) for key, value in total.items()}, "saved": round(total["fixed"] - total["waited"], 3)}
+        return report
+
+    def log_report(self):
+        report = self.report()
+        for action, totals in report.items():
+            logger.info(f"INFO: Waits for {action}: {totals}")
+        return report
+
+
+def fixed_poll_seconds(waited, step):
+    """
+    Seconds a loop that sleeps step seconds between checks takes to see a wait of waited seconds end
+    """
+    return step * math.ceil(waited / step) if waited > 0 else 0
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+import shutil
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# The scraper modules are imported from the repository root, like the runner scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def scraper_cache_in_tmp(tmp_path, monkeypatch):
+    """
+    Every test runs in its own directory, so nothing lands in the repository's .scraper_cache
+    """
+    monkeypatch.chdir(tmp_path)
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """
+    /ok answers 200, /flaky answers 503 to the first failures requests of a path then 200, /echo answers the POST body
+    """
+    failures = 2
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        hits = self.server.hits
+        hits[self.path] = hits.get(self.path, 0) + 1
+        if self.path.startswith("/flaky") and hits[self.path] <= self.failures:
+            return self._send(503, b"busy")
+        return self._send(200, b"file contents")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        return self._send(200, json.dumps({"body": body.hex()}).encode(), "application/json")
+
+
+@pytest.fixture
+def local_server():
+    """
+    Base url of a local HTTP server (see LocalHandler). server.hits counts the requests per path
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalHandler)
+    server.hits = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+requires_curl = pytest.mark.skipif(shutil.which("curl") is None, reason="curl binary not installed")
@@ -0,0 +1,94 @@
+import json
+import time
+from CurlScraper.CoreLibrary.CookieStore import CookieStore
+from CurlScraper.CoreLibrary.IdIndex import IdIndex
+from CurlScraper.CoreLibrary.CodeTable import CodeTable
+
+
+def test_cookie_store_applies_set_cookie_headers():
+    store = CookieStore("cookies.json")
+    store.set_from_header("sid=abc; Path=/; Max-Age=3600; HttpOnly")
+    store.set_from_header("tracking=1; Max-Age=3600")
+    assert store.as_dict() == {"sid": "abc", "tracking": "1"}
+    assert store.is_valid()
+
+    # Newer values replace older ones, Max-Age=0 deletes
+    store.set_from_header("sid=def; Max-Age=3600")
+    store.set_from_header("tracking=; Max-Age=0")
+    assert store.as_dict() == {"sid": "def"}
+
+
+def test_cookie_store_drops_expired_cookies():
+    store = CookieStore("cookies.json", expiry_margin=60)
+    store.set("old", "1", expires=time.time() - 1)
+    store.set("soon", "2", expires=time.time() + 30)
+    assert store.as_dict() == {"soon": "2"}
+    # Expiring within the margin means the warm-up request is needed again
+    assert not store.is_valid()
+
+
+def test_cookie_store_round_trips_through_the_file():
+    store = CookieStore("cookies.json")
+    store.set("sid", "abc", expires=time.time() + 3600, domain="example.test")
+    store.save()
+    assert CookieStore("cookies.json").as_dict() == {"sid": "abc"}
+
+
+def test_store_of_another_version_is_ignored():
+    with open("codes.json", 'w') as codes_file:
+        json.dump({"version": -1, "fetched_at": time.time(), "groups": {}}, codes_file)
+    assert CodeTable("codes.json").read_file() is None
+
+
+def test_id_index_merge_adds_removes_and_keeps_first_seen():
+    index = IdIndex("ids.json")
+    assert index.merge(["A", "B", "C"]) == (["A", "B", "C"], [])
+    first_seen_b = index._entries["B"]["first_seen"]
+
+    added, removed = index.merge(["B", "C", "D", "D"])
+    assert (added, removed) == (["D"], ["A"])
+    assert index.ids() == ["B", "C", "D"]
+    assert index._entries["B"]["first_seen"] == first_seen_b
+    assert IdIndex("ids.json").ids() == ["B", "C", "D"]
+
+
+def test_id_index_keeps_stored_ids_when_enumeration_fails():
+    index = IdIndex("ids.json", ttl=0)
+    index.merge(["A"])
+
+    def broken():
+        raise RuntimeError("site down")
+    assert index.refresh(broken) is None
+    assert index.refresh(lambda: []) is None
+    assert index.ids() == ["A"]
+
+
+GROUPS = {"State Board of Pharmacy": {"id": "1", "items": {"Pharmacist": "5", "Pharmacy Intern": "6"}}}
+
+
+def test_code_table_resolve_fetches_once_and_matches_loosely():
+    table = CodeTable("codes.json")
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return GROUPS
+    assert table.resolve("state board of  PHARMACY", "pharmacist", fetch) == ("1", "5")
+    assert table.resolve("State Board of Pharmacy", "Pharmacy Intern", fetch) == ("1", "6")
+    # The table was filled by this process, so unknown names do not fetch it again
+    assert table.resolve("State Board of Pharmacy", "Nope", fetch) is None
+    assert len(fetches) == 1
+
+    # A table read from the file is filled again once for an unknown name
+    stored_table = CodeTable("codes.json")
+    assert stored_table.resolve("State Board of Pharmacy", "Nope", fetch) is None
+    assert stored_table.resolve("State Board of Pharmacy", "Nope either", fetch) is None
+    assert len(fetches) == 2
+    assert CodeTable("codes.json").lookup("State Board of Pharmacy", "Pharmacist") == ("1", "5")
+
+
+def test_code_table_with_unread_group_is_used_but_not_saved():
+    table = CodeTable("codes.json")
+    groups = dict(GROUPS, **{"State Board of Nursing": {"id": "2", "items": None}})
+    assert table.resolve("State Board of Pharmacy", "Pharmacist", lambda: groups) == ("1", "5")
+    assert CodeTable("codes.json").read_file() is None
@@ -0,0 +1,150 @@
+import re
+import pytest
+from urllib.parse import unquote_plus
+from CurlScraper.PALicensingCurl import PALS
+from CurlScraper.DCHealthCurl import DCHealth
+from CurlScraper.CoreLibrary.Pagination import IncompleteResultsError
+from CurlScraper.CoreLibrary.RetryPolicy import RetryPolicy
+
+
+def client(client_class):
+    """
+    Site client without the cookie warm-up request of its constructor
+    """
+    site_client = client_class.__new__(client_class)
+    site_client.cookies_dict = {}
+    site_client.curl_proxy = None
+    site_client.requester = None
+    site_client.get_requester().retry_policy = RetryPolicy(max_attempts=3, backoff_base=0.001)
+    return site_client
+
+
+def pals_with_pages(pages):
+    """
+    :param pages: function of the page number returning the summaries of that page, or raising when it fails
+    """
+    pals = client(PALS)
+    requested = []
+
+    def get_page(professionID, licenseTypeId, pageNo, curl_proxy=None):
+        requested.append(pageNo)
+        return pages(pageNo)
+    pals._get_licenses_summaries_page = get_page
+    pals._get_license_details = lambda personId, licenseNumber, licenseId, curl_proxy=None: {"LicenseNumber": licenseNumber}
+    return pals, requested
+
+
+def summaries(first, last):
+    return [{"PersonId": idx, "LicenseId": idx, "LicenseNumber": f"RP{idx}"} for idx in range(first, last)]
+
+
+def test_pals_ends_on_the_short_page():
+    pals, requested = pals_with_pages(lambda pageNo: summaries((pageNo - 1) * 10, min(pageNo * 10, 35)))
+    assert len(list(pals.iter_licenses_summaries(1, 1, max_pages_in_flight=2))) == 35
+    # Page 4 is short. At most max_pages_in_flight requests go past it
+    assert max(requested) <= 6
+
+
+def test_pals_ends_on_an_empty_page():
+    pals, _ = pals_with_pages(lambda pageNo: summaries((pageNo - 1) * 10, min(pageNo * 10, 30)))
+    assert len(list(pals.iter_licenses_summaries(1, 1))) == 30
+
+
+def test_pals_ends_when_the_site_ignores_the_page_number():
+    pals, _ = pals_with_pages(lambda pageNo: summaries(0, 10))
+    assert len(list(pals.iter_licenses_summaries(1, 1))) == 10
+
+
+def test_pals_failed_page_is_retried_and_never_the_end():
+    failures = {2: 2}
+
+    def pages(pageNo):
+        if failures.get(pageNo):
+            failures[pageNo] -= 1
+            raise ValueError("no list in response")
+        return summaries((pageNo - 1) * 10, min(pageNo * 10, 35))
+    pals, _ = pals_with_pages(pages)
+    assert len(list(pals.iter_licenses_summaries(1, 1))) == 35
+
+
+def test_pals_missing_page_gives_the_partial_details():
+    def pages(pageNo):
+        if pageNo == 2:
+            raise ValueError("no list in response")
+        return summaries((pageNo - 1) * 10, min(pageNo * 10, 35))
+    pals, _ = pals_with_pages(pages)
+    with pytest.raises(IncompleteResultsError) as error:
+        pals.get_all_license_details_for_type(1, 1)
+    assert error.value.missing == [2]
+    assert len(error.value.results) == 25
+
+
+def test_pals_failed_detail_does_not_end_the_others():
+    pals, _ = pals_with_pages(lambda pageNo: summaries((pageNo - 1) * 10, min(pageNo * 10, 15)))
+
+    def details(personId, licenseNumber, licenseId, curl_proxy=None):
+        if personId == 3:
+            raise RuntimeError("detail request failed")
+        return {"LicenseNumber": licenseNumber}
+    pals._get_license_details = details
+    license_details = pals.get_all_license_details_for_type(1, 1)
+    assert len(license_details) == 15
+    assert license_details.count({}) == 1
+
+
+class AuraSession:
+    """
+    Answers searchRemainingRecords like the DC site: 25 records per offset, an ERROR state past the last one
+    """
+
+    def __init__(self, total, answer=None):
+        self.total = total
+        self.answer = answer
+        self.offsets = []
+
+    def send(self, requester, url, proxy=None, page_redirects=False, form_data=None, verbose=True):
+        offset = int(re.search(r'"offsetCnt":"(\d+)"', unquote_plus(form_data)).group(1))
+        self.offsets.append(offset)
+        if self.answer:
+            answer = self.answer(offset)
+            if answer is not None:
+                return answer
+        if offset >= self.total:
+            return {"actions": [{"state": "ERROR", "error": ["offset"]}]}
+        records = [{"Name__c": f"n{idx}"} for idx in range(offset, min(offset + 25, self.total))]
+        return {"actions": [{"state": "SUCCESS", "returnValue": records}]}
+
+
+def dc_health(session, record_count):
+    dc = client(DCHealth)
+    dc.session = session
+    dc.get_record_count = lambda license_type, curl_proxy=None: record_count
+    return dc
+
+
+def test_dc_fetches_exactly_the_planned_offsets():
+    session = AuraSession(60)
+    records = dc_health(session, 60).get_all_licenses("PT", parallel=True)
+    assert [record["Name"] for record in records] == [f"n{idx}" for idx in range(60)]
+    assert sorted(session.offsets) == [0, 25, 50]
+
+
+def test_dc_missing_offset_gives_the_partial_results():
+    session = AuraSession(60, answer=lambda offset: {"actions": [{"state": "ERROR", "error": ["busy"]}]} if offset == 25 else None)
+    with pytest.raises(IncompleteResultsError) as error:
+        dc_health(session, 60).get_all_licenses("PT", parallel=True)
+    assert error.value.missing == [25]
+    assert len(error.value.results) == 35
+    assert session.offsets.count(25) == 3
+
+
+def test_dc_sequential_walk_stops_on_the_short_page():
+    session = AuraSession(60)
+    assert len(dc_health(session, None).get_all_licenses("PT", parallel=True)) == 60
+    assert session.offsets == [0, 25, 50]
+
+
+def test_dc_sequential_walk_stops_on_a_blocked_answer():
+    session = AuraSession(60, answer=lambda offset: {"actions": []})
+    assert dc_health(session, None).get_all_licenses("PT") == []
+    assert session.offsets == [0]
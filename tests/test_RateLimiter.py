@@ -0,0 +1,76 @@
+import time
+from CurlScraper.CoreLibrary.RateLimiter import HostRateLimiter
+from CurlScraper.CoreLibrary.PyCurlRequest import CurlRequests
+from CurlScraper.CoreLibrary.CurlResponse import CurlResponse
+
+
+def limiter(**kwargs):
+    return HostRateLimiter(path="rate_limits.sqlite", **kwargs)
+
+
+def tokens(rate_limiter, host):
+    return rate_limiter._connection().execute("SELECT tokens FROM hosts WHERE host = ?", (host,)).fetchone()[0]
+
+
+def in_flight(rate_limiter, host):
+    return rate_limiter._connection().execute("SELECT COUNT(*) FROM leases WHERE host = ?", (host,)).fetchone()[0]
+
+
+def test_cost_above_burst_leaves_the_bucket_in_debt():
+    rate_limiter = limiter(rate=10, burst=4)
+    lease_ids = rate_limiter.acquire("host", cost=10)
+    assert tokens(rate_limiter, "host") < -5
+    rate_limiter.release("host", lease_ids, 200, 0.1)
+
+    # The next request waits for the debt to be paid back: 6 tokens owed plus 1 at 10 per second
+    start = time.time()
+    rate_limiter.release("host", rate_limiter.acquire("host"), 200, 0.1)
+    assert time.time() - start >= 0.5
+
+
+def test_slots_are_capped_at_the_concurrency_limit_and_released_together():
+    rate_limiter = limiter(rate=100, burst=100, initial_concurrency=3)
+    lease_ids = rate_limiter.acquire("host", cost=10, slots=10)
+    assert len(lease_ids) == 3
+    assert in_flight(rate_limiter, "host") == 3
+    rate_limiter.release("host", lease_ids, 200, 0.1)
+    assert in_flight(rate_limiter, "host") == 0
+
+
+def test_throttle_status_halves_the_concurrency_limit():
+    rate_limiter = limiter(initial_concurrency=8)
+    rate_limiter.release("host", rate_limiter.acquire("host"), 503, 0.1)
+    assert rate_limiter.concurrency_limit("host") == 4
+    rate_limiter.release("host", rate_limiter.acquire("host"), None, 0.1)
+    assert rate_limiter.concurrency_limit("host") == 2
+
+
+class RecordingTransport:
+    """
+    Batch transport that records what the limiter held while the batch ran
+    """
+    parallel_max = 10
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self.batches = []
+
+    def send_batch(self, prepared_requests, parallel_max=None):
+        self.batches.append({"parallel_max": parallel_max, "in_flight": in_flight(self.rate_limiter, "example.test"),
+                             "tokens": tokens(self.rate_limiter, "example.test")})
+        return [CurlResponse([b"HTTP/1.1 200 OK\r\n\r\n"]) for _ in prepared_requests]
+
+
+def test_batch_takes_a_token_per_transfer_and_a_slot_per_parallel_transfer():
+    rate_limiter = limiter(rate=100, burst=20, initial_concurrency=4)
+    transport = RecordingTransport(rate_limiter)
+    requester = CurlRequests({}, transport=transport, rate_limiter=rate_limiter)
+    prepared_requests = [requester.prepare_request(f"http://example.test/{idx}") for idx in range(12)]
+
+    requester.send_transport_batch_limited(prepared_requests)
+    batch = transport.batches[0]
+    # 12 tokens out of 20, and min(parallel_max 10, 12 transfers) slots capped at the limit of 4
+    assert 7.5 <= batch["tokens"] <= 8.5
+    assert batch["in_flight"] == 4
+    assert batch["parallel_max"] == 4
+    assert in_flight(rate_limiter, "example.test") == 0
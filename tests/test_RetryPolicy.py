@@ -0,0 +1,95 @@
+import pytest
+from CurlScraper.CoreLibrary.CurlResponse import CurlResponse
+from CurlScraper.CoreLibrary.RetryPolicy import RetryPolicy
+from CurlScraper.CoreLibrary.Transports import ConnectError
+
+
+def prepared(method="GET"):
+    return {"url": "http://example.test/page", "method": method, "connect_timeout": None}
+
+
+def response(status, headers=b""):
+    if status is None:
+        return CurlResponse()
+    return CurlResponse([f"HTTP/1.1 {status} X\r\n".encode() + headers + b"\r\n"])
+
+
+def test_should_retry_idempotent_on_retry_statuses_only():
+    policy = RetryPolicy()
+    assert policy.should_retry(prepared(), response(503), None)
+    assert policy.should_retry(prepared(), response(429), None)
+    assert not policy.should_retry(prepared(), response(404), None)
+    assert not policy.should_retry(prepared(), response(200), None)
+
+
+def test_should_retry_post_only_when_it_never_reached_the_server():
+    policy = RetryPolicy()
+    assert not policy.should_retry(prepared("POST"), response(503), None)
+    assert not policy.should_retry(prepared("POST"), None, TimeoutError())
+    assert policy.should_retry(prepared("POST"), None, ConnectError())
+
+    connect_failure = response(None)
+    connect_failure.error_phase = "connect"
+    assert policy.should_retry(prepared("POST"), connect_failure, None)
+    assert RetryPolicy(retry_non_idempotent=True).should_retry(prepared("POST"), response(503), None)
+
+
+def test_backoff_is_capped_and_honours_retry_after():
+    policy = RetryPolicy(backoff_base=1, backoff_cap=4)
+    assert all(0 <= policy.backoff(attempt) <= 4 for attempt in range(1, 10))
+    assert policy.backoff(1, retry_after=3) >= 3
+    assert policy.backoff(1, retry_after=60) <= 4
+    assert policy.retry_after(response(429, b"Retry-After: 7\r\n")) == 7
+
+
+def test_execute_retries_until_success():
+    policy = RetryPolicy(max_attempts=3, backoff_base=0.001)
+    answers = [response(503), response(502), response(200)]
+    result = policy.execute(lambda prepared_request: answers.pop(0), prepared())
+    assert result.status == 200
+    assert result.attempts == 3
+
+
+def test_execute_gives_up_after_max_attempts():
+    policy = RetryPolicy(max_attempts=2, backoff_base=0.001)
+    result = policy.execute(lambda prepared_request: response(503), prepared())
+    assert result.status == 503
+    assert result.attempts == 2
+
+    def refuse(prepared_request):
+        raise ConnectError("refused")
+    with pytest.raises(ConnectError):
+        policy.execute(refuse, prepared())
+
+
+def test_call_retries_then_raises_the_last_error():
+    policy = RetryPolicy(max_attempts=3, backoff_base=0.001)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError("error payload")
+        return "page"
+    assert policy.call(fetch, "page 1") == "page"
+
+    calls.clear()
+
+    def always_fails():
+        calls.append(1)
+        raise ValueError("error payload")
+    with pytest.raises(ValueError):
+        policy.call(always_fails, "page 2")
+    assert len(calls) == 3
+
+
+def test_call_stops_when_the_caller_went_away():
+    policy = RetryPolicy(max_attempts=5, backoff_base=0.001)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        raise ValueError("error payload")
+    with pytest.raises(ValueError):
+        policy.call(fetch, "page 1", should_stop=lambda: True)
+    assert len(calls) == 1
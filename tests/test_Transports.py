@@ -0,0 +1,55 @@
+import os
+from CurlScraper.CoreLibrary.PyCurlRequest import CurlRequests
+from CurlScraper.CoreLibrary.RetryPolicy import RetryPolicy
+from CurlScraper.CoreLibrary.Transports import SubprocessCurlTransport
+from tests.conftest import requires_curl
+
+
+def requester():
+    return CurlRequests({}, transport=SubprocessCurlTransport(), retry_policy=RetryPolicy(max_attempts=3, backoff_base=0.001))
+
+
+@requires_curl
+def test_download_succeeds_without_retries(local_server):
+    response = requester().send_curl_request(f"{local_server.base_url}/report.pdf", download_file=True)
+    assert response.status == 200
+    assert response.attempts == 1
+    assert local_server.hits["/report.pdf"] == 1
+    with open("report.pdf", 'rb') as downloaded_file:
+        assert downloaded_file.read() == b"file contents"
+
+
+@requires_curl
+def test_download_is_retried_on_a_throttle_status(local_server):
+    response = requester().send_curl_request(f"{local_server.base_url}/flaky.pdf", download_file=True)
+    assert response.status == 200
+    assert response.attempts == 3
+    assert os.path.exists("flaky.pdf")
+
+
+@requires_curl
+def test_batch_sends_binary_bodies_and_reports_failed_transfers(local_server):
+    curl_requests = requester()
+    # --data-binary keeps newlines, carriage returns and non-ASCII text as they are
+    body = "naïve\r\n\"quoted\"\n"
+    prepared_requests = [curl_requests.prepare_request(f"{local_server.base_url}/echo", data=body),
+                         curl_requests.prepare_request("http://127.0.0.1:1/refused"),
+                         curl_requests.prepare_request(f"{local_server.base_url}/ok")]
+    for prepared_request in prepared_requests:
+        prepared_request["connect_timeout"] = 2
+
+    echoed, refused, ok = curl_requests.transport.send_batch(prepared_requests)
+    assert bytes.fromhex(echoed["body"]) == body.encode()
+    assert refused.status is None
+    assert refused.error_phase == "connect"
+    assert ok.status == 200
+
+
+@requires_curl
+def test_batch_retries_only_the_failed_transfers(local_server):
+    curl_requests = requester()
+    responses = curl_requests.send_prepared_batch([curl_requests.prepare_request(f"{local_server.base_url}/flaky/{idx}") for idx in range(3)]
+                                                  + [curl_requests.prepare_request(f"{local_server.base_url}/ok")])
+    assert [response.status for response in responses] == [200, 200, 200, 200]
+    assert local_server.hits["/ok"] == 1
+    assert local_server.hits["/flaky/0"] == 3